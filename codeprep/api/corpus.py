@@ -15,8 +15,12 @@ from codeprep.config import CHUNKSIZE
 from codeprep.pipeline import stages
 from codeprep.pipeline.bperegistry import CustomBpeConfig, is_predefined_id
 from codeprep.pipeline.dataset import Dataset, SubDataset
+from codeprep.pipeline.numericalize import NumericalizedCorpus, numericalize, load_word_ids
+from codeprep.pipeline.packing import PackedSequences, pack
+from codeprep.pipeline.vocabgrowth import SHUFFLE_SEED
 from codeprep.pipeline.vocab import _load_vocab_dict
 from codeprep.prepconfig import PrepConfig
+from codeprep.preprocess.placeholders import placeholders
 
 logger = logging.getLogger(__name__)
 
@@ -36,12 +40,50 @@ class PreprocessedCorpus(object):
         self.get_file_iterator = lambda: prep_dataset.file_iterator()
         self.path_to_vocab = path_to_vocab
         self._path_to_corpus_size_file = prep_dataset._dataset.path_to_prep_corpus_size_file
+        self._prep_dataset = prep_dataset
 
     def load_vocab(self) -> Dict[str, int]:
+        self._check_vocab_calculated()
+        return _load_vocab_dict(self.path_to_vocab)
+
+    def _check_vocab_calculated(self) -> None:
         if not self.path_to_vocab:
             raise ValueError("Vocabulary has not been yet calculated. Set calc_vocab param to True when running preprocessing.")
 
-        return _load_vocab_dict(self.path_to_vocab)
+    def load_numericalized(self) -> NumericalizedCorpus:
+        """
+        Replaces the tokens with their ids in the vocab (unless it has been done already)
+        and returns a memory-mapped view of the token ids.
+        """
+        self._check_vocab_calculated()
+        path = self._prep_dataset.dataset.path_to_numericalized_corpus
+        numericalize(self._prep_dataset, self._prep_dataset.dataset.word_boundaries, self.path_to_vocab, path)
+        return NumericalizedCorpus(path)
+
+    def export_sequences(self, output_path: str, seq_len: int, stride: Optional[int] = None,
+                         separator: Optional[str] = placeholders['ect'], n_shards: Optional[int] = None,
+                         seed: int = SHUFFLE_SEED) -> PackedSequences:
+        """
+        Packs the token ids of the corpus into fixed-length sequences for language model training.
+
+        :param output_path: dir where the sequences are written as `.npy` matrices of shape (n, `seq_len`)
+        :param stride: the number of tokens between the starts of consecutive sequences, by default `seq_len`
+        :param separator: token inserted between the files (unless a file already ends with it), None for no separator
+        :param n_shards: the number of shards packed in parallel, by default the number of cpus
+        :param seed: the files are taken in an order shuffled with this seed
+
+        :return: memory-mapped view of the sequences
+        """
+        numericalized = self.load_numericalized()
+        if separator is not None:
+            word_ids = load_word_ids(self.path_to_vocab)
+            if separator not in word_ids:
+                raise ValueError(f'Separator {separator} is not in the vocabulary')
+            separator_id = word_ids[separator]
+        else:
+            separator_id = None
+        pack(numericalized.path, output_path, seq_len, stride, separator_id, n_shards, seed)
+        return PackedSequences(output_path)
 
     def get_corpus_size(self) -> int:
         if not os.path.exists(self._path_to_corpus_size_file):
@@ -52,7 +94,7 @@ class PreprocessedCorpus(object):
             return int(f.read())
 
     def _calc_corpus_size(self):
-        files_total = len([f for f in self.get_file_iterator()])
+        files_total = self._prep_dataset.count_files()
         total_words = 0
 
         def param_gen():
@@ -0,0 +1,32 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from typing import List, Optional
+
+from codeprep.pipeline import vocabalgebra
+
+
+def merge(vocab_paths: List[str], output_path: str) -> None:
+    """
+    Merge vocab files, e.g. of two preprocessed datasets, summing up the counts of the words.
+
+    :param vocab_paths: paths to vocab files as calculated with `calc_vocab=True`
+    :param output_path: path the merged vocab is to be written to
+    """
+    vocabalgebra.merge(vocab_paths, output_path)
+
+
+def subtract(vocab_path: str, subtracted_vocab_paths: List[str], output_path: str) -> None:
+    """
+    Subtract the counts of the words of `subtracted_vocab_paths` from the vocab at `vocab_path`,
+    e.g. when projects are removed from a dataset. Words whose counts drop to zero are removed.
+    """
+    vocabalgebra.subtract(vocab_path, subtracted_vocab_paths, output_path)
+
+
+def prune(vocab_path: str, output_path: str, top_k: Optional[int] = None, min_count: Optional[int] = None) -> None:
+    """
+    Leave only the `top_k` most frequent words and/or the words occurring at least `min_count` times.
+    """
+    vocabalgebra.prune(vocab_path, output_path, top_k, min_count)
@@ -4,12 +4,17 @@
 
 import collections
 import logging
+import random
+import time
 
 import regex
 from tqdm import tqdm
-from typing import Dict, List, Tuple, Set
+from typing import Dict, List, Tuple, Set, Optional
 
+from codeprep.bpepkg.bpe_encode import encode
+from codeprep.bpepkg.checkpoint import BpeCheckpointer
 from codeprep.bpepkg.merge import Merge, MergeList
+from codeprep.bpepkg.performance_stats import BpePerformanceStatsCollector, BpePerformanceStatsEntry
 from codeprep.util import PriorityCounter
 
 logger = logging.getLogger(__name__)
@@ -36,15 +41,28 @@ def merge_vocab(pair: Tuple[str, str], input_vocab: Dict[str, int]) -> Tuple[Dic
     >>> new_pairs
     [(('wo', 'r'), 7), (('o', 'r'), -7), (('wo', 'g'), 13), (('o', 'g'), -13)]
     """
+    output_vocab, added_pairs, _, _ = _merge_vocab(pair, input_vocab)
+    return output_vocab, added_pairs
+
+
+def _merge_vocab(pair: Tuple[str, str], input_vocab: Dict[str, int]) -> Tuple[Dict[str, int], List, int, int]:
+    """
+    :return: same as `merge_vocab` and additionally the number of words the merge was applied to
+    and the number of occurrences of the pair merged (weighted by word frequencies)
+    """
     output_vocab = {}
     concat_pair_with_space = ' '.join(pair)
     concat_pair_with_space_escaped = regex.escape(concat_pair_with_space)
     concat_pair = ''.join(pair)
     reg = regex.compile('(^|[^ ]+ )(' + concat_pair_with_space_escaped + ')( [^ ]+|$)')
     added_pairs = []
+    n_words_touched = 0
+    n_merged = 0
     for word in input_vocab:
         word_occurences = input_vocab[word]
         match = reg.search(word)
+        if match:
+            n_words_touched += 1
         while match:
             # word changed
             if match.group(1) != '':
@@ -60,19 +78,66 @@ def merge_vocab(pair: Tuple[str, str], input_vocab: Dict[str, int]) -> Tuple[Dic
             start, end = match.span(2)
             replacement = concat_pair
             word = word[:start] + replacement + word[end:]
+            n_merged += word_occurences
             match = reg.search(word)
         output_vocab[word] = word_occurences
-    return output_vocab, added_pairs
+    return output_vocab, added_pairs, n_words_touched, n_merged
+
+
+class ResultingVocabSize(object):
+    """
+    The size of the resulting vocab (see `create_resulting_vocab`) kept up to date after each merge
+    without going through the whole split vocab.
+
+    >>> vocab_size = ResultingVocabSize({'a b @': 2, 'b @': 1})
+    >>> vocab_size.size
+    3
+    >>> vocab_size.merge(('a', 'b'), 2)
+    >>> vocab_size.size
+    3
+    >>> vocab_size.merge(('ab', '@'), 2)
+    >>> vocab_size.size
+    3
+    >>> vocab_size.merge(('b', '@'), 1)
+    >>> vocab_size.size
+    2
+    """
+    def __init__(self, split_base_vocab: Dict[str, int]):
+        self.subword_freqs = create_resulting_vocab(split_base_vocab)
+        self.size = len(self.subword_freqs)
+
+    def _add(self, subword: str, freq: int) -> None:
+        old_freq = self.subword_freqs.get(subword, 0)
+        new_freq = old_freq + freq
+        if new_freq:
+            self.subword_freqs[subword] = new_freq
+        else:
+            del self.subword_freqs[subword]
+        self.size += bool(new_freq) - bool(old_freq)
+
+    def merge(self, pair: Tuple[str, str], n_merged: int) -> None:
+        """
+        :param n_merged: the number of occurrences of the pair merged
+        """
+        self._add(pair[0], -n_merged)
+        self._add(pair[1], -n_merged)
+        self._add(''.join(pair), n_merged)
 
 
-def do_merges(vocab: Dict[str, int], n_merges: int) -> Tuple[Dict[str, int], MergeList]:
+def do_merges(vocab: Dict[str, int], n_merges: int,
+              checkpointer: Optional[BpeCheckpointer] = None,
+              snapshot_writer=None,
+              stats_collector: Optional[BpePerformanceStatsCollector] = None) -> Tuple[Dict[str, int], MergeList]:
     """
     Do `n_merges` bpe merges starting from vocabulary splittings `vocab` which were formed after applying `already_done_merges` merges
 
     :param vocab: base vocab splittings formed after applying `already_done_merges` in a format
     {"fix me@": 3242, "a b c@": 400}
     :param n_merges: number of bpe merges to be applied
-    :param already_done_merges: merges which has already been applied in a format ["e @, f i", "fi x", "m e@"]
+    :param checkpointer: if passed, the merges done and the current vocab splittings are saved whenever a checkpoint is due
+    :param snapshot_writer: if passed, the merges done and the current vocab splittings are passed to it
+    after each number of merges it is interested in. Same interface as `checkpointer`: `is_due()` and `save()`
+    :param stats_collector: if passed, performance stats are added to it whenever they are due
 
     :return: a tuple where the first elements is the resulting vocab splittings,
     the second one are all the merges done to reach those vocab splittings
@@ -103,17 +168,153 @@ def do_merges(vocab: Dict[str, int], n_merges: int) -> Tuple[Dict[str, int], Mer
     """
     merges = MergeList()
     pairs = get_stats(vocab)
+    if stats_collector:
+        vocab_size = ResultingVocabSize(vocab)
+        stats_collector.add(BpePerformanceStatsEntry(
+            merges_done=0, time_for_last_merge=0, n_priority_queue_entries=len(pairs.pq),
+            n_live_priority_queue_entries=len(pairs), vocab_size=vocab_size.size
+        ))
     for i in tqdm(range(n_merges), total=n_merges):
+        merge_start = time.time()
         try:
             best, occurences = pairs.pop_pair()
             merges.append(Merge(best, freq=occurences, priority=i))
         except KeyError:
             break
-        vocab, added_pairs = merge_vocab(best, vocab)
+        vocab, added_pairs, n_words_touched, n_merged = _merge_vocab(best, vocab)
         for p in added_pairs:
             pairs.add(*p)
+        if stats_collector:
+            vocab_size.merge(best, n_merged)
+            if stats_collector.is_due(i + 1):
+                stats_collector.add(BpePerformanceStatsEntry(
+                    merges_done=i + 1, time_for_last_merge=time.time() - merge_start,
+                    n_priority_queue_entries=len(pairs.pq), n_live_priority_queue_entries=len(pairs),
+                    n_words_touched=n_words_touched, vocab_size=vocab_size.size
+                ))
+        if checkpointer and checkpointer.is_due(i + 1):
+            checkpointer.save(vocab, merges)
+        if snapshot_writer and snapshot_writer.is_due(i + 1):
+            snapshot_writer.save(vocab, merges)
     return vocab, merges
 
+# ======== Learning on a sample of the vocab.
+
+
+DEFAULT_SAMPLING_SEED = 13
+HOLDOUT_SEED = 31
+DEFAULT_HOLDOUT_RATE = 0.01
+TOP_K_TO_REPORT = [10, 100, 1000, 10000]
+
+
+def sample_vocab(split_base_vocab: Dict[str, int], sample_rate: float,
+                 seed: int = DEFAULT_SAMPLING_SEED) -> Dict[str, int]:
+    """
+    Words are grouped by the binary logarithm of their frequencies, `sample_rate` of the words of each group
+    (but at least one) are sampled. The frequencies of sampled words are rescaled so that the total frequency
+    of each group is preserved.
+
+    >>> vocab = {'a b @': 1, 'b c @': 1, 'c d @': 1, 'd e @': 1, 'e @': 9, 'f @': 8}
+    >>> sample_vocab(vocab, 0.5)
+    {'b c @': 2, 'c d @': 2, 'e @': 17}
+    """
+    strata = collections.defaultdict(list)
+    for word, freq in split_base_vocab.items():
+        strata[freq.bit_length()].append(word)
+
+    rnd = random.Random(seed)
+    rescaled_freqs = {}
+    for _, words in sorted(strata.items()):
+        sampled_words = rnd.sample(words, max(1, round(len(words) * sample_rate)))
+        total_freq = sum(split_base_vocab[w] for w in words)
+        sampled_freq = sum(split_base_vocab[w] for w in sampled_words)
+        for word in sampled_words:
+            rescaled_freqs[word] = max(1, round(split_base_vocab[word] * total_freq / sampled_freq))
+    return {word: rescaled_freqs[word] for word in split_base_vocab if word in rescaled_freqs}
+
+
+def get_top_k_merge_overlap(merges: MergeList, other_merges: MergeList, k: int) -> float:
+    """
+    >>> merges = MergeList().append(Merge(('a', 'b'))).append(Merge(('c', 'd'))).append(Merge(('ab', 'cd')))
+    >>> other_merges = MergeList().append(Merge(('c', 'd'))).append(Merge(('a', 'b'))).append(Merge(('e', 'f')))
+    >>> get_top_k_merge_overlap(merges, other_merges, 2)
+    1.0
+    >>> get_top_k_merge_overlap(merges, other_merges, 3)
+    0.6666666666666666
+    """
+    top_k = {merge.pair for merge in merges[:k]}
+    other_top_k = {merge.pair for merge in other_merges[:k]}
+    return len(top_k & other_top_k) / max(len(top_k), len(other_top_k), 1)
+
+
+def get_compression_ratio(split_base_vocab: Dict[str, int], merges: MergeList) -> float:
+    """
+    The average number of characters per subword when the words are split with `merges`.
+
+    >>> merges = MergeList().append(Merge(('a', 'b')))
+    >>> get_compression_ratio({'a b @': 2, 'c @': 1}, merges)
+    1.3333333333333333
+    """
+    encoded = encode({''.join(word.split(' ')): freq for word, freq in split_base_vocab.items()}, merges)
+    n_chars = sum(len(word.split(' ')) * freq for word, freq in split_base_vocab.items())
+    n_subwords = sum(len(word.split(' ')) * freq for word, freq in encoded.items())
+    return n_chars / n_subwords if n_subwords else 0.0
+
+
+def split_holdout(split_base_vocab: Dict[str, int], holdout_rate: float = DEFAULT_HOLDOUT_RATE,
+                  seed: int = HOLDOUT_SEED) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """
+    Randomly chosen `holdout_rate` of the words are held out with their frequencies, merges are learned on the rest.
+
+    >>> split_holdout({'a @': 1, 'b @': 2, 'c @': 3, 'd @': 4}, 0.5)
+    ({'a @': 1, 'b @': 2}, {'c @': 3, 'd @': 4})
+    """
+    rnd = random.Random(seed)
+    holdout_words = set(rnd.sample(list(split_base_vocab), round(len(split_base_vocab) * holdout_rate)))
+    holdout, rest = {}, {}
+    for word, freq in split_base_vocab.items():
+        (holdout if word in holdout_words else rest)[word] = freq
+    return holdout, rest
+
+
+def get_top_k_list(n_merges: int) -> List[int]:
+    return [k for k in TOP_K_TO_REPORT if k < n_merges] + [n_merges]
+
+
+def create_sampling_report(holdout: Dict[str, int], merges: MergeList, sample_rate: float,
+                           holdout_rate: float = DEFAULT_HOLDOUT_RATE) -> Dict:
+    """
+    :param holdout: words held out from the vocab before it was sampled to learn `merges`
+
+    The report contains:
+
+    * `compression_ratio`: characters per subword on the holdout. `sampled` is the one of `merges`, i.e. on words
+      they were not learned on; `exact_on_holdout` is the one of merges learned on the holdout itself (an upper bound)
+      and `sampled_on_holdout` - of merges learned on a `sample_rate` sample of the holdout;
+    * `holdout_top_k_merge_overlap`: the share of the top-k merges learned on the holdout which are also among
+      the top-k merges learned on its `sample_rate` sample. Exact merges of the whole vocab are not known
+      without learning them, so this is an estimate of how much sampling at this rate changes the merges
+      made on a vocab of the size of the holdout, not an overlap between `merges` and the exact ones.
+    """
+    n_merges = len(merges)
+    if not holdout:
+        logger.warning('The holdout is empty, the sampling report is not meaningful')
+    _, exact_holdout_merges = do_merges(holdout, n_merges)
+    _, sampled_holdout_merges = do_merges(sample_vocab(holdout, sample_rate), n_merges)
+    return {
+        'sample_rate': sample_rate,
+        'n_merges': n_merges,
+        'holdout_rate': holdout_rate,
+        'n_holdout_words': len(holdout),
+        'holdout_top_k_merge_overlap': {k: get_top_k_merge_overlap(sampled_holdout_merges, exact_holdout_merges, k)
+                                        for k in get_top_k_list(n_merges)},
+        'compression_ratio': {
+            'exact_on_holdout': get_compression_ratio(holdout, exact_holdout_merges),
+            'sampled_on_holdout': get_compression_ratio(holdout, sampled_holdout_merges),
+            'sampled': get_compression_ratio(holdout, merges),
+        }
+    }
+
 # ======== Create auxiliary data structures.
 
 
@@ -0,0 +1,444 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Memory-bounded version of the bpe learner from `bpe_learn`:
+
+* words occurring less than `min_word_freq` times are not used to learn merges. They are kept on disk
+  and split with the learned merges at the end, so that the total number of occurrences is preserved;
+* the split base vocab is stored as flat arrays of symbol ids instead of a dict of space-separated strings;
+* only the pairs occurring at least `frontier` times are kept in the priority queue, the rest are spilled
+  into an sqlite db and loaded back lazily once the most frequent pair in memory falls below the frontier.
+
+The pairs get the same tie-breaking counters as in `bpe_learn.do_merges`, so if no words are pruned,
+the merges are exactly the same.
+
+>>> input_vocab = {"b i r d @": 3, "w o r d @": 7, "w o g @": 13}
+>>> vocab, merges = do_merges(input_vocab, 10, max_pairs_in_memory=2)
+>>> vocab
+{'bird@': 3, 'word@': 7, 'wog@': 13}
+>>> merges
+[('w', 'o'): (20, 0), ('g', '@'): (13, 1), ('wo', 'g@'): (13, 2), ('r', 'd'): (10, 3), ('rd', '@'): (10, 4), \
+('wo', 'rd@'): (7, 5), ('b', 'i'): (3, 6), ('bi', 'rd@'): (3, 7)]
+
+>>> do_merges(input_vocab, 10, min_word_freq=5)
+({'word@': 7, 'wog@': 13, 'b i rd @': 3}, [('w', 'o'): (20, 0), ('g', '@'): (13, 1), ('wo', 'g@'): (13, 2), \
+('r', 'd'): (7, 3), ('wo', 'rd'): (7, 4), ('word', '@'): (7, 5)])
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+from array import array
+from collections import Counter
+from typing import Dict, List, Tuple, Optional, Iterator, Union, Iterable
+
+from tqdm import tqdm
+
+from codeprep.bpepkg.bpe_encode import encode
+from codeprep.bpepkg.checkpoint import BpeCheckpointer
+from codeprep.bpepkg.merge import Merge, MergeList
+from codeprep.util import PriorityCounter, to_literal_str, to_non_literal_str
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_WORD_FREQ = 1
+DEFAULT_MAX_PAIRS_IN_MEMORY = 10 * 1000 * 1000
+
+PRUNED_WORDS_FILE_NAME = 'pruned_words.txt'
+PRUNED_WORDS_FILE_PREFIX = 'pruned_words.'
+SPILLED_PAIRS_FILE_NAME = 'pairs.sqlite'
+
+Pair = Tuple[int, int]
+
+
+class SplitVocabStore(object):
+    """
+    Split words encoded as sequences of symbol ids stored one after another in a flat array.
+    Words only get shorter when merges are applied, so they are rewritten in place.
+
+    >>> store = SplitVocabStore()
+    >>> store.add_word('w o r d @', 7)
+    >>> store.add_word('w o g @', 13)
+    >>> changes = store.merge_pair((store.symbol_ids['w'], store.symbol_ids['o']))
+    >>> [((store.symbols[a], store.symbols[b]), n) for (a, b), n in changes]
+    [(('wo', 'r'), 7), (('o', 'r'), -7), (('wo', 'g'), 13), (('o', 'g'), -13)]
+    >>> list(store.items())
+    [('wo r d @', 7), ('wo g @', 13)]
+    """
+    def __init__(self):
+        self.symbols: List[str] = []
+        self.symbol_ids: Dict[str, int] = {}
+        self.data = array('i')
+        self.offsets = array('q')
+        self.lengths = array('i')
+        self.counts = array('q')
+        # ids of the words each symbol can be found in; may contain ids of words which do not contain it anymore
+        self.symbol_words: Dict[int, array] = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def intern(self, symbol: str) -> int:
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_ids[symbol] = symbol_id
+            self.symbol_words[symbol_id] = array('i')
+        return symbol_id
+
+    def add_word(self, split_word: str, count: int) -> None:
+        word_id = len(self.counts)
+        symbols = [self.intern(symbol) for symbol in split_word.split(' ')]
+        self.offsets.append(len(self.data))
+        self.lengths.append(len(symbols))
+        self.counts.append(count)
+        self.data.extend(symbols)
+        for symbol in set(symbols):
+            self.symbol_words[symbol].append(word_id)
+
+    def get_word(self, word_id: int) -> List[int]:
+        offset = self.offsets[word_id]
+        return self.data[offset:offset + self.lengths[word_id]].tolist()
+
+    def _set_word(self, word_id: int, symbols: List[int]) -> None:
+        offset = self.offsets[word_id]
+        self.data[offset:offset + len(symbols)] = array('i', symbols)
+        self.lengths[word_id] = len(symbols)
+
+    def merge_pair(self, pair: Pair) -> Iterator[Tuple[Pair, int]]:
+        """
+        Applies the merge to all the words and yields the changes of pair frequencies
+        in the same order as `bpe_learn.merge_vocab` returns them.
+        """
+        left, right = pair
+        new_symbol = self.intern(self.symbols[left] + self.symbols[right])
+        indexed = left if len(self.symbol_words[left]) <= len(self.symbol_words[right]) else right
+        still_containing = array('i')
+        for word_id in sorted(set(self.symbol_words[indexed])):
+            symbols = self.get_word(word_id)
+            freq = self.counts[word_id]
+            changed = False
+            i = 0
+            while i < len(symbols) - 1:
+                if symbols[i] == left and symbols[i + 1] == right:
+                    if i > 0:
+                        before = symbols[i - 1]
+                        yield (before, new_symbol), freq
+                        if (before, left) != pair:
+                            yield (before, left), -freq
+                    if i + 2 < len(symbols):
+                        after = symbols[i + 2]
+                        yield (new_symbol, after), freq
+                        if (right, after) != pair:
+                            yield (right, after), -freq
+                    symbols[i:i + 2] = [new_symbol]
+                    changed = True
+                i += 1
+            if changed:
+                self._set_word(word_id, symbols)
+                self.symbol_words[new_symbol].append(word_id)
+            if indexed in symbols:
+                still_containing.append(word_id)
+        self.symbol_words[indexed] = still_containing
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        for word_id in range(len(self.counts)):
+            yield ' '.join(self.symbols[s] for s in self.get_word(word_id)), self.counts[word_id]
+
+    def __getstate__(self):
+        # the indices are rebuilt when unpickling to keep checkpoints compact
+        return self.symbols, self.data, self.offsets, self.lengths, self.counts
+
+    def __setstate__(self, state):
+        self.symbols, self.data, self.offsets, self.lengths, self.counts = state
+        self.symbol_ids = {symbol: symbol_id for symbol_id, symbol in enumerate(self.symbols)}
+        self.symbol_words = {symbol_id: array('i') for symbol_id in range(len(self.symbols))}
+        for word_id in range(len(self.counts)):
+            for symbol in set(self.get_word(word_id)):
+                self.symbol_words[symbol].append(word_id)
+
+
+class SpillablePairStats(object):
+    """
+    Pair frequencies. All the pairs occurring at least `frontier` times are kept in a `PriorityCounter`,
+    the others might be spilled into an sqlite db.
+
+    Every update gets the next value of `clock` as a tie-breaking counter, like `PriorityCounter` with
+    `automatic_count=True` does, so the pairs are popped in the same order as if all of them were kept in memory.
+    """
+    def __init__(self, max_pairs_in_memory: int, spill_dir: str):
+        self.max_pairs_in_memory = max_pairs_in_memory
+        self.spill_dir = spill_dir
+        self.pq = PriorityCounter({}, automatic_count=False)
+        self.frontier = 0
+        self.clock = 0
+        self.n_spilled = 0
+        self._shrink_at = max_pairs_in_memory
+        self._db: Optional[sqlite3.Connection] = None
+
+    def _get_db(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(os.path.join(self.spill_dir, SPILLED_PAIRS_FILE_NAME))
+            self._db.execute('PRAGMA journal_mode = OFF')
+            self._db.execute('PRAGMA synchronous = OFF')
+            self._db.execute('CREATE TABLE pairs (a INTEGER, b INTEGER, count INTEGER, c INTEGER, '
+                             'PRIMARY KEY (a, b)) WITHOUT ROWID')
+        return self._db
+
+    def init_from(self, store: SplitVocabStore) -> None:
+        # the position of the first occurrence is used as a counter: it preserves the order,
+        # in which pairs are added to the priority counter in `bpe_learn.get_stats`
+        counts: Dict[Pair, List[int]] = {}
+        occurrence = 0
+        for word_id in range(len(store)):
+            symbols = store.get_word(word_id)
+            freq = store.counts[word_id]
+            for pair in zip(symbols, symbols[1:]):
+                entry = counts.get(pair)
+                if entry is None:
+                    counts[pair] = [freq, occurrence]
+                else:
+                    entry[0] += freq
+                occurrence += 1
+            if len(counts) > self.max_pairs_in_memory:
+                self._spill_partial_counts(counts)
+                counts = {}
+        self.clock = occurrence
+        if self._db is None:
+            self.pq = PriorityCounter({pair: (count, c) for pair, (count, c) in counts.items()},
+                                      automatic_count=False)
+        else:
+            self._spill_partial_counts(counts)
+            self.n_spilled = self._db.execute('SELECT COUNT(*) FROM pairs').fetchone()[0]
+            self.frontier = self._get_max_spilled_count() + 1
+            self._load()
+
+    def _spill_partial_counts(self, counts: Dict[Pair, List[int]]) -> None:
+        db = self._get_db()
+        db.executemany('UPDATE pairs SET count = count + ?, c = MIN(c, ?) WHERE a = ? AND b = ?',
+                       ((count, c, a, b) for (a, b), (count, c) in counts.items()))
+        db.executemany('INSERT OR IGNORE INTO pairs VALUES (?, ?, ?, ?)',
+                       ((a, b, count, c) for (a, b), (count, c) in counts.items()))
+
+    def _get_max_spilled_count(self) -> int:
+        return self._db.execute('SELECT MAX(count) FROM pairs').fetchone()[0]
+
+    def _load(self) -> None:
+        """
+        Lowers the frontier and loads the spilled pairs above it. At least the most frequent pairs are loaded,
+        less frequent ones - as long as they fit into memory.
+        """
+        budget = max(self.max_pairs_in_memory - len(self.pq), 0)
+        threshold, n_to_load = None, 0
+        for count, n in self._db.execute('SELECT count, COUNT(*) FROM pairs GROUP BY count ORDER BY count DESC'):
+            if threshold is not None and n_to_load + n > budget:
+                break
+            threshold, n_to_load = count, n_to_load + n
+        for a, b, count, c in self._db.execute('SELECT a, b, count, c FROM pairs WHERE count >= ?', (threshold,)):
+            self.pq.add((a, b), count, c)
+        self._db.execute('DELETE FROM pairs WHERE count >= ?', (threshold,))
+        self.n_spilled -= n_to_load
+        self.frontier = threshold if self.n_spilled else 0
+        logger.debug(f'Loaded {n_to_load} pairs occurring at least {threshold} times, '
+                     f'{self.n_spilled} pairs are still on disk')
+
+    def shrink_if_needed(self) -> None:
+        """
+        If there are too many pairs in memory, raises the frontier and spills the pairs below it.
+        """
+        if len(self.pq) <= self._shrink_at:
+            return
+        entries = self.pq.entry_finder
+        histogram = Counter(-entry[0][0] for entry in entries.values())
+        threshold, n_to_keep = None, 0
+        for count in sorted(histogram, reverse=True):
+            if threshold is not None and n_to_keep + histogram[count] > self.max_pairs_in_memory // 2:
+                break
+            threshold, n_to_keep = count, n_to_keep + histogram[count]
+        frontier = max(threshold, self.frontier) if self.n_spilled else threshold
+        to_spill = [(a, b, -entry[0][0], entry[0][1]) for (a, b), entry in entries.items() if -entry[0][0] < frontier]
+        if to_spill:
+            self._get_db().executemany('INSERT INTO pairs VALUES (?, ?, ?, ?)', to_spill)
+            self.pq = PriorityCounter({pair: (-entry[0][0], entry[0][1]) for pair, entry in entries.items()
+                                       if -entry[0][0] >= frontier}, automatic_count=False)
+            self.n_spilled += len(to_spill)
+            self.frontier = frontier
+            logger.debug(f'Spilled {len(to_spill)} pairs occurring less than {frontier} times')
+        self._shrink_at = max(self.max_pairs_in_memory, 2 * len(self.pq))
+
+    def add(self, pair: Pair, to_add: int) -> None:
+        c = self.clock
+        self.clock += 1
+        if not self.n_spilled or pair in self.pq.entry_finder:
+            self.pq.add(pair, to_add, c)
+            return
+
+        row = self._db.execute('SELECT count FROM pairs WHERE a = ? AND b = ?', pair).fetchone()
+        count = to_add + (row[0] if row else 0)
+        if row is not None and (count == 0 or count >= self.frontier):
+            self._db.execute('DELETE FROM pairs WHERE a = ? AND b = ?', pair)
+            self.n_spilled -= 1
+        if count != 0 and count >= self.frontier:
+            self.pq.add(pair, count, c)
+        elif count != 0:
+            self._db.execute('INSERT OR REPLACE INTO pairs VALUES (?, ?, ?, ?)', (pair[0], pair[1], count, c))
+            if row is None:
+                self.n_spilled += 1
+
+    def pop_pair(self) -> Tuple[Pair, int]:
+        while True:
+            try:
+                _, count = self.pq.peek_pair()
+            except KeyError:
+                count = None
+            if not self.n_spilled or (count is not None and count >= self.frontier):
+                return self.pq.pop_pair()
+            self._load()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _prune_vocab(vocab: Iterable[Tuple[str, int]], min_word_freq: int, path_to_pruned_words: str) -> SplitVocabStore:
+    store = SplitVocabStore()
+    n_pruned, n_pruned_occurrences = 0, 0
+    with open(path_to_pruned_words, 'w') as f:
+        for word, freq in vocab:
+            if freq < min_word_freq:
+                f.write(f'{to_literal_str(word)}\t{freq}\n')
+                n_pruned += 1
+                n_pruned_occurrences += freq
+            else:
+                store.add_word(word, freq)
+    logger.info(f'{n_pruned} words ({n_pruned_occurrences} occurrences) occurring less than {min_word_freq} times '
+                f'are not used to learn merges, {len(store)} words are left.')
+    return store
+
+
+def _load_pruned_words(path_to_pruned_words: str) -> Dict[str, int]:
+    words = {}
+    with open(path_to_pruned_words, 'r') as f:
+        for line in f:
+            word, freq = line.rstrip('\n').split('\t')
+            words[''.join(to_non_literal_str(word).split(' '))] = int(freq)
+    return words
+
+
+def _assemble_vocab(store: SplitVocabStore, path_to_pruned_words: str, merges: MergeList) -> Dict[str, int]:
+    vocab = dict(store.items())
+    pruned_words = _load_pruned_words(path_to_pruned_words)
+    if pruned_words:
+        vocab.update(encode(pruned_words, merges))
+    return vocab
+
+
+class PrunedSplitVocab(object):
+    """
+    State of the learner saved in checkpoints: the split words merges are learned on and the file with the pruned words.
+    The pruned words are not changed by merges, so the file is written once and only referenced by the checkpoints.
+    """
+    def __init__(self, store: SplitVocabStore, path_to_pruned_words: str):
+        self.store = store
+        self.path_to_pruned_words = path_to_pruned_words
+
+    def assemble(self, merges: MergeList) -> Dict[str, int]:
+        """
+        :param merges: all the merges the words of the store have been split with
+        """
+        return _assemble_vocab(self.store, self.path_to_pruned_words, merges)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not os.path.exists(self.path_to_pruned_words):
+            raise FileNotFoundError(f'File with pruned words {self.path_to_pruned_words} is missing')
+
+
+def _create_path_to_pruned_words(spill_dir: str, checkpointer: Optional[BpeCheckpointer]) -> str:
+    if not checkpointer:
+        os.makedirs(spill_dir, exist_ok=True)
+        return os.path.join(spill_dir, PRUNED_WORDS_FILE_NAME)
+    # checkpoints refer to this file, so it is kept with them and outlives the spill dir
+    os.makedirs(checkpointer.checkpoint_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=PRUNED_WORDS_FILE_PREFIX, suffix='.txt', dir=checkpointer.checkpoint_dir)
+    os.close(fd)
+    return path
+
+
+def create_pruned_split_vocab(split_words: Iterable[Tuple[str, int]], min_word_freq: int, spill_dir: str,
+                              checkpointer: Optional[BpeCheckpointer] = None) -> PrunedSplitVocab:
+    """
+    Encodes the split words into a `SplitVocabStore` one by one, the words occurring less than `min_word_freq` times
+    are written to disk right away, so the split words can be streamed from a file without ever being all in memory.
+    The result can be passed to `do_merges` with the same `spill_dir` and `checkpointer`.
+
+    >>> spill_dir = tempfile.mkdtemp()
+    >>> vocab = create_pruned_split_vocab(iter([('w o g @', 13), ('b i r d @', 3)]), 5, spill_dir)
+    >>> list(vocab.store.items())
+    [('w o g @', 13)]
+    >>> do_merges(vocab, 10, spill_dir=spill_dir)[0]
+    {'wog@': 13, 'b i r d @': 3}
+    """
+    path_to_pruned_words = _create_path_to_pruned_words(spill_dir, checkpointer)
+    return PrunedSplitVocab(_prune_vocab(split_words, min_word_freq, path_to_pruned_words), path_to_pruned_words)
+
+
+def do_merges(vocab: Union[Dict[str, int], PrunedSplitVocab], n_merges: int,
+              min_word_freq: int = DEFAULT_MIN_WORD_FREQ,
+              max_pairs_in_memory: int = DEFAULT_MAX_PAIRS_IN_MEMORY,
+              already_done_merges: Optional[MergeList] = None,
+              checkpointer: Optional[BpeCheckpointer] = None,
+              snapshot_writer=None,
+              spill_dir: Optional[str] = None) -> Tuple[Dict[str, int], MergeList]:
+    """
+    Same as `bpe_learn.do_merges` but with bounded memory consumption.
+    Checkpoints contain `PrunedSplitVocab`, it can be passed as `vocab` to resume the learning,
+    the words pruned before are kept then regardless of `min_word_freq`. So can the one created
+    with `create_pruned_split_vocab` to avoid having all the split words in memory as a dict.
+    `snapshot_writer` also gets `PrunedSplitVocab` and has to assemble the vocab itself (see `PrunedSplitVocab.assemble`),
+    if no `checkpointer` is passed, the pruned words it refers to are removed when the learning is finished.
+
+    :param min_word_freq: words occurring less often are not used to learn merges,
+    they are split with the learned merges afterwards
+    :param max_pairs_in_memory: approximate number of pair statistics entries kept in memory
+    :param already_done_merges: merges `vocab` was formed with, needed to split the pruned words
+    :param spill_dir: directory for the pruned words and spilled pairs, a temporary one is used if not specified.
+    It is removed when the learning is finished.
+
+    :return: the resulting vocab splittings including the pruned words and the merges done
+    """
+    already_done_merges = already_done_merges or MergeList()
+    spill_dir = spill_dir or tempfile.mkdtemp()
+    os.makedirs(spill_dir, exist_ok=True)
+    pairs = SpillablePairStats(max_pairs_in_memory, spill_dir)
+    try:
+        if isinstance(vocab, PrunedSplitVocab):
+            store, path_to_pruned_words = vocab.store, vocab.path_to_pruned_words
+        else:
+            path_to_pruned_words = _create_path_to_pruned_words(spill_dir, checkpointer)
+            store = _prune_vocab(vocab.items(), min_word_freq, path_to_pruned_words)
+        del vocab
+        pairs.init_from(store)
+        merges = MergeList()
+        for i in tqdm(range(n_merges), total=n_merges):
+            try:
+                (left, right), occurences = pairs.pop_pair()
+            except KeyError:
+                break
+            merges.append(Merge((store.symbols[left], store.symbols[right]), freq=occurences, priority=i))
+            for p in store.merge_pair((left, right)):
+                pairs.add(*p)
+            pairs.shrink_if_needed()
+            if checkpointer and checkpointer.is_due(i + 1):
+                checkpointer.save(PrunedSplitVocab(store, path_to_pruned_words), merges)
+            if snapshot_writer and snapshot_writer.is_due(i + 1):
+                snapshot_writer.save(PrunedSplitVocab(store, path_to_pruned_words), merges)
+        return _assemble_vocab(store, path_to_pruned_words, already_done_merges + merges), merges
+    finally:
+        pairs.close()
+        shutil.rmtree(spill_dir, ignore_errors=True)
@@ -0,0 +1,240 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Periodic checkpoints of the state of bpe learning, so that an interrupted `learn-bpe` run can be resumed.
+
+A checkpoint contains all the merges done so far and the split base vocab formed after applying them.
+It is first written to a temporary file which is then renamed, so a checkpoint file is either complete or absent.
+
+>>> import tempfile
+>>> checkpoint_dir = tempfile.mkdtemp()
+>>> merges = MergeList().append(Merge(('a', 'b'), 5)).append(Merge(('ab', 'c'), 3))
+>>> path = dump_checkpoint(BpeCheckpoint(merges, {'abc @': 3, 'ab d @': 2}), checkpoint_dir)
+>>> os.path.basename(path)
+'2.ckpt'
+>>> checkpoint = read_checkpoint(path)
+>>> checkpoint.merges
+[('a', 'b'): (5, 0), ('ab', 'c'): (3, 1)]
+>>> checkpoint.split_base_vocab
+{'abc @': 3, 'ab d @': 2}
+"""
+import gzip
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple, Callable, IO, Union, Any
+
+from codeprep.bpepkg.merge import MergeList, Merge
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_EXT = 'ckpt'
+NOT_FINISHED_EXT = 'part'
+CHECKPOINT_FORMAT_VERSION = 1
+
+MAX_CHECKPOINTS_TO_KEEP = 2
+DEFAULT_CHECKPOINT_EVERY_N_MERGES = 1000
+DEFAULT_CHECKPOINT_EVERY_SECONDS = 600
+
+
+class InvalidCheckpointError(Exception):
+    pass
+
+
+class BpeCheckpoint(object):
+    """
+    `split_base_vocab` is a dict of split words, or a compact state of the learner
+    (e.g. `bpe_learn_bounded.PrunedSplitVocab`) for the learners which do not keep such a dict.
+    """
+    def __init__(self, merges: MergeList, split_base_vocab: Union[Dict[str, int], Any]):
+        self.merges = merges
+        self.split_base_vocab = split_base_vocab
+
+    def __len__(self):
+        return len(self.merges)
+
+
+def _merges_to_tuples(merges: MergeList) -> List[Tuple[str, str, int]]:
+    return [(merge.pair[0], merge.pair[1], merge.freq) for merge in merges]
+
+
+def _tuples_to_merges(merge_tuples: List[Tuple[str, str, int]]) -> MergeList:
+    merges = MergeList()
+    for left, right, freq in merge_tuples:
+        merges.append(Merge((left, right), freq=freq))
+    return merges
+
+
+def _get_checkpoint_path(checkpoint_dir: str, n_merges: int) -> str:
+    return os.path.join(checkpoint_dir, f'{n_merges}.{CHECKPOINT_EXT}')
+
+
+def _dump_checkpoint_payload(write_payload: Callable[[IO], None], n_merges: int, checkpoint_dir: str) -> str:
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path_to_checkpoint = _get_checkpoint_path(checkpoint_dir, n_merges)
+    not_finished_path = f'{path_to_checkpoint}.{NOT_FINISHED_EXT}'
+    with open(not_finished_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as f:
+            write_payload(f)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(not_finished_path, path_to_checkpoint)
+    return path_to_checkpoint
+
+
+def _dump_checkpoint_tuples(merge_tuples: List[Tuple[str, str, int]], split_base_vocab, checkpoint_dir: str) -> str:
+    return _dump_checkpoint_payload(
+        lambda f: pickle.dump((CHECKPOINT_FORMAT_VERSION, merge_tuples, split_base_vocab), f, pickle.HIGHEST_PROTOCOL),
+        len(merge_tuples), checkpoint_dir
+    )
+
+
+def dump_checkpoint(checkpoint: BpeCheckpoint, checkpoint_dir: str) -> str:
+    return _dump_checkpoint_tuples(_merges_to_tuples(checkpoint.merges), checkpoint.split_base_vocab, checkpoint_dir)
+
+
+def read_checkpoint(path_to_checkpoint: str) -> BpeCheckpoint:
+    try:
+        with gzip.GzipFile(path_to_checkpoint, 'rb') as f:
+            version, merge_tuples, split_base_vocab = pickle.load(f)
+    except (EOFError, OSError, zlib.error, pickle.UnpicklingError, ValueError, TypeError) as err:
+        raise InvalidCheckpointError(f'Checkpoint {path_to_checkpoint} is corrupted: {err}')
+    if version != CHECKPOINT_FORMAT_VERSION:
+        raise InvalidCheckpointError(f'Checkpoint {path_to_checkpoint} has version {version}, '
+                                     f'expected: {CHECKPOINT_FORMAT_VERSION}')
+    return BpeCheckpoint(_tuples_to_merges(merge_tuples), split_base_vocab)
+
+
+def list_checkpoints(checkpoint_dir: str) -> List[Tuple[int, str]]:
+    """
+    :return: pairs (number of merges, path to the checkpoint) sorted by the number of merges, the biggest first
+    """
+    if not os.path.exists(checkpoint_dir):
+        return []
+
+    checkpoints = []
+    for file in os.listdir(checkpoint_dir):
+        name, ext = os.path.splitext(file)
+        if ext == f'.{CHECKPOINT_EXT}' and name.isdigit():
+            checkpoints.append((int(name), os.path.join(checkpoint_dir, file)))
+    return sorted(checkpoints, reverse=True)
+
+
+def find_latest_checkpoint(checkpoint_dir: str, max_merges: int) -> Optional[BpeCheckpoint]:
+    for n_merges, path_to_checkpoint in list_checkpoints(checkpoint_dir):
+        if n_merges > max_merges:
+            continue
+        try:
+            return read_checkpoint(path_to_checkpoint)
+        except InvalidCheckpointError as err:
+            logger.warning(f'{err}. Trying an older one ...')
+    return None
+
+
+def remove_checkpoints(checkpoint_dir: str, up_to_merges: int) -> None:
+    """
+    If no checkpoints are left, the dir is removed together with the files checkpoints might refer to.
+    """
+    for n_merges, path_to_checkpoint in list_checkpoints(checkpoint_dir):
+        if n_merges <= up_to_merges:
+            os.remove(path_to_checkpoint)
+    if os.path.exists(checkpoint_dir) and not list_checkpoints(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+
+
+def _get_fork_context() -> Optional[multiprocessing.context.BaseContext]:
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+
+def _remove_old_checkpoints(checkpoint_dir: str) -> None:
+    for _, old_checkpoint in list_checkpoints(checkpoint_dir)[MAX_CHECKPOINTS_TO_KEEP:]:
+        os.remove(old_checkpoint)
+
+
+def _write_checkpoint(merge_tuples: List[Tuple[str, str, int]], split_base_vocab, checkpoint_dir: str) -> None:
+    start = time.time()
+    path_to_checkpoint = _dump_checkpoint_tuples(merge_tuples, split_base_vocab, checkpoint_dir)
+    _remove_old_checkpoints(checkpoint_dir)
+    logger.debug(f'Checkpoint {path_to_checkpoint} is written in {time.time() - start:.2f} s')
+
+
+def _write_pickled_checkpoint(payload: bytes, n_merges: int, checkpoint_dir: str) -> None:
+    start = time.time()
+    # zlib releases the GIL while compressing, so this does not block the merge loop
+    path_to_checkpoint = _dump_checkpoint_payload(lambda f: f.write(payload), n_merges, checkpoint_dir)
+    _remove_old_checkpoints(checkpoint_dir)
+    logger.debug(f'Checkpoint {path_to_checkpoint} is written in {time.time() - start:.2f} s')
+
+
+class BpeCheckpointer(object):
+    """
+    Decides when the next checkpoint is due and writes it in the background.
+
+    Where `fork` is available, the checkpoint is serialized and written by a forked process, which gets
+    a copy-on-write snapshot of the learner's memory: the merge loop only pauses for the `fork()` itself
+    (milliseconds even for a vocab of several GB) and the state passed to `save` can be modified right after.
+    Elsewhere the state is pickled in the calling thread, which pauses the merge loop for the time of `pickle.dumps`,
+    and is compressed and written in a background thread. The total pause is logged when the learning is finished.
+    """
+    def __init__(self, checkpoint_dir: str, already_done_merges: MergeList,
+                 every_n_merges: int = DEFAULT_CHECKPOINT_EVERY_N_MERGES,
+                 every_seconds: float = DEFAULT_CHECKPOINT_EVERY_SECONDS):
+        self.checkpoint_dir = checkpoint_dir
+        self.every_n_merges = every_n_merges
+        self.every_seconds = every_seconds
+        self.pause_seconds = 0.0
+        self._already_done_merge_tuples = _merges_to_tuples(already_done_merges)
+        self._last_checkpoint_merges = 0
+        self._last_checkpoint_time = time.time()
+        self._fork_context = _get_fork_context()
+        self._writer = None
+
+    def _check_last_writer(self) -> None:
+        if isinstance(self._writer, multiprocessing.process.BaseProcess) and self._writer.exitcode:
+            logger.warning(f'Writing the checkpoint failed with the exit code {self._writer.exitcode}')
+
+    def is_due(self, merges_done: int) -> bool:
+        if self._writer is not None and self._writer.is_alive():
+            return False
+        if self.every_n_merges and merges_done - self._last_checkpoint_merges >= self.every_n_merges:
+            return True
+        return bool(self.every_seconds) and time.time() - self._last_checkpoint_time >= self.every_seconds
+
+    def save(self, split_base_vocab, merges: MergeList) -> None:
+        """
+        :param split_base_vocab: the split base vocab or any other picklable state of the learner
+        """
+        start = time.perf_counter()
+        self._check_last_writer()
+        merge_tuples = self._already_done_merge_tuples + _merges_to_tuples(merges)
+        self._last_checkpoint_merges = len(merges)
+        if self._fork_context:
+            self._writer = self._fork_context.Process(target=_write_checkpoint,
+                                                      args=(merge_tuples, split_base_vocab, self.checkpoint_dir),
+                                                      daemon=True)
+        else:
+            payload = pickle.dumps((CHECKPOINT_FORMAT_VERSION, merge_tuples, split_base_vocab),
+                                   pickle.HIGHEST_PROTOCOL)
+            self._writer = threading.Thread(target=_write_pickled_checkpoint,
+                                            args=(payload, len(merge_tuples), self.checkpoint_dir), daemon=True)
+        self._writer.start()
+        self._last_checkpoint_time = time.time()
+        pause = time.perf_counter() - start
+        self.pause_seconds += pause
+        logger.debug(f'Merging paused for {pause:.3f} s to start writing a checkpoint')
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.join()
+            self._check_last_writer()
+        logger.info(f'Merging was paused for {self.pause_seconds:.2f} s in total to write checkpoints')
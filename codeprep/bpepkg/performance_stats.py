@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Performance statistics recorded by bpe learners while doing merges.
+
+>>> import tempfile
+>>> stats_collector = BpePerformanceStatsCollector(every_n_merges=2, already_done_merges=10)
+>>> stats_collector.is_due(1), stats_collector.is_due(3), stats_collector.is_due(4)
+(True, False, True)
+>>> stats_collector.add(BpePerformanceStatsEntry(merges_done=4, time_for_last_merge=0.5, n_priority_queue_entries=7,
+...                                              n_live_priority_queue_entries=5, n_words_touched=3, vocab_size=20))
+>>> path = os.path.join(tempfile.mkdtemp(), 'stats.csv')
+>>> dump_performance_stats(stats_collector.entries, path)
+>>> with open(path) as f:
+...     print(f.read().rstrip())
+merges_done,time_for_last_merge,n_priority_queue_entries,n_index_entries,location_index_obj_size,\
+neighbour_index_obj_size,priority_counter_obj_size,n_live_priority_queue_entries,n_words_touched,vocab_size,\
+n_positions,n_neighbour_links,traced_memory_size,traced_memory_peak
+14,0.5,7,,,,,5,3,20,,,,
+"""
+import csv
+import json
+import logging
+import os
+from typing import Optional, List
+
+logger = logging.getLogger(__name__)
+
+CSV_EXT = '.csv'
+STATS_FORMATS = ['json', 'csv']
+
+
+class BpePerformanceStatsEntry(object):
+    def __init__(self, merges_done: int, time_for_last_merge: float,
+                 n_priority_queue_entries: int,
+                 n_index_enties: Optional[int] = None,
+                 location_index_obj_size: Optional[float] = None,
+                 neighbour_index_obj_size: Optional[float] = None,
+                 priority_counter_obj_size: Optional[float] = None,
+                 n_live_priority_queue_entries: Optional[int] = None,
+                 n_words_touched: Optional[int] = None,
+                 vocab_size: Optional[int] = None,
+                 n_positions: Optional[int] = None,
+                 n_neighbour_links: Optional[int] = None,
+                 traced_memory_size: Optional[float] = None,
+                 traced_memory_peak: Optional[float] = None
+                 ):
+        self.merges_done = merges_done
+        self.time_for_last_merge = time_for_last_merge
+        self.n_priority_queue_entries = n_priority_queue_entries
+        self.n_index_entries = n_index_enties
+        self.location_index_obj_size = location_index_obj_size
+        self.neighbour_index_obj_size = neighbour_index_obj_size
+        self.priority_counter_obj_size = priority_counter_obj_size
+        self.n_live_priority_queue_entries = n_live_priority_queue_entries
+        self.n_words_touched = n_words_touched
+        self.vocab_size = vocab_size
+        self.n_positions = n_positions
+        self.n_neighbour_links = n_neighbour_links
+        self.traced_memory_size = traced_memory_size
+        self.traced_memory_peak = traced_memory_peak
+
+
+class BpePerformanceStatsCollector(object):
+    """
+    Decides after which merges the stats are recorded: after the first one and then every `every_n_merges`.
+    Merges already done before the learning was started are added to `merges_done` of the recorded entries.
+    """
+    def __init__(self, every_n_merges: int, already_done_merges: int = 0):
+        self.every_n_merges = every_n_merges
+        self.already_done_merges = already_done_merges
+        self.entries: List[BpePerformanceStatsEntry] = []
+
+    def is_due(self, merges_done: int) -> bool:
+        return merges_done == 1 or merges_done % self.every_n_merges == 0
+
+    def add(self, entry: BpePerformanceStatsEntry) -> None:
+        entry.merges_done += self.already_done_merges
+        logger.debug(f'After merge {entry.merges_done}: {vars(entry)}')
+        self.entries.append(entry)
+
+
+def dump_performance_stats(entries: List[BpePerformanceStatsEntry], path: str) -> None:
+    """
+    Writes the stats as a csv file if `path` has a .csv extension, otherwise as json.
+    """
+    rows = [vars(entry) for entry in entries]
+    with open(path, 'w', newline='') as f:
+        if os.path.splitext(path)[1] == CSV_EXT:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, f, indent=2)
@@ -6,458 +6,721 @@ import logging
 import os
 import sys
 from collections import defaultdict
-from enum import Enum, auto
+from contextlib import contextmanager
+from enum import IntEnum
 
 import time
-from typing import List, Dict, Tuple, Set, Generator, Optional
+import tracemalloc
+from typing import List, Dict, Tuple, Set, Generator, Optional, Iterable, Union
 
-from codeprep.util import PriorityCounter, getsize
+import numpy as np
+
+from codeprep.bpepkg.performance_stats import BpePerformanceStatsEntry
+from codeprep.util import PriorityCounter
 
 logger = logging.getLogger(__name__)
 
-__version__ = '0.2'
+__version__ = '0.5'
+
+BLOCK_SIZE = 1 << 20
+FILE_SEPARATOR = "\n" * 3
+
+DEFAULT_MEMORY_BUDGET_MB = 3072
 
+# approximate memory taken by a single element of the indices, measured with tracemalloc on cpython 3.7
+LOCATION_INDEX_ENTRY_BYTES = 200
+POSITION_BYTES = 8
+NEIGHBOUR_INDEX_ENTRY_BYTES = 500
+NEIGHBOUR_LINK_BYTES = 48
+PRIORITY_QUEUE_ENTRY_BYTES = 250
 
-class BpePerformanceStatsEntry(object):
-    def __init__(self, merges_done: int, time_for_last_merge: float,
-                 n_priority_queue_entries: int,
-                 n_index_enties: int,
-                 location_index_obj_size: float,
-                 neighbour_index_obj_size: float,
-                 priority_counter_obj_size: float
-                 ):
-        self.merges_done = merges_done
-        self.time_for_last_merge = time_for_last_merge
-        self.n_priority_queue_entries = n_priority_queue_entries
-        self.n_index_entries = n_index_enties
-        self.location_index_obj_size = location_index_obj_size
-        self.neighbour_index_obj_size = neighbour_index_obj_size
-        self.priority_counter_obj_size = priority_counter_obj_size
+# a pair of symbol ids
+Pair = Tuple[int, int]
 
 
-class Side(Enum):
-    RIGHT = auto()
-    LEFT = auto()
+class Side(IntEnum):
+    # int values are used to index the sets of neighbours of a pair
+    RIGHT = 1
+    LEFT = 0
 
     @staticmethod
     def any():
         return Side.LEFT
 
     def opposite(self):
-        if self.value == Side.LEFT.value:
-            return Side.RIGHT
-        elif self.value == Side.RIGHT.value:
-            return Side.LEFT
+        return _OPPOSITE_SIDES[self]
+
+
+_OPPOSITE_SIDES = (Side.RIGHT, Side.LEFT)
+
 
+class SymbolTable(object):
+    """
+    Symbols are interned, so that pairs can be represented as tuples of ints.
+    Strings are materialized only when the merges are yielded.
 
-def get_char_iterator_for_file(path_to_file: str):
+    >>> symbols = SymbolTable()
+    >>> a, bc = symbols.intern('a'), symbols.intern('bc')
+    >>> symbols.merge((a, bc)) == symbols.intern('abc')
+    True
+    >>> symbols.to_str((bc, a))
+    'bc a'
+    """
+    def __init__(self):
+        self.symbols: List[str] = []
+        self.lengths: List[int] = []
+        self.ids: Dict[str, int] = {}
+        self._merged: Dict[Pair, int] = {}
+
+    def intern(self, symbol: str) -> int:
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.lengths.append(len(symbol))
+            self.ids[symbol] = symbol_id
+        return symbol_id
+
+    def merge(self, pair: Pair) -> int:
+        merged = self._merged.get(pair)
+        if merged is None:
+            merged = self.intern(self.symbols[pair[0]] + self.symbols[pair[1]])
+            self._merged[pair] = merged
+        return merged
+
+    def to_str(self, pair: Pair) -> str:
+        return f'{self.symbols[pair[0]]} {self.symbols[pair[1]]}'
+
+
+def get_char_iterator_for_file(path_to_file: str) -> Generator[str, None, None]:
+    for block in get_block_iterator_for_file(path_to_file):
+        yield from block
+
+
+def get_block_iterator_for_file(path_to_file: Union[str, bytes],
+                                block_size: int = BLOCK_SIZE) -> Generator[str, None, None]:
     try:
-        yield from get_char_iterator_for_file_with_encoding(path_to_file, 'utf-8')
+        yield from get_block_iterator_for_file_with_encoding(path_to_file, 'utf-8', block_size)
     except UnicodeDecodeError:
-        yield from get_char_iterator_for_file_with_encoding(path_to_file, 'ISO-8859-1')
+        yield from get_block_iterator_for_file_with_encoding(path_to_file, 'ISO-8859-1', block_size)
 
 
 def escape_char(char: str):
     return '\xA0' if str(char) in [' '] else str(char)
 
 
+def escape_block(block: str) -> str:
+    return block.replace(' ', '\xA0')
+
+
 def get_char_iterator_for_file_with_encoding(path_to_file: str, encoding: str) -> Generator[str, None, None]:
+    for block in get_block_iterator_for_file_with_encoding(path_to_file, encoding):
+        yield from block
+
+
+def get_block_iterator_for_file_with_encoding(path_to_file: Union[str, bytes], encoding: str,
+                                              block_size: int = BLOCK_SIZE) -> Generator[str, None, None]:
     with open(path_to_file, encoding=encoding) as f:
         while True:
-            char = f.read(1)
-            if char:
-                escaped_char = escape_char(char)
-                yield escaped_char
+            block = f.read(block_size)
+            if block:
+                yield escape_block(block)
             else:
                 return
 
 
 def get_char_iterator_for_dir(path_to_dir: str) -> Generator[str, None, None]:
-    for root, dirs, files in os.walk(path_to_dir):
-        for file in files:
-            if file.endswith('.py'):
-                yield from get_char_iterator_for_file(os.path.join(root, file))
-                for i in range(3):
-                    yield str("\n")
+    for block in get_block_iterator_for_dir(path_to_dir):
+        yield from block
+
+
+def get_block_iterator_for_dir(path_to_dir: str, block_size: int = BLOCK_SIZE) -> Generator[str, None, None]:
+    paths = (os.path.join(root, file) for root, dirs, files in os.walk(path_to_dir)
+             for file in files if file.endswith('.py'))
+    yield from get_block_iterator_for_files(paths, block_size)
 
 
-def swap_pair(pair: str) -> str:
-    pair_split = pair.split(" ")
-    return " ".join([pair_split[1], pair_split[0]])
+def get_block_iterator_for_files(paths: Iterable[Union[str, bytes]],
+                                 block_size: int = BLOCK_SIZE) -> Generator[str, None, None]:
+    """
+    Reads the files one after another, so that no merges are learned across file boundaries.
+    """
+    for path in paths:
+        yield from get_block_iterator_for_file(path, block_size)
+        yield FILE_SEPARATOR
 
 
-def are_symmetric(pair1: str, pair2: str):
+class IndexSizeCounter(object):
+    """
+    Keeps track of the total number of positions in the location index and of the total number of links
+    in the neighbour index. The counters are updated by the functions mutating the indices,
+    so that the memory taken by the indices can be estimated after every merge at O(1) cost.
+
+    >>> location_index, neighbour_index, _ = build_indices(["abab"])
+    >>> sizes = IndexSizeCounter.count(location_index, neighbour_index)
+    >>> sizes.n_positions, sizes.n_neighbour_links
+    (3, 4)
+    >>> sizes.location_index_size_mb(location_index)
+    0.000424
     """
-    >>> are_symmetric("abc dcba", "dcba abc")
+    def __init__(self, n_positions: int = 0, n_neighbour_links: int = 0):
+        self.n_positions = n_positions
+        self.n_neighbour_links = n_neighbour_links
+
+    @staticmethod
+    def count(location_index, neighbour_index) -> 'IndexSizeCounter':
+        return IndexSizeCounter(
+            n_positions=sum(len(positions) for positions in location_index.values()),
+            n_neighbour_links=sum(len(neighbours) for entry in neighbour_index.values() for neighbours in entry)
+        )
+
+    def set_positions(self, location_index, pair: Pair, positions: np.ndarray) -> None:
+        old_positions = location_index.get(pair)
+        if old_positions is not None:
+            self.n_positions -= len(old_positions)
+        self.n_positions += len(positions)
+        location_index[pair] = positions
+
+    def delete_positions(self, location_index, pair: Pair) -> None:
+        self.n_positions -= len(location_index.pop(pair))
+
+    def delete_neighbours(self, neighbour_index, pair: Pair) -> None:
+        self.n_neighbour_links -= sum(len(neighbours) for neighbours in neighbour_index.pop(pair))
+
+    def location_index_size_mb(self, location_index) -> float:
+        return (len(location_index) * LOCATION_INDEX_ENTRY_BYTES + self.n_positions * POSITION_BYTES) / 1e+6
+
+    def neighbour_index_size_mb(self, neighbour_index) -> float:
+        return (len(neighbour_index) * NEIGHBOUR_INDEX_ENTRY_BYTES
+                + self.n_neighbour_links * NEIGHBOUR_LINK_BYTES) / 1e+6
+
+    @staticmethod
+    def priority_counter_size_mb(priority_counter: PriorityCounter) -> float:
+        return len(priority_counter.pq) * PRIORITY_QUEUE_ENTRY_BYTES / 1e+6
+
+
+class TracemallocSampler(object):
+    """
+    Measures the memory actually allocated by the python interpreter.
+    Tracing slows down the learning considerably, therefore it is used only when requested.
+    """
+    def __init__(self):
+        self.started_here = False
+
+    def __enter__(self) -> 'TracemallocSampler':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_here = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.started_here:
+            tracemalloc.stop()
+
+    @staticmethod
+    def sample_mb() -> Tuple[float, float]:
+        """
+        :return: current and peak size of the traced memory
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        return current / 1e+6, peak / 1e+6
+
+
+def swap_pair(pair: Pair) -> Pair:
+    return pair[1], pair[0]
+
+
+def are_symmetric(pair1: Pair, pair2: Pair):
+    """
+    >>> are_symmetric(("abc", "dcba"), ("dcba", "abc"))
     True
 
-    >>> are_symmetric("abc dfe", "efd cba")
+    >>> are_symmetric(("abc", "dfe"), ("efd", "cba"))
     False
 
-    >>> are_symmetric("a c", "ac")
+    >>> are_symmetric(("a", "c"), ("a", "c"))
     False
 
     """
-    if len(pair1) != len(pair2):
-        return False
-    # TODO make it faster
-    split1 = pair1.split(" ")
-    split2 = pair2.split(" ")
-    return split1[0] == split2[1] and split1[1] == split2[0]
-
-
-def build_indices(it: Generator[str, None, None]) -> Tuple[Dict[str, List[int]], Dict[str, Dict[Side, Set[str]]]]:
-    index = defaultdict(list)
-    index_index = defaultdict(lambda: {Side.LEFT: set(), Side.RIGHT: set()})
-    first_char = next(it)
-    last_key = None
-    for i, second_char in enumerate(it):
-        key = ' '.join([first_char, second_char])
-        index[key].append(i)
-        if last_key:
-            index_index[last_key][Side.RIGHT].add(key)
-            index_index[key][Side.LEFT].add(last_key)
-        last_key = key
-        first_char = second_char
-    return index, index_index
-
-
-def merge_lists(main_list: List[int], list2: List[int], position_shift: int) -> Tuple[List[int], List[int]]:
-    list2_result = []
-    result = []
-    i = 0; j = 0
-    while i < len(main_list) and j < len(list2):
-        if main_list[i] + position_shift == list2[j]:
-            result.append(min(main_list[i], list2[j]))
-            i +=1; j+=1
-        elif main_list[i] + position_shift > list2[j]:
-            list2_result.append(list2[j])
-            j += 1
-        else:
-            i += 1
-    list2_result.extend(list2[j:])
-    return list2_result, result
+    return pair1[0] == pair2[1] and pair1[1] == pair2[0]
+
+
+def _empty_positions() -> np.ndarray:
+    return np.empty(0, dtype=np.int64)
+
+
+def _read_code_points(chunks: Iterable[str]) -> np.ndarray:
+    """
+    >>> _read_code_points(iter("ab")).tolist()
+    [97, 98]
+    """
+    arrays = []
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= BLOCK_SIZE:
+            arrays.append(np.frombuffer(''.join(buffer).encode('utf-32-le'), dtype=np.uint32))
+            buffer, buffered = [], 0
+    arrays.append(np.frombuffer(''.join(buffer).encode('utf-32-le'), dtype=np.uint32))
+    return np.concatenate(arrays)
+
+
+def _empty_neighbours() -> List[Set[Pair]]:
+    # neighbours on the left and on the right, indexed by `Side`
+    return [set(), set()]
+
+
+def build_indices(chunks: Iterable[str], symbols: Optional[SymbolTable] = None) \
+        -> Tuple[Dict[Pair, np.ndarray], Dict[Pair, List[Set[Pair]]], SymbolTable]:
+    """
+    :param chunks: the text split into chunks of arbitrary length, e.g. blocks read from a file or single chars
+    :param symbols: symbol table to intern the chars into, a new one is created if not passed
+
+    >>> location_index, neighbour_index, symbols = build_indices(["aba", "b"])
+    >>> {symbols.to_str(k): v.tolist() for k, v in location_index.items()}
+    {'a b': [0, 2], 'b a': [1]}
+    >>> ba = (symbols.ids['b'], symbols.ids['a'])
+    >>> [{symbols.to_str(p) for p in neighbour_index[ba][side]} for side in [Side.LEFT, Side.RIGHT]]
+    [{'a b'}, {'a b'}]
+    """
+    index = defaultdict(_empty_positions)
+    index_index = defaultdict(_empty_neighbours)
+    symbols = symbols or SymbolTable()
+    code_points = _read_code_points(chunks)
+    if len(code_points) < 2:
+        return index, index_index, symbols
+
+    # a pair starting at position i is encoded as a single number: (code point i) << 32 | (code point i+1)
+    pair_codes = (code_points[:-1].astype(np.uint64) << np.uint64(32)) | code_points[1:]
+    # stable sort keeps positions of each pair in ascending order
+    positions_by_pair = np.argsort(pair_codes, kind='stable')
+    sorted_pair_codes = pair_codes[positions_by_pair]
+    group_starts = np.flatnonzero(np.diff(sorted_pair_codes)) + 1
+    group_bounds = np.concatenate(([0], group_starts, [len(pair_codes)]))
+    symbol_ids = {code: symbols.intern(chr(code)) for code in np.unique(code_points).tolist()}
+    keys = [(symbol_ids[code >> 32], symbol_ids[code & 0xFFFFFFFF])
+            for code in sorted_pair_codes[group_bounds[:-1]].tolist()]
+    for key, positions in zip(keys, np.split(positions_by_pair, group_starts)):
+        index[key] = positions
+
+    pair_ids = np.empty(len(pair_codes), dtype=np.int64)
+    pair_ids[positions_by_pair] = np.repeat(np.arange(len(keys)), np.diff(group_bounds))
+    neighbours = np.unique(pair_ids[:-1] * len(keys) + pair_ids[1:])
+    for left_id, right_id in zip((neighbours // len(keys)).tolist(), (neighbours % len(keys)).tolist()):
+        index_index[keys[left_id]][Side.RIGHT].add(keys[right_id])
+        index_index[keys[right_id]][Side.LEFT].add(keys[left_id])
+    return index, index_index, symbols
+
+
+def _is_in_sorted(values: np.ndarray, sorted_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: a mask of `values` found in `sorted_array` and the indices in `sorted_array` they would be inserted at
+    """
+    indices = np.searchsorted(sorted_array, values)
+    if not len(sorted_array):
+        return np.zeros(len(values), dtype=bool), indices
+    found = sorted_array[np.minimum(indices, len(sorted_array) - 1)] == values
+    return found, indices
+
+
+def merge_lists(main_list: np.ndarray, list2: np.ndarray, position_shift: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    >>> list2_result, result = merge_lists([0, 5, 9], [2, 7, 11, 13], 2)
+    >>> list2_result.tolist(), result.tolist()
+    ([13], [0, 5, 9])
+    """
+    main_list = np.asarray(main_list, dtype=np.int64)
+    list2 = np.asarray(list2, dtype=np.int64)
+    merged, _ = _is_in_sorted(list2, main_list + position_shift)
+    merged_positions = list2[merged]
+    return list2[~merged], np.minimum(merged_positions - position_shift, merged_positions)
+
+
+def _first_of_merged_pairs(main_list: np.ndarray, position_shift: int) -> np.ndarray:
+    """
+    A mask of elements of `main_list` followed by the element `position_shift` apart,
+    chosen greedily from left to right so that chosen pairs do not overlap.
+    """
+    linked = main_list[:-1] + position_shift == main_list[1:]
+    indices = np.arange(len(linked))
+    chain_starts = linked & ~np.concatenate(([False], linked[:-1]))
+    chain_start_indices = np.maximum.accumulate(np.where(chain_starts, indices, 0)) if len(linked) else indices
+    return linked & ((indices - chain_start_indices) % 2 == 0)
 
 
 def self_merge(main_list, position_shift):
-    result = []
-    i = 0
-    while i < len(main_list)-1:
-        if main_list[i] + position_shift == main_list[i+1]:
-            result.append(main_list[i])
-            i += 2
-        else:
-            i += 1
-    return [], result
+    main_list = np.asarray(main_list, dtype=np.int64)
+    if len(main_list) < 2:
+        return _empty_positions(), _empty_positions()
+    return _empty_positions(), main_list[:-1][_first_of_merged_pairs(main_list, position_shift)]
 
 
-def merge_lists_both(main_list: List[int], list2: List[int], position_shift: Tuple[int, int]) -> Tuple[List[int], List[int]]:
+def merge_lists_both(main_list: np.ndarray, list2: np.ndarray, position_shift: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
     """
-    >>> merge_lists_both([0, 5, 7, 11, 16], [1, 9, 15], (2, -2))
+    >>> list2_result, result = merge_lists_both([0, 5, 7, 11, 16], [1, 9, 15], (2, -2))
+    >>> list2_result.tolist(), result.tolist()
     ([1, 15], [7])
 
-    >>> merge_lists_both([2, 7, 10, 12, 15], [1, 3, 6, 11], (1, -1))
+    >>> list2_result, result = merge_lists_both([2, 7, 10, 12, 15], [1, 3, 6, 11], (1, -1))
+    >>> list2_result.tolist(), result.tolist()
     ([1, 3, 6], [10])
 
-    >>> merge_lists_both([0, 2, 4], [1, 3], (1, -1))
+    >>> list2_result, result = merge_lists_both([0, 2, 4], [1, 3], (1, -1))
+    >>> list2_result.tolist(), result.tolist()
     ([], [0, 2])
     """
     # position shift should be one positive and one negative number
     if not (position_shift[0] >0 and position_shift[1] < 0):
         raise AssertionError()
 
-    if main_list == list2:
+    main_list = np.asarray(main_list, dtype=np.int64)
+    list2 = np.asarray(list2, dtype=np.int64)
+    if np.array_equal(main_list, list2):
         raise AssertionError("")
 
-    list2_result = []
-    result = []
-    i = 0; j = 0
-    while i < len(main_list)-1 and j < len(list2):
-        if main_list[i] + position_shift[0] == list2[j]:
-            if main_list[i+1] + position_shift[1] == list2[j]:
-                result.append(main_list[i])
-            else:
-                list2_result.append(list2[j])
-            i +=1; j+=1
-        elif main_list[i] + position_shift[0] > list2[j]:
-            list2_result.append(list2[j])
-            j += 1
-        else:
-            i += 1
-    list2_result.extend(list2[j:])
-    return list2_result, result
-
-
-def is_left(main_pair: str, pair2: str):
-    right = (pair2.split(" ")[0] == main_pair.split(" ")[1])
+    if len(main_list) < 2:
+        return list2, _empty_positions()
+    # the last element of the main list is never merged with the element after it
+    matched, main_indices = _is_in_sorted(list2, main_list[:-1] + position_shift[0])
+    main_indices = main_indices[matched]
+    merged_with_both = main_list[main_indices + 1] + position_shift[1] == list2[matched]
+    list2_left = np.ones(len(list2), dtype=bool)
+    list2_left[np.flatnonzero(matched)[merged_with_both]] = False
+    return list2[list2_left], main_list[main_indices[merged_with_both]]
+
+
+def is_left(main_pair: Pair, pair2: Pair):
+    right = (pair2[0] == main_pair[1])
     return not right
 
 
-def merge_pair(pair: str) -> str:
-    return "".join(pair.split(" "))
+def merge_pair(pair: Pair, symbols: SymbolTable) -> int:
+    return symbols.merge(pair)
 
 
-def concat_pairs(main_pair: str, pair2: str, side: Side):
+def concat_pairs(main_pair: Pair, pair2: Pair, side: Side, symbols: SymbolTable) -> Pair:
     if not can_be_concat(main_pair, pair2, side):
         raise AssertionError()
 
-    merged_main_pair = merge_pair(main_pair)
-    if side.value == Side.LEFT.value:
-        return " ".join([pair2.split(" ")[0],merged_main_pair])
-    elif side.value == Side.RIGHT.value:
-        return " ".join([merged_main_pair, pair2.split(" ")[1]])
+    merged_main_pair = merge_pair(main_pair, symbols)
+    if side is Side.LEFT:
+        return pair2[0], merged_main_pair
+    else:
+        return merged_main_pair, pair2[1]
 
 
-def can_be_concat(main_pair: str, pair: str, side: Side):
+def can_be_concat(main_pair: Pair, pair: Pair, side: Side):
     """
-    >>> can_be_concat("ab cd", "1 ab", Side.LEFT)
+    >>> can_be_concat(("ab", "cd"), ("1", "ab"), Side.LEFT)
     True
 
-    >>> can_be_concat("ab cd", "1 ab", Side.RIGHT)
+    >>> can_be_concat(("ab", "cd"), ("1", "ab"), Side.RIGHT)
     False
     """
-    if side.value == Side.LEFT.value:
-        return main_pair.split(" ")[0] == pair.split(" ")[1]
-    elif side.value == Side.RIGHT.value:
-        return main_pair.split(" ")[1] == pair.split(" ")[0]
+    if side is Side.LEFT:
+        return main_pair[0] == pair[1]
+    else:
+        return main_pair[1] == pair[0]
 
 
-def double_pair(pair: str):
-    merged_pair = merge_pair(pair)
-    return " ".join([merged_pair, merged_pair])
+def double_pair(pair: Pair, symbols: SymbolTable) -> Pair:
+    merged_pair = merge_pair(pair, symbols)
+    return merged_pair, merged_pair
 
 
-def calc_position_shift(main_pair: str, pair2: str, side: Side):
-    if side.value == Side.LEFT.value:
-        return -len(pair2.split(" ")[0])
-    elif side.value == Side.RIGHT.value:
-        return len(main_pair.split(" ")[0])
+def calc_position_shift(main_pair: Pair, pair2: Pair, side: Side, symbols: SymbolTable) -> int:
+    if side is Side.LEFT:
+        return -symbols.lengths[pair2[0]]
+    else:
+        return symbols.lengths[main_pair[0]]
 
 
-def add_pairs_to_neighbour_index(index, pair1, pair2, side, location_index):
+def add_pairs_to_neighbour_index(index, pair1, pair2, side, location_index, sizes: IndexSizeCounter):
     if not can_be_concat(pair1, pair2, side):
         raise AssertionError("")
     if pair2 in location_index:
-        index[pair1][side].add(pair2)
-        index[pair2][side.opposite()].add(pair1)
+        neighbours = index[pair1][side]
+        if pair2 not in neighbours:
+            neighbours.add(pair2)
+            sizes.n_neighbour_links += 1
+        neighbours = index[pair2][side.opposite()]
+        if pair1 not in neighbours:
+            neighbours.add(pair1)
+            sizes.n_neighbour_links += 1
 
 
 def choose_positions_to_merge(main_list, position_shift):
     """
-    >>> choose_positions_to_merge([0 ,1, 2, 5, 8, 9, 10, 11, 12, 20, 33, 34], 1)
+    >>> result_main, result_disappearing = choose_positions_to_merge([0 ,1, 2, 5, 8, 9, 10, 11, 12, 20, 33, 34], 1)
+    >>> result_main.tolist(), result_disappearing.tolist()
     ([0, 2, 5, 8, 10, 12, 20, 33], [1, 9, 11, 34])
 
-    >>> choose_positions_to_merge([0], 1)
+    >>> result_main, result_disappearing = choose_positions_to_merge([0], 1)
+    >>> result_main.tolist(), result_disappearing.tolist()
     ([0], [])
     """
-    result_main = []
-    result_disappearing = []
-    i = 0
-    while i < len(main_list)-1:
-        result_main.append(main_list[i])
-        if main_list[i] + position_shift == main_list[i+1]:
-            result_disappearing.append(main_list[i+1])
-            i += 1
-        i += 1
-    if i == len(main_list) -1:
-        result_main.append(main_list[i])
-    return result_main, result_disappearing
-
-
-def cleanup_location_index(location_index, most_freq_pair, disappearing_pairs):
+    main_list = np.asarray(main_list, dtype=np.int64)
+    if len(main_list) < 2:
+        return main_list, _empty_positions()
+    disappearing = np.concatenate(([False], _first_of_merged_pairs(main_list, position_shift)))
+    return main_list[~disappearing], main_list[disappearing]
+
+
+def cleanup_location_index(location_index, most_freq_pair, disappearing_pairs, sizes: IndexSizeCounter):
     for side in Side:
         for disappearing_pair in disappearing_pairs[side]:
             if len(location_index[disappearing_pair]) == 0:
-                del location_index[disappearing_pair]
+                sizes.delete_positions(location_index, disappearing_pair)
 
     if most_freq_pair in location_index:
         # check needed for the case when most freq pair was also a disappearing pair
-        del location_index[most_freq_pair]
+        sizes.delete_positions(location_index, most_freq_pair)
 
 
-def cleanup_neighbour_index(location_index, neighbour_index, most_freq_pair):
+def cleanup_neighbour_index(location_index, neighbour_index, most_freq_pair, sizes: IndexSizeCounter):
     for side in Side:
         disappearing_pairs = neighbour_index[most_freq_pair][side]
         for disappearing_pair in disappearing_pairs:
             if disappearing_pair not in location_index and disappearing_pair in neighbour_index:
-                del neighbour_index[disappearing_pair]
-    del neighbour_index[most_freq_pair]
+                sizes.delete_neighbours(neighbour_index, disappearing_pair)
+    sizes.delete_neighbours(neighbour_index, most_freq_pair)
 
 
-def update_location_index(location_index, neighbour_index, pair_to_merge):
+def update_location_index(location_index, neighbour_index, pair_to_merge, symbols: SymbolTable,
+                          sizes: IndexSizeCounter):
     occurence_changes = []
     disappearing_pairs = neighbour_index[pair_to_merge]
     main_list = location_index[pair_to_merge]
     if pair_to_merge in neighbour_index[pair_to_merge][Side.any()]:
         main_list, disappearing_pair_list_for_merge_pair = choose_positions_to_merge(
             main_list,
-            calc_position_shift(pair_to_merge, pair_to_merge, Side.RIGHT)
+            calc_position_shift(pair_to_merge, pair_to_merge, Side.RIGHT, symbols)
         )
     for side in Side:
         for disappearing_pair in disappearing_pairs[side]:
             if pair_to_merge != disappearing_pair:
                 disappearing_pair_list = location_index[disappearing_pair]
-            elif side.value == Side.RIGHT.value:
+            elif side is Side.RIGHT:
                 disappearing_pair_list = disappearing_pair_list_for_merge_pair
             else:
                 continue
 
 
-            if can_be_concat(disappearing_pair, pair_to_merge, side) and side.value == Side.RIGHT.value:
-                appeared_pair = double_pair(pair_to_merge)
+            if can_be_concat(disappearing_pair, pair_to_merge, side) and side is Side.RIGHT:
+                appeared_pair = double_pair(pair_to_merge, symbols)
                 position_shift = (
-                    calc_position_shift(pair_to_merge, disappearing_pair, side),
-                    calc_position_shift(pair_to_merge, disappearing_pair, side.opposite())
+                    calc_position_shift(pair_to_merge, disappearing_pair, side, symbols),
+                    calc_position_shift(pair_to_merge, disappearing_pair, side.opposite(), symbols)
                 )
 
                 disappearing_pair_list, appeared_pairs_locations = merge_lists_both(
                     main_list, disappearing_pair_list, position_shift
                 )
                 if len(appeared_pairs_locations) > 0:
-                    location_index[appeared_pair] = appeared_pairs_locations
+                    sizes.set_positions(location_index, appeared_pair, appeared_pairs_locations)
                     reduced_occurences = len(location_index[appeared_pair])
-                    occurence_changes.append((appeared_pair, appeared_pairs_locations[0], disappearing_pair, disappearing_pair_list[0] if disappearing_pair_list else -1, reduced_occurences))
+                    occurence_changes.append((appeared_pair, int(appeared_pairs_locations[0]), disappearing_pair, int(disappearing_pair_list[0]) if len(disappearing_pair_list) else -1, reduced_occurences))
 
-            appeared_pair = concat_pairs(pair_to_merge, disappearing_pair, side)
-            position_shift = calc_position_shift(pair_to_merge, disappearing_pair, side)
+            appeared_pair = concat_pairs(pair_to_merge, disappearing_pair, side, symbols)
+            position_shift = calc_position_shift(pair_to_merge, disappearing_pair, side, symbols)
             disappearing_pair_list, appeared_pairs_locations = merge_lists(
                 main_list, disappearing_pair_list, position_shift
             )
             if len(appeared_pairs_locations) > 0:
-                location_index[appeared_pair] = appeared_pairs_locations
+                sizes.set_positions(location_index, appeared_pair, appeared_pairs_locations)
                 reduced_occurences = len(location_index[appeared_pair])
-                occurence_changes.append((appeared_pair, appeared_pairs_locations[0], disappearing_pair, disappearing_pair_list[0] if disappearing_pair_list else -1, reduced_occurences))
+                occurence_changes.append((appeared_pair, int(appeared_pairs_locations[0]), disappearing_pair, int(disappearing_pair_list[0]) if len(disappearing_pair_list) else -1, reduced_occurences))
 
-            location_index[disappearing_pair] = disappearing_pair_list
+            sizes.set_positions(location_index, disappearing_pair, disappearing_pair_list)
 
-    cleanup_location_index(location_index, pair_to_merge, disappearing_pairs)
+    cleanup_location_index(location_index, pair_to_merge, disappearing_pairs, sizes)
 
     return occurence_changes
 
 
-def update_neighbour_index(location_index, neighbour_index, pair_to_merge):
+def update_neighbour_index(location_index, neighbour_index, pair_to_merge, symbols: SymbolTable,
+                           sizes: IndexSizeCounter):
     for side in Side:
         disappearing_pairs = neighbour_index[pair_to_merge][side]
         for disappearing_pair in disappearing_pairs:
             if can_be_concat(disappearing_pair, pair_to_merge, side):
-                appeared_pair = double_pair(pair_to_merge)
+                appeared_pair = double_pair(pair_to_merge, symbols)
                 if appeared_pair in location_index:
                     for disappeared_pair2 in disappearing_pairs:
-                        mm = concat_pairs(pair_to_merge, disappeared_pair2, side)
-                        add_pairs_to_neighbour_index(neighbour_index, appeared_pair, mm, side, location_index)
+                        mm = concat_pairs(pair_to_merge, disappeared_pair2, side, symbols)
+                        add_pairs_to_neighbour_index(neighbour_index, appeared_pair, mm, side,
+                                                     location_index, sizes)
                         if can_be_concat(pair_to_merge, mm, side.opposite()):
-                            mm_concat = concat_pairs(pair_to_merge, mm, side.opposite())
+                            mm_concat = concat_pairs(pair_to_merge, mm, side.opposite(), symbols)
                             add_pairs_to_neighbour_index(neighbour_index, appeared_pair,
-                                                         mm_concat, side, location_index)
+                                                         mm_concat, side, location_index, sizes)
 
-            appeared_pair = concat_pairs(pair_to_merge, disappearing_pair, side)
+            appeared_pair = concat_pairs(pair_to_merge, disappearing_pair, side, symbols)
             if appeared_pair in location_index:
                 for neighbour_of_neighbour in neighbour_index[disappearing_pair][side]:
                     add_pairs_to_neighbour_index(neighbour_index, appeared_pair, neighbour_of_neighbour, side,
-                                                 location_index)
+                                                 location_index, sizes)
                     if can_be_concat(pair_to_merge, neighbour_of_neighbour, side.opposite()):
                         neighbour_of_neighbour_concat = concat_pairs(pair_to_merge, neighbour_of_neighbour,
-                                                                     side.opposite())
+                                                                     side.opposite(), symbols)
                         add_pairs_to_neighbour_index(neighbour_index, appeared_pair, neighbour_of_neighbour_concat,
-                                                     side, location_index)
+                                                     side, location_index, sizes)
                 op_side = side.opposite()
                 for neighbour_of_neighbour in neighbour_index[pair_to_merge][op_side]:
-                    cc = concat_pairs(pair_to_merge, neighbour_of_neighbour, op_side)
-                    add_pairs_to_neighbour_index(neighbour_index, appeared_pair, cc, op_side, location_index)
+                    cc = concat_pairs(pair_to_merge, neighbour_of_neighbour, op_side, symbols)
+                    add_pairs_to_neighbour_index(neighbour_index, appeared_pair, cc, op_side,
+                                                 location_index, sizes)
                     if can_be_concat(pair_to_merge, cc, op_side.opposite()):
-                        cc_concat = concat_pairs(pair_to_merge, cc, op_side.opposite())
+                        cc_concat = concat_pairs(pair_to_merge, cc, op_side.opposite(), symbols)
                         add_pairs_to_neighbour_index(neighbour_index, appeared_pair, cc_concat, op_side,
-                                                     location_index)
+                                                     location_index, sizes)
+
+    cleanup_neighbour_index(location_index, neighbour_index, pair_to_merge, sizes)
+
+
+def run(generator: Iterable[str], n_merges: int=sys.maxsize,
+        include_performance_stats_every_n_merges: int = 0,
+        memory_budget_mb: Optional[float] = DEFAULT_MEMORY_BUDGET_MB,
+        trace_memory: bool = False) \
+        -> Tuple[str, int, Optional[List[BpePerformanceStatsEntry]]]:
+    """
+    :param memory_budget_mb: the learning stops gracefully after the merge
+    which made the estimated size of the indices exceed the budget; `None` means no limit.
+    :param trace_memory: whether the memory allocated by the interpreter should be
+    sampled with `tracemalloc` and added to the performance stats (slows down the learning).
+    """
+    with TracemallocSampler() if trace_memory else _no_sampler() as sampler:
+        yield from _run(generator, n_merges, include_performance_stats_every_n_merges, memory_budget_mb, sampler)
+
+
+@contextmanager
+def _no_sampler():
+    yield None
+
+
+def _create_performance_stats_entry(merges_done: int, time_for_last_merge: float,
+                                    location_index, neighbour_index, priority_counter, sizes: IndexSizeCounter,
+                                    sampler: Optional[TracemallocSampler]) -> BpePerformanceStatsEntry:
+    traced_memory_size, traced_memory_peak = sampler.sample_mb() if sampler else (None, None)
+    return BpePerformanceStatsEntry(
+        merges_done=merges_done,
+        time_for_last_merge=time_for_last_merge,
+        n_priority_queue_entries=len(priority_counter.pq),
+        n_index_enties=len(location_index),
+        location_index_obj_size=sizes.location_index_size_mb(location_index),
+        neighbour_index_obj_size=sizes.neighbour_index_size_mb(neighbour_index),
+        priority_counter_obj_size=sizes.priority_counter_size_mb(priority_counter),
+        n_live_priority_queue_entries=len(priority_counter),
+        n_positions=sizes.n_positions,
+        n_neighbour_links=sizes.n_neighbour_links,
+        traced_memory_size=traced_memory_size,
+        traced_memory_peak=traced_memory_peak
+    )
+
+
+class WildBpeState(object):
+    """
+    Indices and the priority counter of the pairs of a text, together with the merges done on it so far.
+    """
+    def __init__(self, location_index: Dict[Pair, np.ndarray], neighbour_index: Dict[Pair, List[Set[Pair]]],
+                 symbols: SymbolTable):
+        self.location_index = location_index
+        self.neighbour_index = neighbour_index
+        self.symbols = symbols
+        self.sizes = IndexSizeCounter.count(location_index, neighbour_index)
+        self.priority_counter = PriorityCounter({k: (len(v), int(v[0])) for k, v in location_index.items()},
+                                                automatic_count=False)
+        self.merges: List[Pair] = []
+
+    @staticmethod
+    def build(chunks: Iterable[str], symbols: Optional[SymbolTable] = None) -> 'WildBpeState':
+        return WildBpeState(*build_indices(chunks, symbols))
+
+    def apply_merge(self, pair: Pair) -> List[Tuple]:
+        """
+        Updates the indices, but not the priority counter.
+        """
+        occurence_changes = update_location_index(self.location_index, self.neighbour_index, pair,
+                                                  self.symbols, self.sizes)
+        update_neighbour_index(self.location_index, self.neighbour_index, pair, self.symbols, self.sizes)
+        return occurence_changes
+
+    def do_merge(self) -> Tuple[Pair, int]:
+        """
+        Merges the most frequent pair. Raises KeyError if there are no pairs left.
+        """
+        most_freq_pair, occurences = self.priority_counter.pop_pair()
+        occurence_changes = self.apply_merge(most_freq_pair)
+        for (appeared_pair, first_appeared_pair, disappearing_pair, first_left_disappering_pair, n_occurences) in occurence_changes:
+            self.priority_counter.add(appeared_pair, n_occurences, first_appeared_pair)
+            if disappearing_pair != most_freq_pair:
+                self.priority_counter.add(disappearing_pair, -n_occurences, first_left_disappering_pair)
+            else:
+                occurences -= n_occurences
+        self.merges.append(most_freq_pair)
+        return most_freq_pair, occurences
 
-    cleanup_neighbour_index(location_index, neighbour_index, pair_to_merge)
+    def total_size_mb(self) -> float:
+        return self.sizes.location_index_size_mb(self.location_index) \
+               + self.sizes.neighbour_index_size_mb(self.neighbour_index) \
+               + self.sizes.priority_counter_size_mb(self.priority_counter)
 
 
-def run(generator: Generator[str, None, None], n_merges: int=sys.maxsize,
-        include_performance_stats_every_n_merges: int = 0) \
+def _run(generator: Iterable[str], n_merges: int, include_performance_stats_every_n_merges: int,
+         memory_budget_mb: Optional[float], sampler: Optional[TracemallocSampler]) \
         -> Tuple[str, int, Optional[List[BpePerformanceStatsEntry]]]:
 
     checkpoint = time.time()
 
-    location_index, neighbour_index = build_indices(generator)
-    priority_counter = PriorityCounter({k: (len(v), v[0]) for k, v in location_index.items()}, automatic_count=False)
+    state = WildBpeState.build(generator)
+    location_index, neighbour_index, priority_counter, sizes = \
+        state.location_index, state.neighbour_index, state.priority_counter, state.sizes
 
-    logger.debug(f'Size of location index: {getsize(location_index) / 1e+6} (MB)')
-    logger.debug(f'Size of neighbour index: {getsize(neighbour_index) / 1e+6} (MB)')
+    logger.debug(f'Size of location index: {sizes.location_index_size_mb(location_index)} (MB)')
+    logger.debug(f'Size of neighbour index: {sizes.neighbour_index_size_mb(neighbour_index)} (MB)')
     logger.debug(f'Index build in : {time.time()-checkpoint} s')
 
     bpe_performance_stats = None
     if include_performance_stats_every_n_merges:
         bpe_performance_stats = [
-            BpePerformanceStatsEntry(
-                merges_done=0,
-                time_for_last_merge=0,
-                n_priority_queue_entries=len(priority_counter.pq),
-                n_index_enties=len(location_index),
-                location_index_obj_size=getsize(location_index) / 1e+6,
-                neighbour_index_obj_size=getsize(neighbour_index) / 1e+6,
-                priority_counter_obj_size=getsize(priority_counter) / 1e+6
-            )
+            _create_performance_stats_entry(0, 0, location_index, neighbour_index, priority_counter, sizes, sampler)
         ]
 
     for i in range(n_merges):
         checkpoint = time.time()
         try:
-            most_freq_pair, occurences = priority_counter.pop_pair()
-            logger.debug(f'Merge {i+1}: {most_freq_pair} {occurences}')
+            most_freq_pair, occurences = state.do_merge()
         except KeyError:
             break
-
-        occurence_changes = update_location_index(location_index, neighbour_index, most_freq_pair)
-        for (appeared_pair, first_appeared_pair, disappearing_pair, first_left_disappering_pair, n_occurences) in occurence_changes:
-            priority_counter.add(appeared_pair, n_occurences, first_appeared_pair)
-            if disappearing_pair != most_freq_pair:
-                priority_counter.add(disappearing_pair, -n_occurences, first_left_disappering_pair)
-            else:
-                occurences -= n_occurences
-
-        update_neighbour_index(location_index, neighbour_index, most_freq_pair)
+        logger.debug(f'Merge {i+1}: {state.symbols.to_str(most_freq_pair)} {occurences}')
 
         time_per_merge = time.time() - checkpoint
         if include_performance_stats_every_n_merges > 0 and (i == 1 or i % include_performance_stats_every_n_merges == 0):
-            n_index_entries = len(location_index)
-            n_priority_queue_entries = len(priority_counter.pq)
-            location_index_obj_size = getsize(location_index) / 1e+6
-            neighbour_index_obj_size = getsize(neighbour_index) / 1e+6
-            priority_queue_obj_size = getsize(priority_counter) / 1e+6
-
+            entry = _create_performance_stats_entry(i, time_per_merge, location_index, neighbour_index,
+                                                    priority_counter, sizes, sampler)
             logger.debug(f"---------------------------  After merge {i}")
-            logger.debug(f"Last merge was done in {time_per_merge} s")
-            logger.debug(f'The number of keys in the index: {n_index_entries}')
-            logger.debug(f'Length of pq {n_priority_queue_entries}')
-            logger.debug(f'Size of location index: {location_index_obj_size} (MB)')
-            logger.debug(f'Size of neighbour index: {neighbour_index_obj_size} (MB)')
-            logger.debug(f'Size of priority counter: {priority_queue_obj_size} (MB)')
-
-            bpe_performance_stats.append(
-                BpePerformanceStatsEntry(
-                    merges_done=i,
-                    time_for_last_merge=time_per_merge,
-                    n_priority_queue_entries=n_priority_queue_entries,
-                    n_index_enties=n_index_entries,
-                    location_index_obj_size=location_index_obj_size,
-                    neighbour_index_obj_size=neighbour_index_obj_size,
-                    priority_counter_obj_size=priority_queue_obj_size
-                )
-            )
+            logger.debug(f'{vars(entry)}')
+            bpe_performance_stats.append(entry)
 
-        yield (most_freq_pair, occurences, bpe_performance_stats)
+        yield (state.symbols.to_str(most_freq_pair), occurences, bpe_performance_stats)
 
-        if include_performance_stats_every_n_merges > 0 and (location_index_obj_size + neighbour_index_obj_size + priority_queue_obj_size) > 3072:
-            return
+        if memory_budget_mb is not None:
+            total_size_mb = state.total_size_mb()
+            if total_size_mb > memory_budget_mb:
+                logger.warning(f'Estimated size of the indices ({total_size_mb:.1f} MB) exceeded '
+                               f'the memory budget ({memory_budget_mb} MB). Stopping after {i+1} merges.')
+                return
 
 
 def run_from_file(path_to_file: str, n_merges: int=sys.maxsize) -> Tuple[str, int, Optional[List[BpePerformanceStatsEntry]]]:
-    it = get_char_iterator_for_file(path_to_file)
+    it = get_block_iterator_for_file(path_to_file)
     return run(it, n_merges)
 
 
 def run_from_dir(path_to_dir: str, n_merges: int=sys.maxsize) -> Tuple[str, int, Optional[List[BpePerformanceStatsEntry]]]:
-    it = get_char_iterator_for_dir(path_to_dir)
+    it = get_block_iterator_for_dir(path_to_dir)
     return run(it, n_merges)
 
 
@@ -501,7 +764,7 @@ def run_from_text(text: str, n_merges: int=sys.maxsize) -> Tuple[str, int, Optio
 ('there|is|a|thin|tooth|in| the', 1), ('there|is|a|thin|tooth|in|the |', 1), \
 ('there|is|a|thin|tooth|in|the| tooth', 1)]
     """
-    return run(iter(text), n_merges)
+    return run([text], n_merges)
 
 
 if __name__ == '__main__':
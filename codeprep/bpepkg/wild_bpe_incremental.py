@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Online mode of wild bpe: text can be appended to the indices after some merges have already been learned.
+The appended text is rewritten under the learned merges, so the cost of appending scales with the size
+of the new text, not with the size of the whole corpus.
+
+>>> bpe = IncrementalWildBpe()
+>>> bpe.append(["abcabc"])
+>>> list(bpe.learn(2))
+[('a b', 2), ('ab c', 2)]
+>>> bpe.append(["xabcxabc"])
+>>> list(bpe.learn(1))
+[('x abc', 2)]
+"""
+import logging
+import os
+import pickle
+from collections import defaultdict
+from typing import Iterable, Generator, Tuple
+
+import numpy as np
+
+from codeprep.bpepkg import wild_bpe
+from codeprep.bpepkg.wild_bpe import WildBpeState, Side, _empty_positions, _empty_neighbours
+from codeprep.util import PriorityCounter
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalWildBpe(object):
+    def __init__(self, state: WildBpeState = None, text_length: int = 0):
+        self.state = state or WildBpeState.build([])
+        # positions of the appended text start right after the text already in the indices
+        self.text_length = text_length
+
+    def append(self, chunks: Iterable[str]) -> None:
+        """
+        Adds the pairs of the text to the indices. Pairs spanning the end of the previous text and
+        the beginning of the appended one are not added, like the pairs spanning file boundaries.
+        """
+        new_state = WildBpeState.build(chunks, self.state.symbols)
+        if not new_state.location_index:
+            return
+        new_text_length = max(int(positions[-1]) for positions in new_state.location_index.values()) + 2
+
+        n_replayed = 0
+        for pair in self.state.merges:
+            if pair in new_state.location_index:
+                new_state.apply_merge(pair)
+                n_replayed += 1
+        logger.debug(f'Appended text rewritten with {n_replayed} of {len(self.state.merges)} learned merges')
+
+        self._add_new_pairs(new_state)
+        self.text_length += new_text_length
+
+    def _add_new_pairs(self, new_state: WildBpeState) -> None:
+        state = self.state
+        for pair, positions in new_state.location_index.items():
+            if not len(positions):
+                continue
+            shifted_positions = positions + self.text_length
+            old_positions = state.location_index.get(pair)
+            all_positions = shifted_positions if old_positions is None \
+                else np.concatenate((old_positions, shifted_positions))
+            state.sizes.set_positions(state.location_index, pair, all_positions)
+            state.priority_counter.add(pair, len(positions), int(all_positions[0]))
+
+        for pair, neighbours in new_state.neighbour_index.items():
+            if pair not in new_state.location_index:
+                continue
+            for side in Side:
+                for neighbour in neighbours[side]:
+                    if neighbour in new_state.location_index and neighbour not in state.neighbour_index[pair][side]:
+                        state.neighbour_index[pair][side].add(neighbour)
+                        state.sizes.n_neighbour_links += 1
+
+    def learn(self, n_merges: int) -> Generator[Tuple[str, int], None, None]:
+        for _ in range(n_merges):
+            try:
+                pair, occurences = self.state.do_merge()
+            except KeyError:
+                return
+            yield self.state.symbols.to_str(pair), occurences
+
+    @property
+    def merges(self):
+        return [self.state.symbols.to_str(pair) for pair in self.state.merges]
+
+    def save(self, path: str) -> None:
+        state = self.state
+        # removed entries of the priority counter are dropped, they would not be recognized after loading anyway
+        priority_counter_entries = {pair: (-entry[0][0], entry[0][1])
+                                    for pair, entry in state.priority_counter.entry_finder.items()}
+        persisted = {
+            'version': wild_bpe.__version__,
+            'text_length': self.text_length,
+            'location_index': dict(state.location_index),
+            'neighbour_index': dict(state.neighbour_index),
+            'symbols': state.symbols,
+            'priority_counter': priority_counter_entries,
+            'merges': state.merges,
+            'n_positions': state.sizes.n_positions,
+            'n_neighbour_links': state.sizes.n_neighbour_links,
+        }
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(persisted, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'IncrementalWildBpe':
+        with open(path, 'rb') as f:
+            persisted = pickle.load(f)
+        if persisted['version'] != wild_bpe.__version__:
+            raise ValueError(f'Index state was saved by wild bpe {persisted["version"]}, '
+                             f'current version: {wild_bpe.__version__}')
+        state = WildBpeState.__new__(WildBpeState)
+        state.location_index = defaultdict(_empty_positions, persisted['location_index'])
+        state.neighbour_index = defaultdict(_empty_neighbours, persisted['neighbour_index'])
+        state.symbols = persisted['symbols']
+        state.sizes = wild_bpe.IndexSizeCounter(persisted['n_positions'], persisted['n_neighbour_links'])
+        state.priority_counter = PriorityCounter(persisted['priority_counter'], automatic_count=False)
+        state.merges = persisted['merges']
+        return IncrementalWildBpe(state, persisted['text_length'])
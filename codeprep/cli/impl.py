@@ -7,19 +7,25 @@ import os
 from typing import Dict, Optional, Any
 
 import sys
+from docopt import DocoptExit
 
 import codeprep
 import codeprep.api.corpus
 import codeprep.api.text
+import codeprep.api.vocab
 from codeprep.api.common import create_split_value, create_str_value
 from codeprep.bpepkg.bpe_config import BpeParam, BpeConfig
+from codeprep.bpepkg.performance_stats import STATS_FORMATS
 from codeprep.pipeline import bpelearner
+from codeprep.pipeline.bpelearner import WILD_ENGINE, ENGINES
 from codeprep.pipeline.bperegistry import InvalidBpeCodesIdError, USER_PREDEFINED_BPE_CODES
 from codeprep.pipeline.dataset import Dataset, normalize_extension_string
 from codeprep.prepconfig import PrepConfig, PrepParam
 
 logger = logging.getLogger(__name__)
 
+CLASSIC_ENGINE_ONLY_OPTIONS = ['--min-word-freq', '--max-pairs-in-memory', '--sample', '--stats-every']
+
 
 def set_log_level(args: Dict[str, str]) -> None:
     if args['--verbose']:
@@ -36,11 +42,21 @@ def is_option_true(args: Dict, option: str) -> bool:
     return bool(get_option(args, option))
 
 
+def check_learnbpe_engine_options(args: Dict) -> None:
+    if args['--engine'] not in ENGINES:
+        raise DocoptExit(f'Unknown --engine: {args["--engine"]}, possible values: {ENGINES}')
+    if args['--engine'] == WILD_ENGINE:
+        classic_only_options = [option for option in CLASSIC_ENGINE_ONLY_OPTIONS if args[option]]
+        if classic_only_options:
+            raise DocoptExit(f'Options {classic_only_options} cannot be used with --engine {WILD_ENGINE}')
+
+
 def handle_learnbpe(args):
     set_log_level(args)
     path = os.path.abspath(args['--path'])
+    check_learnbpe_engine_options(args)
     bpe_config = create_bpe_config_from_args(args)
-    n_merges = int(args['<n-merges>'])
+    n_merges = [int(n) for n in args['<n-merges>']]
     if args['--legacy']:
         parsed_extensions = normalize_extension_string(args['--ext'])
         if parsed_extensions and parsed_extensions != ['java']:
@@ -59,7 +75,35 @@ def handle_learnbpe(args):
         logger.warning(f"Ignoring passed bpe codes id: {bpe_codes_id}. "
               f"This dataset has already been assigned id: {dataset.bpe_codes_id}")
 
-    bpelearner.run(dataset, n_merges, bpe_config)
+    if args['--engine'] == WILD_ENGINE:
+        bpelearner.run_wild(dataset, n_merges, bpe_config)
+        return
+
+    learning_options = {}
+    if args['--min-word-freq']:
+        learning_options['min_word_freq'] = int(args['--min-word-freq'])
+    if args['--max-pairs-in-memory']:
+        learning_options['max_pairs_in_memory'] = int(args['--max-pairs-in-memory'])
+    if args['--sample']:
+        learning_options['sample_rate'] = float(args['--sample'])
+    if args['--stats-every']:
+        if args['--stats-format'] not in STATS_FORMATS:
+            raise DocoptExit(f'Unknown --stats-format: {args["--stats-format"]}, possible values: {STATS_FORMATS}')
+        learning_options['stats_every_n_merges'] = int(args['--stats-every'])
+        learning_options['stats_format'] = args['--stats-format']
+    bpelearner.run(dataset, n_merges, bpe_config, **learning_options)
+
+
+def handle_vocab(args: Dict) -> None:
+    set_log_level(args)
+    if args['merge']:
+        codeprep.api.vocab.merge(args['<vocab>'], args['--output'])
+    elif args['subtract']:
+        codeprep.api.vocab.subtract(args['<vocab>'][0], args['<subtracted-vocab>'], args['--output'])
+    else:
+        top_k = int(args['--top-k']) if args['--top-k'] else None
+        min_count = int(args['--min-count']) if args['--min-count'] else None
+        codeprep.api.vocab.prune(args['<vocab>'][0], args['--output'], top_k=top_k, min_count=min_count)
 
 
 def handle_splitting(args: Dict) -> None:
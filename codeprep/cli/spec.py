@@ -6,7 +6,7 @@ import logging
 
 import docopt_subcommands as dsc
 
-from codeprep.cli.impl import handle_splitting, handle_learnbpe
+from codeprep.cli.impl import handle_splitting, handle_learnbpe, handle_vocab
 from codeprep.config import app_name, version
 
 logger = logging.getLogger(__name__)
@@ -154,12 +154,13 @@ def bpe_handler(args):
 
 @dsc.command()
 def bpelearn_handler(args):
-    """usage: {program} learn-bpe <n-merges> -p <path> [-e <ext>] [--id <bpe-codes-id>] [--no-unicode | --bytes] [--word-end] [--legacy] [--verbose]
+    """usage: {program} learn-bpe <n-merges>... -p <path> [-e <ext>] [--id <bpe-codes-id>] [--no-unicode | --bytes] [--word-end] [--legacy] [--min-word-freq <min-word-freq>] [--max-pairs-in-memory <max-pairs-in-memory>] [--sample <sample-rate>] [--stats-every <n> [--stats-format <format>]] [--engine <engine>] [--verbose]
 
     Trains bpe codes on a specified corpus.
 
     Options:
-      <n-merges>                                   The number of BPE merges to compute
+      <n-merges>                                   The number of BPE merges to compute. If multiple numbers are passed,
+                                                   bpe codes for each of them are saved in one run.
       -p, --path <path>                            Path to the dataset to be used to learn bpe codes.
       -e --ext <ext>                               Limits the set of input files to the files with the specified extension(s).
                                                    The format is the following: "ext1|ext2|...|extN" If not specififed, all the files are read.
@@ -168,10 +169,39 @@ def bpelearn_handler(args):
       --bytes, -b                                  Treat non-ascii characters as 2 bytes and do real byte-pair encoding.
       --word-end, -z                               Add a special character to the end of each word.
       --legacy                                     Parse using legacy parser (only files with extension “.java” will be processed)
+      --min-word-freq <min-word-freq>              Words occurring less often are not used to learn merges, they are split with the learned merges at the end.
+      --max-pairs-in-memory <max-pairs-in-memory>  Spill pair statistics to disk when their number exceeds this value.
+      --sample <sample-rate>                       Learn approximate bpe codes fast on a sample of words of this size (e.g. 0.01).
+                                                   They are saved separately together with a report comparing them with exact ones.
+      --stats-every <n>                            Record performance stats of the learner every n merges and save them next to the bpe output dir.
+      --stats-format <format>                      Format of the performance stats file: "json" or "csv" [default: json].
+      --engine <engine>                            "classic" learns bpe codes on the vocabulary of the preprocessed corpus,
+                                                   "wild" learns them in one pass over the raw characters of the files [default: classic].
       --verbose, -v                                Print logs with log level DEBUG and higher to stdout.
     """
     handle_learnbpe(args)
 
 
+@dsc.command()
+def vocab_handler(args):
+    """usage: {program} vocab merge <vocab>... -o <output> [--verbose]
+       {program} vocab subtract <vocab> <subtracted-vocab>... -o <output> [--verbose]
+       {program} vocab prune <vocab> -o <output> [--top-k <k>] [--min-count <min-count>] [--verbose]
+
+    Merges, subtracts or prunes already calculated vocab files.
+
+    Options:
+      merge                                        Sum up the counts of the words in the vocab files.
+      subtract                                     Subtract the counts of the words in <subtracted-vocab> files from <vocab>.
+                                                   Words whose counts drop to zero are removed.
+      prune                                        Leave only the most frequent words of <vocab>.
+      -o, --output <output>                        Path to write the resulting vocab to.
+      --top-k <k>                                  Leave <k> most frequent words.
+      --min-count <min-count>                      Leave words occurring at least <min-count> times.
+      --verbose, -v                                Print logs with log level DEBUG and higher to stdout.
+    """
+    handle_vocab(args)
+
+
 def parse_and_run(args):
     dsc.main(app_name, f'{app_name} {version}', argv=args, exit_at_end=False)
\ No newline at end of file
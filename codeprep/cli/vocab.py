@@ -6,6 +6,7 @@ import argparse
 import logging
 
 from codeprep.dirutils import walk
+from codeprep.pipeline.approxvocab import DEFAULT_COUNT_MIN_WIDTH, DEFAULT_COUNT_MIN_DEPTH
 from codeprep.pipeline.vocab import calc_vocab
 
 logger = logging.getLogger(__name__)
@@ -16,8 +17,16 @@ if __name__ == '__main__':
     parser.add_argument('path_to_dataset', action='store', help=f'path to dataset')
     parser.add_argument('output_dir', action='store', help=f'output dir')
     parser.add_argument('extension', action='store', help=f'extension')
+    parser.add_argument('--bounded-memory', action='store_true',
+                        help=f'use external sorting, so that the vocab does not have to fit into memory')
+    parser.add_argument('--top-k', action='store', type=int,
+                        help=f'calculate approximately only the specified number of the most frequent words')
+    parser.add_argument('--count-min', action='store_true',
+                        help=f'with --top-k, estimate the counts with a Count-Min sketch')
 
     args = parser.parse_known_args()
     args = args[0]
 
-    calc_vocab(args.path_to_dataset, walk(args.path_to_dataset.encode(), extension=args.extension.encode()), args.output_dir)
\ No newline at end of file
+    calc_vocab(args.path_to_dataset, walk(args.path_to_dataset.encode(), extension=args.extension.encode()), args.output_dir,
+               bounded_memory=args.bounded_memory, top_k=args.top_k,
+               count_min_size=(DEFAULT_COUNT_MIN_WIDTH, DEFAULT_COUNT_MIN_DEPTH) if args.count_min else None)
\ No newline at end of file
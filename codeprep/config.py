@@ -38,10 +38,21 @@ USER_BPE_DIR = os.path.join(USER_CONFIG_DIR, BPE_DIR)
 USER_VOCAB_DIR = os.path.join(USER_CONFIG_DIR, VOCAB_DIR)
 DEFAULT_BPE_CACHE_DIR = os.path.join(USER_CACHE_DIR, BPE_DIR)
 DEFAULT_CORPUS_SIZES_DIR = os.path.join(USER_CACHE_DIR, 'corpus_sizes')
+DEFAULT_WORD_BOUNDARIES_DIR = os.path.join(USER_CACHE_DIR, 'word_boundaries')
+DEFAULT_NUMERICALIZED_DIR = os.path.join(USER_CACHE_DIR, 'numericalized')
+DEFAULT_PARSE_CACHE_DIR = os.path.join(USER_CACHE_DIR, 'parse_cache')
 
 REWRITE_PARSED_FILE=False
 REWRITE_PREPROCESSED_FILE=False
+# set to True to detect the files whose modification time has changed but the contents have not (e.g. after git checkout)
+MANIFEST_CONTENT_HASH=False
+
+# parsed files are shared between datasets through a content-addressed store, set to False to disable it
+USE_PARSE_CACHE=True
+PARSE_CACHE_MAX_SIZE=10 * 2 ** 30
 
 CHUNKSIZE=24
+# number of threads listing the directories of a dataset, more threads help mostly on network file systems
+WALK_THREADS=16
 LIMIT_FILES_ON_LAST_MODIFICATION_CHECK=1000
 LIMIT_FILES_SCANNING=50000
\ No newline at end of file
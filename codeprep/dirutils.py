@@ -4,11 +4,14 @@
 
 import logging
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from typing import Optional, List, Generator
+from typing import Optional, List, Generator, Tuple, FrozenSet, NamedTuple
 
-from codeprep.config import LIMIT_FILES_ON_LAST_MODIFICATION_CHECK
+from codeprep.config import LIMIT_FILES_ON_LAST_MODIFICATION_CHECK, WALK_THREADS
+from codeprep.filelist import FileListWriter
 from codeprep.fileutils import has_one_of_extensions
 
 logger = logging.getLogger(__name__)
@@ -24,32 +27,115 @@ def walk(path:bytes, extension: Optional[bytes] = None) -> Generator[bytes, None
                     yield os.path.join(root, file)
 
 
+class ScannedDir(NamedTuple):
+    rel_path: bytes
+    dirs: List[bytes]
+    files: List[os.DirEntry]
+
+
+def _scan_dir(full_path: bytes, rel_path: bytes, ancestors: FrozenSet[Tuple[int, int]], stat_files: bool) \
+        -> Tuple[ScannedDir, List[Tuple[bytes, bytes, FrozenSet[Tuple[int, int]]]]]:
+    """
+    Lists a single directory, the type of the entries is taken from `os.DirEntry` without extra stat calls
+    (except for symlinks to directories, which are checked for loops).
+    """
+    dirs, files, subdirs = [], [], []
+    try:
+        dir_stat = os.stat(full_path)
+        ancestors = ancestors | {(dir_stat.st_dev, dir_stat.st_ino)}
+        with os.scandir(full_path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    is_symlink = entry.is_symlink()
+                except OSError:
+                    continue
+                if is_dir:
+                    if is_symlink:
+                        try:
+                            target_stat = os.stat(entry.path)
+                        except OSError:
+                            continue
+                        if (target_stat.st_dev, target_stat.st_ino) in ancestors:
+                            logger.warning(f'Symlink loop detected, not following {entry.path}')
+                            continue
+                    dirs.append(entry.name)
+                    subdirs.append((entry.path, entry.name if rel_path == b'.' else os.path.join(rel_path, entry.name),
+                                    ancestors))
+                elif not is_symlink:
+                    if stat_files:
+                        try:
+                            # the result is cached in the entry
+                            entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                    files.append(entry)
+    except OSError as e:
+        # the same as os.walk: unreadable directories are skipped
+        logger.warning(f'Cannot list {full_path}: {e}')
+    return ScannedDir(rel_path, dirs, files), subdirs
+
+
+def parallel_walk(path: bytes, n_threads: int = WALK_THREADS,
+                  stat_files: bool = False) -> Generator[ScannedDir, None, None]:
+    """
+    Walks the directory tree like `os.walk(path, followlinks=True)` with several directories listed at the same time.
+    Symlinks to files are skipped, symlinks to directories are followed unless they point to one of their ancestors.
+    The directories are returned in breadth-first order, the same on every run regardless of the thread scheduling.
+    Paths are relative to `path`, the top directory is b'.'.
+    If `stat_files` is True, `stat()` of the returned entries is called in the worker threads.
+
+    >>> import tempfile
+    >>> root = tempfile.mkdtemp().encode()
+    >>> os.makedirs(os.path.join(root, b'src', b'main'))
+    >>> for file in [b'a.java', b'src/b.java', b'src/main/c.java']:
+    ...     open(os.path.join(root, file), 'w').close()
+    >>> os.symlink(os.path.join(root, b'src'), os.path.join(root, b'src', b'main', b'loop'))
+    >>> os.symlink(os.path.join(root, b'a.java'), os.path.join(root, b'link.java'))
+    >>> [(d.rel_path, sorted(d.dirs), sorted(f.name for f in d.files)) for d in parallel_walk(root)]
+    [(b'.', [b'src'], [b'a.java']), (b'src', [b'main'], [b'b.java']), (b'src/main', [], [b'c.java'])]
+    """
+    max_in_flight = n_threads * 4
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        not_submitted = deque([(path, b'.', frozenset())])
+        in_flight = deque()
+        while not_submitted or in_flight:
+            while not_submitted and len(in_flight) < max_in_flight:
+                full_path, rel_path, ancestors = not_submitted.popleft()
+                in_flight.append(executor.submit(_scan_dir, full_path, rel_path, ancestors, stat_files))
+            scanned_dir, subdirs = in_flight.popleft().result()
+            not_submitted.extend(subdirs)
+            yield scanned_dir
+
+
 def walk_and_save(path: str, dir_list_path: str, file_list_path: str, return_dirs_instead_of_regular_files: bool,
                   extensions: Optional[List[str]]) -> Generator[bytes, None, None]:
-    with open(dir_list_path, 'w') as d, open(file_list_path, 'w') as f:
+    """
+    The lists are written in the binary format of `codeprep.filelist` and become available when the walk is complete.
+    The paths are yielded as soon as their directory is listed, so that they can be processed while the walk goes on.
+    """
+    with FileListWriter(dir_list_path) as d, FileListWriter(file_list_path) as f:
         path_bin = path.encode()
         extensions_bin = list(map(lambda e: e.encode(), extensions)) if extensions else None
         # we want to list and store all the files a sequences of bytes to avoid problems with different encodings for filenames
         if os.path.isfile(path_bin):
             res = os.path.basename(path_bin)
-            f.write(f'{res}\n')
+            f.write(res)
             if not return_dirs_instead_of_regular_files:
                 yield res
         else:
-            for root, dirs, files in os.walk(path_bin, followlinks=True):
-                # we pass bytes to os.walk -> the output are bytes as well
-                for dir in dirs:
-                    bin_name = os.path.join(os.path.relpath(root, path_bin), dir)
-                    d.write(f'{bin_name}\n')
+            for scanned_dir in parallel_walk(path_bin):
+                for dir in scanned_dir.dirs:
+                    bin_name = os.path.join(scanned_dir.rel_path, dir)
+                    d.write(bin_name)
                     if return_dirs_instead_of_regular_files:
                         yield bin_name
-                for file in files:
-                    bin_name = os.path.join(os.path.relpath(root, path_bin), file)
+                for file in scanned_dir.files:
+                    bin_name = os.path.join(scanned_dir.rel_path, file.name)
                     if not extensions or has_one_of_extensions(bin_name, extensions_bin):
-                        if not os.path.islink(os.path.join(root, file)):
-                            f.write(f'{bin_name}\n')
-                            if not return_dirs_instead_of_regular_files:
-                                yield bin_name
+                        f.write(bin_name)
+                        if not return_dirs_instead_of_regular_files:
+                            yield bin_name
 
 
 def get_dir_last_modification(path: str, limit: int = LIMIT_FILES_ON_LAST_MODIFICATION_CHECK) -> datetime:
@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Binary format of the lists of files of a dataset.
+
+The file starts with a header containing the number of entries and the size of the data section,
+followed by the paths (raw bytes, each prefixed with its length) and the offsets of the entries in the data section.
+The file is memory-mapped when read, the number of entries and any slice of the list are available
+without reading the whole list.
+
+Lists written by the previous versions (`repr()` of each path on a separate line) can still be read.
+"""
+import ast
+import logging
+import mmap
+import os
+import struct
+from typing import Iterator, Union, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FILE_LIST_MAGIC = b'CPFL'
+FILE_LIST_VERSION = 1
+FILE_LIST_HEADER = struct.Struct('<4sIQQ')  # magic, version, number of entries, size of data section
+ENTRY_LENGTH = struct.Struct('<I')
+NOT_FINISHED_EXT = '.part'
+
+
+class FileListWriter(object):
+    """
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'filelist')
+    >>> with FileListWriter(path) as writer:
+    ...     writer.write(b'./a.java')
+    ...     writer.write(b'src/b.java')
+    >>> file_list = FileList(path)
+    >>> len(file_list), file_list[1], file_list[:1], file_list.total_bytes
+    (2, b'src/b.java', [b'./a.java'], 18)
+    >>> list(read_file_list(path))
+    [b'./a.java', b'src/b.java']
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path + NOT_FINISHED_EXT, 'wb')
+        self._file.write(FILE_LIST_HEADER.pack(FILE_LIST_MAGIC, FILE_LIST_VERSION, 0, 0))
+        self._offsets = [0]
+
+    def write(self, path: bytes) -> None:
+        self._file.write(ENTRY_LENGTH.pack(len(path)))
+        self._file.write(path)
+        self._offsets.append(self._offsets[-1] + ENTRY_LENGTH.size + len(path))
+
+    def close(self) -> None:
+        """
+        The list becomes available at `path` only when it is complete.
+        """
+        self._file.write(np.array(self._offsets, dtype=np.uint64).tobytes())
+        self._file.seek(0)
+        self._file.write(FILE_LIST_HEADER.pack(FILE_LIST_MAGIC, FILE_LIST_VERSION,
+                                               len(self._offsets) - 1, self._offsets[-1]))
+        self._file.close()
+        os.replace(self.path + NOT_FINISHED_EXT, self.path)
+
+    def abort(self) -> None:
+        self._file.close()
+        os.remove(self.path + NOT_FINISHED_EXT)
+
+    def __enter__(self) -> 'FileListWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class FileList(object):
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._n_entries, self._data_size = FILE_LIST_HEADER.unpack_from(self._mmap)
+        if magic != FILE_LIST_MAGIC or version != FILE_LIST_VERSION:
+            raise ValueError(f'{path} is not a file list of version {FILE_LIST_VERSION}')
+        self._offsets = np.frombuffer(self._mmap, dtype=np.uint64, count=self._n_entries + 1,
+                                      offset=FILE_LIST_HEADER.size + self._data_size)
+
+    def __len__(self) -> int:
+        return self._n_entries
+
+    @property
+    def total_bytes(self) -> int:
+        """
+        Size of the paths in the list.
+        """
+        return self._data_size - self._n_entries * ENTRY_LENGTH.size
+
+    def _get(self, i: int) -> bytes:
+        start = FILE_LIST_HEADER.size + int(self._offsets[i]) + ENTRY_LENGTH.size
+        end = FILE_LIST_HEADER.size + int(self._offsets[i + 1])
+        return self._mmap[start:end]
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[bytes, List[bytes]]:
+        if isinstance(item, slice):
+            return [self._get(i) for i in range(*item.indices(self._n_entries))]
+        if item < 0:
+            item += self._n_entries
+        if not 0 <= item < self._n_entries:
+            raise IndexError(f'File list index {item} is out of range')
+        return self._get(item)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for i in range(self._n_entries):
+            yield self._get(i)
+
+
+def is_binary_file_list(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(FILE_LIST_MAGIC)) == FILE_LIST_MAGIC
+
+
+def read_file_list(path: str) -> Iterator[bytes]:
+    if is_binary_file_list(path):
+        yield from FileList(path)
+    else:
+        with open(path) as f:
+            for line in f:
+                yield ast.literal_eval(line)
+
+
+def count_files_in_list(path: str) -> int:
+    if is_binary_file_list(path):
+        return len(FileList(path))
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
@@ -0,0 +1,260 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Approximate vocab of the `k` most frequent words calculated in O(k) memory per process.
+
+Words are counted with a Misra-Gries summary: the counts are underestimated by at most `total / (k + 1)`,
+and every word occurring more often than that is guaranteed to be in the summary.
+Summaries of different parts of the corpus can be merged keeping the same guarantee.
+Optionally, the counts of the words in the summary are estimated with a Count-Min sketch,
+which overestimates them by at most `e / width * total` with the probability of `1 - e ^ -depth`.
+"""
+import heapq
+import logging
+import math
+import os
+import shutil
+import zlib
+from collections import Counter
+from multiprocessing.pool import Pool
+from multiprocessing.util import Finalize
+from typing import Iterable, List, Tuple, Optional, Iterator
+
+import numpy as np
+from tqdm import tqdm
+
+from codeprep.fileutils import read_file_contents
+from codeprep.pipeline.vocab import _dump_vocab_dict, NOT_FINISHED_EXT, write_vocab_growth_stats
+from codeprep.pipeline.vocabgrowth import VocabGrowthSketch, shuffle_files, estimate_vocab_growth, HyperLogLog
+from codeprep.util import groupify, ProgressChannel, init_progress_channel, report_progress
+
+logger = logging.getLogger(__name__)
+
+# summaries of file groups are sent to the main process, so there are fewer groups than in the exact calculation
+MAX_FILE_GROUPS = 256
+DEFAULT_COUNT_MIN_WIDTH = 2 ** 18
+DEFAULT_COUNT_MIN_DEPTH = 4
+COUNT_MIN_EXT = 'countmin'
+
+
+class MisraGriesSummary(object):
+    """
+    >>> summary = MisraGriesSummary(2)
+    >>> summary.update('a b a c a b d a'.split(' '))
+    >>> summary.top()
+    [('a', 3), ('b', 1)]
+    >>> summary.total, summary.max_underestimation
+    (8, 1)
+
+    >>> other = MisraGriesSummary(2)
+    >>> other.update('b b b e'.split(' '))
+    >>> summary.merge(other)
+    >>> summary.top()
+    [('b', 3), ('a', 2)]
+    >>> summary.total, summary.max_underestimation
+    (12, 2)
+    """
+    def __init__(self, k: int):
+        if k <= 0:
+            raise ValueError(f'k must be positive, but is {k}')
+        self.k = k
+        self.counts = Counter()
+        self.total = 0
+        self.max_underestimation = 0
+
+    def update(self, words: Iterable[str]) -> None:
+        for word in words:
+            self.counts[word] += 1
+            self.total += 1
+            # reducing only when there are 2k counters keeps the cost of an update amortized O(1)
+            if len(self.counts) > 2 * self.k:
+                self._reduce()
+
+    def merge(self, other: 'MisraGriesSummary') -> None:
+        self.counts.update(other.counts)
+        self.total += other.total
+        self.max_underestimation += other.max_underestimation
+        self._reduce()
+
+    def _reduce(self) -> None:
+        if len(self.counts) <= self.k:
+            return
+        decrement = heapq.nlargest(self.k + 1, self.counts.values())[-1]
+        self.counts = Counter({word: count - decrement for word, count in self.counts.items() if count > decrement})
+        self.max_underestimation += decrement
+
+    def top(self) -> List[Tuple[str, int]]:
+        self._reduce()
+        return sorted(self.counts.items(), key=lambda x: x[1], reverse=True)
+
+
+class CountMinSketch(object):
+    """
+    >>> sketch = CountMinSketch(width=64, depth=3)
+    >>> sketch.update('a b a c a'.split(' '))
+    >>> sketch.estimate('a') >= 3, sketch.estimate('b') >= 1, sketch.total
+    (True, True, 5)
+    """
+    def __init__(self, width: int = DEFAULT_COUNT_MIN_WIDTH, depth: int = DEFAULT_COUNT_MIN_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _columns(self, word: str) -> List[int]:
+        encoded = word.encode('utf-8', 'surrogatepass')
+        # crc32 with different initial values is used as the family of hash functions
+        return [zlib.crc32(encoded, row) % self.width for row in range(self.depth)]
+
+    def update(self, words: Iterable[str]) -> None:
+        # the columns are calculated once per distinct word and the counters of all the rows are updated at once
+        word_counts = Counter(words)
+        if not word_counts:
+            return
+        columns = np.array([self._columns(word) for word in word_counts], dtype=np.int64).T
+        counts = np.fromiter(word_counts.values(), dtype=np.int64, count=len(word_counts))
+        np.add.at(self.table, (np.arange(self.depth)[:, np.newaxis], columns), counts)
+        self.total += int(counts.sum())
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError(f'Cannot merge sketches of different sizes: '
+                             f'{self.width}x{self.depth} and {other.width}x{other.depth}')
+        self.table += other.table
+        self.total += other.total
+
+    def dump(self, path: str) -> None:
+        with open(path + NOT_FINISHED_EXT, 'wb') as f:
+            np.save(f, self.table)
+        os.rename(path + NOT_FINISHED_EXT, path)
+
+    @staticmethod
+    def load(path: str) -> 'CountMinSketch':
+        """
+        >>> import tempfile
+        >>> sketch = CountMinSketch(width=64, depth=3)
+        >>> sketch.update('a b a c a'.split(' '))
+        >>> with tempfile.TemporaryDirectory() as d:
+        ...     sketch.dump(os.path.join(d, 'sketch'))
+        ...     loaded = CountMinSketch.load(os.path.join(d, 'sketch'))
+        >>> (loaded.width, loaded.depth, loaded.total), bool((loaded.table == sketch.table).all())
+        ((64, 3, 5), True)
+        """
+        with open(path, 'rb') as f:
+            table = np.load(f)
+        sketch = CountMinSketch.__new__(CountMinSketch)
+        sketch.depth, sketch.width = table.shape
+        sketch.table = table
+        # every word is counted once in each row
+        sketch.total = int(table[0].sum())
+        return sketch
+
+    def estimate(self, word: str) -> int:
+        return int(min(self.table[row, column] for row, column in enumerate(self._columns(word))))
+
+    @property
+    def max_overestimation(self) -> float:
+        return math.e / self.width * self.total
+
+    @property
+    def confidence(self) -> float:
+        return 1 - math.exp(-self.depth)
+
+
+_worker_sketch: Optional[CountMinSketch] = None
+
+
+def init_count_heavy_hitters(progress: ProgressChannel, count_min_size: Optional[Tuple[int, int]],
+                             path_to_dump: str) -> None:
+    """
+    To be called in a worker process of a pool. A worker updates a single Count-Min sketch for all the file groups
+    it processes and dumps it when it exits, i.e. the pool has to be closed and joined, not terminated.
+    """
+    global _worker_sketch
+    init_progress_channel(progress)
+    if count_min_size:
+        _worker_sketch = CountMinSketch(*count_min_size)
+        path = os.path.join(path_to_dump, f'{os.getpid()}.{COUNT_MIN_EXT}')
+        Finalize(None, _worker_sketch.dump, args=(path,), exitpriority=10)
+
+
+def count_heavy_hitters(param: Tuple[int, List[bytes], int]) -> Tuple[int, MisraGriesSummary, VocabGrowthSketch]:
+    group_index, file_group, k = param
+    summary = MisraGriesSummary(k)
+    growth_sketch = VocabGrowthSketch()
+    for file in file_group:
+        lines, _ = read_file_contents(file)
+        file_words = [word for line in lines for word in line.split(' ')]
+        summary.update(file_words)
+        if _worker_sketch:
+            _worker_sketch.update(file_words)
+        growth_sketch.add_file(file_words)
+        report_progress(files=1, tokens=len(file_words))
+    return group_index, summary, growth_sketch
+
+
+def load_worker_sketches(path_to_dump: str, count_min_size: Tuple[int, int]) -> CountMinSketch:
+    sketch = CountMinSketch(*count_min_size)
+    for file in os.listdir(path_to_dump):
+        if file.endswith(f'.{COUNT_MIN_EXT}'):
+            sketch.merge(CountMinSketch.load(os.path.join(path_to_dump, file)))
+    return sketch
+
+
+def _vocab_with_estimates(summary: MisraGriesSummary, sketch: Optional[CountMinSketch]) -> Iterator[Tuple[str, int]]:
+    top = summary.top()
+    if not sketch:
+        return iter(top)
+    return iter(sorted(((word, sketch.estimate(word)) for word, _ in top), key=lambda x: x[1], reverse=True))
+
+
+def write_stats(summary: MisraGriesSummary, sketch: Optional[CountMinSketch],
+                growth_sketches: List[VocabGrowthSketch], path_to_stats_file: str) -> None:
+    """
+    The size of the whole vocab and its growth are estimated, the error bounds are written in the lines starting with #.
+    """
+    write_vocab_growth_stats(estimate_vocab_growth(growth_sketches), path_to_stats_file)
+    with open(path_to_stats_file, 'a') as f:
+        f.write(f'# vocab size is estimated with relative error {HyperLogLog().relative_error:.4f}\n')
+        f.write(f'# approximate vocab: top {summary.k} words, {summary.total} words in total\n')
+        f.write(f'# misra-gries: counts are underestimated by at most {summary.max_underestimation}, '
+                f'words occurring more than {summary.max_underestimation} times are all included\n')
+        if sketch:
+            f.write(f'# count-min {sketch.width}x{sketch.depth}: counts are overestimated by at most '
+                    f'{sketch.max_overestimation:.1f} with probability {sketch.confidence:.4f}\n')
+
+
+def calc_approximate_vocab(file_iterator: Iterator[bytes], k: int, vocab_file_path: str, vocab_size_file_path: str,
+                           count_min_size: Optional[Tuple[int, int]] = None) -> None:
+    """
+    :param count_min_size: width and depth of the Count-Min sketch used to estimate the counts.
+    If not specified, the counts from the Misra-Gries summary are written.
+    """
+    file_groups = groupify(shuffle_files(file_iterator), MAX_FILE_GROUPS)
+    params = [(i, file_group, k) for i, file_group in enumerate(file_groups)]
+    growth_sketches = [None] * len(file_groups)
+    summary = MisraGriesSummary(k)
+    path_to_dump = os.path.join(os.path.dirname(vocab_file_path), 'count_min')
+    if os.path.exists(path_to_dump):
+        shutil.rmtree(path_to_dump)
+    os.makedirs(path_to_dump)
+    progress = ProgressChannel()
+    with Pool(initializer=init_count_heavy_hitters, initargs=(progress, count_min_size, path_to_dump)) as pool:
+        with tqdm(pool.imap_unordered(count_heavy_hitters, params), total=len(params)) as progress_bar:
+            for group_index, group_summary, growth_sketch in progress_bar:
+                growth_sketches[group_index] = growth_sketch
+                summary.merge(group_summary)
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+        # the workers dump their sketches when they exit
+        pool.close()
+        pool.join()
+    logger.info(f"Counted words: {progress}")
+    sketch = load_worker_sketches(path_to_dump, count_min_size) if count_min_size else None
+    shutil.rmtree(path_to_dump)
+
+    tmp_vocab_file_path = vocab_file_path + NOT_FINISHED_EXT
+    _dump_vocab_dict(_vocab_with_estimates(summary, sketch), tmp_vocab_file_path, to_literal=False)
+    os.rename(tmp_vocab_file_path, vocab_file_path)
+    write_stats(summary, sketch, growth_sketches, vocab_size_file_path)
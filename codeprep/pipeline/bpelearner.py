@@ -2,22 +2,38 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
+import functools
+import json
 import logging
+import multiprocessing
 import os
-from typing import Tuple, Dict, Set, Optional
+import pickle
+import queue
+import threading
+from typing import Tuple, Dict, Set, Optional, List, Union, Callable, Iterator
 
 from codeprep.bpepkg.bpe_config import BpeConfig, BpeParam, BpeConfigNotSupported
-from codeprep.bpepkg.bpe_encode import escape
-from codeprep.bpepkg.bpe_learn import separate_vocabs, logger, do_merges, create_resulting_vocab, create_bpe_cache
+from codeprep.bpepkg.bpe_encode import escape, ESCAPE_CHAR
+from codeprep.bpepkg import bpe_learn_bounded, wild_bpe
+from codeprep.bpepkg.bpe_learn import separate_vocabs, logger, do_merges, create_resulting_vocab, create_bpe_cache, \
+    sample_vocab, create_sampling_report, split_holdout, get_top_k_merge_overlap, get_top_k_list
 from codeprep.bpepkg.cache import dump_bpe_cache
-from codeprep.bpepkg.merge import MergeList, read_merges, dump_merges
+from codeprep.bpepkg.checkpoint import BpeCheckpointer, find_latest_checkpoint, remove_checkpoints, \
+    DEFAULT_CHECKPOINT_EVERY_N_MERGES, DEFAULT_CHECKPOINT_EVERY_SECONDS, _get_fork_context
+from codeprep.bpepkg.merge import MergeList, Merge, read_merges, dump_merges
+from codeprep.bpepkg.performance_stats import BpePerformanceStatsCollector, dump_performance_stats, STATS_FORMATS
 from codeprep.pipeline import stages
 from codeprep.pipeline.bperegistry import get_max_merges, MERGES_FILE_NAME, MERGES_CACHE_FILE_NAME, \
-    RESULTING_VOCAB_FILE_NAME, BPE_REASSEMBLED_VOCAB_FILE_NAME
-from codeprep.pipeline.dataset import Dataset
-from codeprep.pipeline.vocab import _dump_vocab_dict, _load_vocab_dict
+    RESULTING_VOCAB_FILE_NAME, BPE_REASSEMBLED_VOCAB_FILE_NAME, CHECKPOINTS_DIR_NAME, SPILL_DIR_NAME, \
+    SAMPLED_DIR_NAME, SAMPLING_REPORT_FILE_NAME, PERFORMANCE_STATS_FILE_SUFFIX, HOLDOUT_VOCAB_FILE_NAME
+from codeprep.pipeline.dataset import Dataset, NOT_FINISHED_EXTENSION
+from codeprep.pipeline.vocab import _dump_vocab_dict, _load_vocab_dict, _read_vocab_dict
 from codeprep.util import to_non_literal_str
 
+CLASSIC_ENGINE = 'classic'
+WILD_ENGINE = 'wild'
+ENGINES = [CLASSIC_ENGINE, WILD_ENGINE]
+
 
 def get_base_vocab(dataset: Dataset) -> Tuple[Dict[str, int], Dict[str, int]]:
     stages.run_until_base_bpe_vocab(dataset)
@@ -45,6 +61,11 @@ def check_if_bpe_config_supported(bpe_config: BpeConfig):
         raise BpeConfigNotSupported('BPE with case encoded in prefix is not yet supported')
 
 
+def get_other_vocab(dataset: Dataset) -> Dict[str, int]:
+    _, other_vocab = get_base_vocab(dataset)
+    return {escape(k, merged=True): v for k, v in other_vocab.items()}
+
+
 def prepare_vocabs(dataset: Dataset, dir_with_most_merges, starting_from_scratch):
     if starting_from_scratch:
         base_bpe_vocab, other_vocab = get_base_vocab(dataset)  # TODO extract this into stages
@@ -59,6 +80,30 @@ def prepare_vocabs(dataset: Dataset, dir_with_most_merges, starting_from_scratch
     return split_base_vocab, other_vocab
 
 
+def read_split_base_vocab(dataset: Dataset, dir_with_most_merges: Optional[str],
+                          other_vocab: Dict[str, int]) -> Iterator[Tuple[str, int]]:
+    """
+    Same as `prepare_vocabs` but the split base vocab is read from the vocab file lazily, word by word,
+    so that it does not have to be in memory all at once. `other_vocab` is filled while reading.
+    """
+    if dir_with_most_merges:
+        path_to_bpe_vocab_file = os.path.join(dir_with_most_merges, BPE_REASSEMBLED_VOCAB_FILE_NAME)
+        non_bpe_vocab = {escape(k, merged=True) for k in load_nonbpe_vocab(dataset)}
+        for word, freq in _read_vocab_dict(path_to_bpe_vocab_file):
+            if word in non_bpe_vocab:
+                other_vocab[word] = freq
+            else:
+                yield word, freq
+    else:
+        stages.run_until_base_bpe_vocab(dataset)
+        non_bpe_vocab = load_nonbpe_vocab(dataset)
+        for word, freq in _read_vocab_dict(dataset.path_to_bpe_vocab_file):
+            if word in non_bpe_vocab:
+                other_vocab[escape(word, merged=True)] = freq
+            else:
+                yield escape(" ".join(word)), freq
+
+
 def get_dir_with_most_merges(dataset_bpe_path, n_merges) -> Optional[str]:
     max_merges = get_max_merges(dataset_bpe_path, n_merges)
     if not max_merges:
@@ -68,48 +113,340 @@ def get_dir_with_most_merges(dataset_bpe_path, n_merges) -> Optional[str]:
     return dir_with_most_merges
 
 
-def save_results(split_base_vocab, merges, new_bpe_dir):
-
-    os.makedirs(new_bpe_dir)
+def save_results(split_base_vocab, merges, new_bpe_dir, sampling_report: Optional[Dict] = None):
+    # the dir is renamed only when all the files are written,
+    # so that a partially written dir is never picked up as learned merges
+    not_finished_bpe_dir = new_bpe_dir + NOT_FINISHED_EXTENSION
+    os.makedirs(not_finished_bpe_dir, exist_ok=True)
 
     resulting_vocab = create_resulting_vocab(split_base_vocab)
     resulting_vocab_sorted = sorted(resulting_vocab.items(), key=lambda x: x[1], reverse=True)
-    _dump_vocab_dict(resulting_vocab_sorted, os.path.join(new_bpe_dir, RESULTING_VOCAB_FILE_NAME))
+    _dump_vocab_dict(resulting_vocab_sorted, os.path.join(not_finished_bpe_dir, RESULTING_VOCAB_FILE_NAME))
 
     bpe_cache = create_bpe_cache(split_base_vocab)
-    dump_bpe_cache(bpe_cache, os.path.join(new_bpe_dir, MERGES_CACHE_FILE_NAME))
+    dump_bpe_cache(bpe_cache, os.path.join(not_finished_bpe_dir, MERGES_CACHE_FILE_NAME))
 
-    dump_merges(merges, os.path.join(new_bpe_dir, MERGES_FILE_NAME))
-    _dump_vocab_dict(split_base_vocab.items(), os.path.join(new_bpe_dir, BPE_REASSEMBLED_VOCAB_FILE_NAME))
+    dump_merges(merges, os.path.join(not_finished_bpe_dir, MERGES_FILE_NAME))
+    _dump_vocab_dict(split_base_vocab.items(), os.path.join(not_finished_bpe_dir, BPE_REASSEMBLED_VOCAB_FILE_NAME))
+    if sampling_report is not None:
+        with open(os.path.join(not_finished_bpe_dir, SAMPLING_REPORT_FILE_NAME), 'w') as f:
+            json.dump(sampling_report, f, indent=2)
+    os.rename(not_finished_bpe_dir, new_bpe_dir)
     logger.info(f'Bpe output files are saved into {new_bpe_dir} folder')
 
 
-def run(dataset: Dataset, n_merges: int, bpe_config: BpeConfig) -> None:
+class SnapshotNotSavedError(Exception):
+    pass
+
+
+class BpeSnapshotWriter(object):
+    """
+    Saves bpe output files for intermediate numbers of merges in the background
+    while the learner continues doing merges.
+
+    Like in `BpeCheckpointer`, where `fork` is available the files are written by a forked process, which gets
+    a copy-on-write snapshot of the learner's memory, so the merge loop only pauses for the `fork()` itself.
+    Elsewhere they are written by a background thread, which holds the GIL most of the time,
+    and the split base vocab passed to `save` must not be modified afterwards unless it is a `PrunedSplitVocab`,
+    which is pickled right away.
+
+    A `PrunedSplitVocab` from the memory-bounded learner is only assembled into the vocab by the writer,
+    so the merge loop does not have to build a dict of all the words for every snapshot.
+
+    :param create_sampling_report: if passed, the report it creates for the merges of a snapshot is saved with them
+    """
+    def __init__(self, dataset_bpe_path: str, already_done_merges: MergeList, snapshot_merges: List[int],
+                 other_vocab: Dict[str, int],
+                 create_sampling_report: Optional[Callable[[MergeList], Dict]] = None):
+        self.dataset_bpe_path = dataset_bpe_path
+        self.already_done_merges = already_done_merges
+        self.other_vocab = other_vocab
+        self.create_sampling_report = create_sampling_report
+        self._due_merges = {n - len(already_done_merges) for n in snapshot_merges if n > len(already_done_merges)}
+        self._fork_context = _get_fork_context()
+        self._writers: List[Tuple[int, multiprocessing.process.BaseProcess]] = []
+        self._queue = queue.Queue()
+        self._error: Optional[Exception] = None
+        self._writer = None
+        if not self._fork_context:
+            self._writer = threading.Thread(target=self._write_all, daemon=True)
+            self._writer.start()
+
+    def is_due(self, merges_done: int) -> bool:
+        return merges_done in self._due_merges
+
+    def save(self, split_base_vocab: Union[Dict[str, int], bpe_learn_bounded.PrunedSplitVocab],
+             merges: MergeList) -> None:
+        merges = self.already_done_merges + merges
+        if self._fork_context:
+            writer = self._fork_context.Process(target=self._write, args=(split_base_vocab, merges), daemon=True)
+            writer.start()
+            self._writers.append((len(merges), writer))
+        else:
+            if isinstance(split_base_vocab, bpe_learn_bounded.PrunedSplitVocab):
+                # the store is modified in place by the following merges
+                split_base_vocab = pickle.dumps(split_base_vocab, protocol=pickle.HIGHEST_PROTOCOL)
+            self._queue.put((split_base_vocab, merges))
+
+    def _write(self, split_base_vocab: Union[Dict[str, int], bpe_learn_bounded.PrunedSplitVocab, bytes],
+               merges: MergeList) -> None:
+        try:
+            if isinstance(split_base_vocab, bytes):
+                split_base_vocab = pickle.loads(split_base_vocab)
+            if isinstance(split_base_vocab, bpe_learn_bounded.PrunedSplitVocab):
+                split_base_vocab = split_base_vocab.assemble(merges)
+            sampling_report = self.create_sampling_report(merges) if self.create_sampling_report else None
+            save_results({**split_base_vocab, **self.other_vocab}, merges,
+                         os.path.join(self.dataset_bpe_path, str(len(merges))), sampling_report)
+        except Exception as err:
+            logger.error(f'Could not save bpe output files for {len(merges)} merges: {err}')
+            raise
+
+    def _write_all(self) -> None:
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            try:
+                self._write(*task)
+            except Exception as err:
+                self._error = err
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+        for n_merges, writer in self._writers:
+            writer.join()
+            if writer.exitcode:
+                self._error = SnapshotNotSavedError(f'Writing bpe output files for {n_merges} merges failed '
+                                                    f'with the exit code {writer.exitcode}')
+        if self._error:
+            raise self._error
+
+
+def load_holdout(dataset: Dataset, dataset_bpe_path: str) -> Dict[str, int]:
+    path_to_holdout = os.path.join(dataset_bpe_path, HOLDOUT_VOCAB_FILE_NAME)
+    if os.path.exists(path_to_holdout):
+        return _load_vocab_dict(path_to_holdout)
+    logger.warning("Merges were learned on a sample before the holdout was saved, "
+                   "the words of the holdout might have been in the sample.")
+    split_base_vocab, _ = prepare_vocabs(dataset, None, starting_from_scratch=True)
+    holdout, _ = split_holdout(split_base_vocab)
+    _dump_vocab_dict(holdout.items(), path_to_holdout)
+    return holdout
+
+
+def create_dataset_sampling_report(dataset: Dataset, holdout: Dict[str, int], sample_rate: float,
+                                   merges: MergeList) -> Dict:
+    """
+    The report from `bpe_learn.create_sampling_report`. If the exact merges have already been learned
+    for the dataset, their actual overlap with `merges` is added as `top_k_merge_overlap_with_exact`.
+    """
+    report = create_sampling_report(holdout, merges, sample_rate)
+    path_to_exact_merges = os.path.join(dataset.bpe_path, str(len(merges)), MERGES_FILE_NAME)
+    if os.path.exists(path_to_exact_merges):
+        exact_merges = read_merges(path_to_exact_merges)
+        report['top_k_merge_overlap_with_exact'] = {k: get_top_k_merge_overlap(merges, exact_merges, k)
+                                                    for k in get_top_k_list(len(merges))}
+    logger.info(f'Sampling report for {len(merges)} merges, top-k merge overlap on the holdout: '
+                f'{report["holdout_top_k_merge_overlap"]}, compression ratios: {report["compression_ratio"]}')
+    return report
+
+
+def run(dataset: Dataset, n_merges: Union[int, List[int]], bpe_config: BpeConfig,
+        checkpoint_every_n_merges: int = DEFAULT_CHECKPOINT_EVERY_N_MERGES,
+        checkpoint_every_seconds: float = DEFAULT_CHECKPOINT_EVERY_SECONDS,
+        min_word_freq: int = bpe_learn_bounded.DEFAULT_MIN_WORD_FREQ,
+        max_pairs_in_memory: Optional[int] = None,
+        sample_rate: Optional[float] = None,
+        stats_every_n_merges: int = 0,
+        stats_format: str = 'json') -> None:
+    """
+    :param n_merges: the number of merges to be learned. If a list is passed, bpe output files are saved
+    for each number of merges in the list, all of them are produced in one pass.
+    :param min_word_freq: words occurring less often are not used to learn merges
+    :param max_pairs_in_memory: if passed, pair statistics exceeding this number are spilled to disk.
+    If this or `min_word_freq` is set, the memory-bounded learner from `bpe_learn_bounded` is used.
+    :param sample_rate: if passed, merges are learned on a sample of the vocab of this size. Such merges are saved
+    separately from the exact ones, together with a report on how much they differ from exact ones.
+    The words of a holdout used by the report are excluded from the sample.
+    :param stats_every_n_merges: if passed, performance stats of the learner are recorded every n merges
+    and saved next to the bpe output dir in `stats_format` ('json' or 'csv')
+    """
 
     check_if_bpe_config_supported(bpe_config)
+    if stats_format not in STATS_FORMATS:
+        raise ValueError(f'Unknown performance stats format: {stats_format}, possible values: {STATS_FORMATS}')
     dataset_bpe_path = dataset.bpe_path
+    if sample_rate:
+        dataset_bpe_path = os.path.join(dataset_bpe_path, SAMPLED_DIR_NAME, f'{sample_rate:g}')
+        os.makedirs(dataset_bpe_path, exist_ok=True)
+    checkpoint_dir = os.path.join(dataset_bpe_path, CHECKPOINTS_DIR_NAME)
+
+    all_n_merges = sorted(set(n_merges)) if isinstance(n_merges, list) else [n_merges]
+    n_merges_to_learn = [n for n in all_n_merges if not os.path.exists(os.path.join(dataset_bpe_path, str(n)))]
+    if not n_merges_to_learn:
+        logger.info("Merges already learned!")
+        return
+    # we can only resume from a state with not more merges than any of the snapshots still to be written
+    max_merges_to_resume_from = n_merges_to_learn[0]
 
-    dir_with_most_merges = get_dir_with_most_merges(dataset_bpe_path, n_merges)
+    dir_with_most_merges = get_dir_with_most_merges(dataset_bpe_path, max_merges_to_resume_from)
 
     if dir_with_most_merges:
         logger.info("Using existing merges...")
         already_done_merges = read_merges(os.path.join(dir_with_most_merges, MERGES_FILE_NAME))
     else:
-        logger.info("Starting encoding from scratch.    ..")
         already_done_merges = MergeList()
 
-    split_base_vocab, other_vocab = prepare_vocabs(dataset, dir_with_most_merges,
-                                                   starting_from_scratch=not dir_with_most_merges)
+    use_bounded_learner = max_pairs_in_memory or min_word_freq > bpe_learn_bounded.DEFAULT_MIN_WORD_FREQ
+    spill_dir = os.path.join(dataset_bpe_path, SPILL_DIR_NAME)
+    holdout = None
+    checkpoint = find_latest_checkpoint(checkpoint_dir, max_merges_to_resume_from)
+    if checkpoint and len(checkpoint.merges) > len(already_done_merges):
+        logger.info(f"Resuming from the checkpoint with {len(checkpoint.merges)} merges...")
+        already_done_merges = checkpoint.merges
+        split_base_vocab = checkpoint.split_base_vocab
+        other_vocab = get_other_vocab(dataset)
+    elif use_bounded_learner and not (sample_rate and not dir_with_most_merges):
+        if not dir_with_most_merges:
+            logger.info("Starting encoding from scratch...")
+        other_vocab = {}
+        # read lazily, directly into the compact store of the memory-bounded learner below
+        split_base_vocab = read_split_base_vocab(dataset, dir_with_most_merges, other_vocab)
+    else:
+        if not dir_with_most_merges:
+            logger.info("Starting encoding from scratch...")
+        split_base_vocab, other_vocab = prepare_vocabs(dataset, dir_with_most_merges,
+                                                       starting_from_scratch=not dir_with_most_merges)
+        if sample_rate and not dir_with_most_merges:
+            holdout, split_base_vocab = split_holdout(split_base_vocab)
+            _dump_vocab_dict(holdout.items(), os.path.join(dataset_bpe_path, HOLDOUT_VOCAB_FILE_NAME))
+            split_base_vocab = sample_vocab(split_base_vocab, sample_rate)
+            logger.info(f"Learning on a sample of {len(split_base_vocab)} words, "
+                        f"{len(holdout)} words are held out for the sampling report")
+    if sample_rate and holdout is None:
+        holdout = load_holdout(dataset, dataset_bpe_path)
+    create_report = functools.partial(create_dataset_sampling_report, dataset, holdout, sample_rate) \
+        if sample_rate else None
+
+    # the vocab from the checkpoint is only referenced by `split_base_vocab` from now on
+    checkpoint = None
+    checkpointer = BpeCheckpointer(checkpoint_dir, already_done_merges,
+                                   checkpoint_every_n_merges, checkpoint_every_seconds)
+    if isinstance(split_base_vocab, bpe_learn_bounded.PrunedSplitVocab) and not use_bounded_learner:
+        split_base_vocab = split_base_vocab.assemble(already_done_merges)
+    elif use_bounded_learner and not isinstance(split_base_vocab, bpe_learn_bounded.PrunedSplitVocab):
+        # no reference to the dict is kept, so that it is freed once its words are in the compact store
+        split_base_vocab = bpe_learn_bounded.create_pruned_split_vocab(
+            split_base_vocab.items() if isinstance(split_base_vocab, dict) else split_base_vocab,
+            min_word_freq, spill_dir, checkpointer)
 
+    n_merges, snapshot_merges = n_merges_to_learn[-1], n_merges_to_learn[:-1]
     logger.info("Learning bpe codes...")
-    split_base_vocab, merges = do_merges(split_base_vocab, n_merges - len(already_done_merges))
+    snapshot_writer = BpeSnapshotWriter(dataset_bpe_path, already_done_merges, snapshot_merges, other_vocab,
+                                        create_report)
+    if len(already_done_merges) in snapshot_merges:
+        # the learning is resumed exactly at one of the snapshots, none of the merges below reaches it
+        logger.info(f"Saving bpe output files for {len(already_done_merges)} merges the learning is resumed from")
+        snapshot_writer.save(split_base_vocab, MergeList())
+    stats_collector = BpePerformanceStatsCollector(stats_every_n_merges, len(already_done_merges)) \
+        if stats_every_n_merges else None
+    if use_bounded_learner:
+        if stats_collector:
+            logger.warning("Performance stats are not recorded by the memory-bounded learner")
+        split_base_vocab, merges = bpe_learn_bounded.do_merges(
+            split_base_vocab, n_merges - len(already_done_merges),
+            min_word_freq=min_word_freq,
+            max_pairs_in_memory=max_pairs_in_memory or bpe_learn_bounded.DEFAULT_MAX_PAIRS_IN_MEMORY,
+            already_done_merges=already_done_merges,
+            checkpointer=checkpointer, snapshot_writer=snapshot_writer, spill_dir=spill_dir)
+    else:
+        split_base_vocab, merges = do_merges(split_base_vocab, n_merges - len(already_done_merges), checkpointer,
+                                             snapshot_writer, stats_collector)
+    checkpointer.close()
+    snapshot_writer.close()
     for k, v in other_vocab.items():
         split_base_vocab[k] = v
     merges = already_done_merges + merges
+    if stats_collector and stats_collector.entries:
+        path_to_stats = os.path.join(dataset_bpe_path, f'{len(merges)}{PERFORMANCE_STATS_FILE_SUFFIX}.{stats_format}')
+        dump_performance_stats(stats_collector.entries, path_to_stats)
+        logger.info(f'Performance stats are saved to {path_to_stats}')
 
     new_bpe_dir = os.path.join(dataset_bpe_path, str(len(merges)))
     if os.path.exists(new_bpe_dir):
         logging.info("Merges already learned!")
         return
 
-    save_results(split_base_vocab, merges, new_bpe_dir)
\ No newline at end of file
+    save_results(split_base_vocab, merges, new_bpe_dir, create_report(merges) if create_report else None)
+    remove_checkpoints(checkpoint_dir, up_to_merges=len(merges))
+
+
+def to_codeprep_merge(wild_merge: str, occurences: int, ascii_only: bool = False) -> Optional[Merge]:
+    """
+    Converts a merge learned by wild bpe on raw text into a merge applicable to the words of the preprocessed corpus.
+    Merges containing whitespace can never be applied to a word, so they are skipped.
+    All the merges building up on a skipped merge contain whitespace as well, so the remaining merges are consistent.
+
+    >>> to_codeprep_merge('a@ b', 3).pair
+    ('a@@', 'b')
+    >>> to_codeprep_merge('a \\n', 3) is None
+    True
+    >>> to_codeprep_merge('a \xA0b', 3) is None
+    True
+    >>> to_codeprep_merge('a ж', 3, ascii_only=True) is None
+    True
+    """
+    left, right = wild_merge.split(' ')
+    merged = left + right
+    if any(c.isspace() for c in merged):
+        return None
+    if ascii_only and any(ord(c) >= 128 for c in merged):
+        return None
+    return Merge((left.replace(ESCAPE_CHAR, 2 * ESCAPE_CHAR), right.replace(ESCAPE_CHAR, 2 * ESCAPE_CHAR)),
+                 freq=occurences)
+
+
+def save_wild_results(merges: MergeList, new_bpe_dir: str) -> None:
+    not_finished_bpe_dir = new_bpe_dir + NOT_FINISHED_EXTENSION
+    os.makedirs(not_finished_bpe_dir, exist_ok=True)
+    dump_merges(merges, os.path.join(not_finished_bpe_dir, MERGES_FILE_NAME))
+    # there is no vocab to cache the encoding of, the cache file is still written to keep the registry layout
+    dump_bpe_cache({}, os.path.join(not_finished_bpe_dir, MERGES_CACHE_FILE_NAME))
+    os.rename(not_finished_bpe_dir, new_bpe_dir)
+    logger.info(f'Bpe output files are saved into {new_bpe_dir} folder')
+
+
+def run_wild(dataset: Dataset, n_merges: Union[int, List[int]], bpe_config: BpeConfig,
+             memory_budget_mb: Optional[float] = wild_bpe.DEFAULT_MEMORY_BUDGET_MB) -> None:
+    """
+    Learns bpe codes with wild bpe in one pass over the raw characters of the dataset files,
+    without building the base vocab with the preprocessing pipeline.
+    Wild bpe cannot resume from existing merges, so all the merges are learned from scratch.
+    """
+    check_if_bpe_config_supported(bpe_config)
+    all_n_merges = sorted(set(n_merges)) if isinstance(n_merges, list) else [n_merges]
+    n_merges_to_learn = [n for n in all_n_merges if not os.path.exists(os.path.join(dataset.bpe_path, str(n)))]
+    if not n_merges_to_learn:
+        logger.info("Merges already learned!")
+        return
+
+    logger.info("Learning bpe codes with wild bpe...")
+    blocks = wild_bpe.get_block_iterator_for_files(dataset.original.file_iterator())
+    ascii_only = bpe_config.get_param_value(BpeParam.UNICODE) == 'no'
+    merges = MergeList()
+    for wild_merge, occurences, _ in wild_bpe.run(blocks, memory_budget_mb=memory_budget_mb):
+        merge = to_codeprep_merge(wild_merge, occurences, ascii_only)
+        if not merge:
+            continue
+        merges.append(merge)
+        if len(merges) == n_merges_to_learn[0]:
+            save_wild_results(merges, os.path.join(dataset.bpe_path, str(len(merges))))
+            n_merges_to_learn.pop(0)
+            if not n_merges_to_learn:
+                return
+    if merges and n_merges_to_learn:
+        logger.warning(f'Only {len(merges)} merges could be learned.')
+        save_wild_results(merges, os.path.join(dataset.bpe_path, str(len(merges))))
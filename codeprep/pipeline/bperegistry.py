@@ -24,6 +24,12 @@ RESULTING_VOCAB_FILE_NAME = "vocab_res.txt"
 MERGES_FILE_NAME = "merges.txt"
 MERGES_CACHE_FILE_NAME = "merges_cache.txt"
 BPE_CODES_ID_FILENAME = '.name'
+CHECKPOINTS_DIR_NAME = 'checkpoints'
+SPILL_DIR_NAME = 'spill'
+SAMPLED_DIR_NAME = 'sampled'
+SAMPLING_REPORT_FILE_NAME = 'sampling_report.json'
+HOLDOUT_VOCAB_FILE_NAME = 'holdout_vocab.txt'
+PERFORMANCE_STATS_FILE_SUFFIX = '.stats'
 
 USER_PREDEFINED_BPE_CODES = ['1k', '5k', '10k']
 PREDEFINED_BPE_CODES = USER_PREDEFINED_BPE_CODES + ['0']
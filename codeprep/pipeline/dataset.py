@@ -2,15 +2,17 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
-import ast
+import glob
 import logging
 import os
-from typing import Type, Optional, Generator, List
+from typing import Type, Optional, Generator, List, Iterable
 
 from codeprep.bpepkg.bpe_config import BpeConfig
 from codeprep.config import DEFAULT_PARSED_DATASETS_DIR, DEFAULT_PREP_DATASETS_DIR, USER_BPE_DIR, DEFAULT_FILE_LIST_DIR, \
-    USER_VOCAB_DIR, DEFAULT_CORPUS_SIZES_DIR
+    USER_VOCAB_DIR, DEFAULT_CORPUS_SIZES_DIR, DEFAULT_WORD_BOUNDARIES_DIR, DEFAULT_NUMERICALIZED_DIR
 from codeprep.dirutils import walk_and_save, get_timestamp
+from codeprep.filelist import read_file_list, count_files_in_list
+from codeprep.pipeline.manifest import Manifest, scan, get_manifest_path, read_manifest_header
 from codeprep.pipeline.bperegistry import get_codes_id_by_bpe_path, create_new_id_from, write_bpe_codes_id, \
     CustomBpeConfig
 from codeprep.pipeline.vocab import VOCAB_FILENAME
@@ -25,11 +27,14 @@ DIR_LIST_FILENAME = "dirlist"
 
 PARSED_EXTENSION = ".parsed"
 PREPROCESSED_EXTENSION = ".prep"
+WORD_BOUNDARIES_EXTENSION = ".wb"
 NOT_FINISHED_EXTENSION = ".part"
 ARCHIVED_EXT = "archived"
 
 NONBPE_VOCAB_FILENAME = 'nonbpe_vocab'
 
+TIMESTAMP_GLOB = '??-??-??T??-??-??'
+
 
 class SubDataset(object):
     def __init__(self, dataset: 'Dataset', path: str, suffix: str = ''):
@@ -51,15 +56,22 @@ class SubDataset(object):
     def is_outdated(self) -> bool:
         return is_path_outdated(self.path)
 
-    def file_iterator(self) -> Generator[bytes, None, None]:
+    def file_iterator(self, files: Optional[Iterable[bytes]] = None) -> Generator[bytes, None, None]:
+        """
+        :param files: paths relative to the original dataset as returned by `Dataset.get_all_files()`,
+        all the files of the dataset by default
+        """
         encoded_path = self.path.encode()
         encoded_suffix = self._suffix.encode()
-        for file in self._dataset.get_all_files():
+        for file in (files if files is not None else self._dataset.get_all_files()):
             if os.path.isfile(encoded_path):
                 yield encoded_path + encoded_suffix
             else:
                 yield os.path.join(encoded_path, file + encoded_suffix)
 
+    def count_files(self) -> Optional[int]:
+        return self._dataset.count_files()
+
     def get_new_file_name(self, file_path: bytes, new_subdataset: 'SubDataset') -> bytes:
         encoded_path = self.path.encode()
         rel_path = os.path.relpath(file_path, encoded_path)
@@ -101,10 +113,12 @@ class Dataset(object):
         self._custom_bpe_config = custom_bpe_config
         self._bpe_config = bpe_config
         self._dataset_last_modified = get_timestamp(path)
+        self._manifest = None
 
         self._original = SubDataset(self, self.path)
         self._parsed = SubDataset(self, self._get_path_to_parsed_dataset(), suffix=PARSED_EXTENSION)
         self._preprocessed = SubDataset(self, self._get_path_to_prep_dataset(overridden_path_to_prep_dataset), suffix=PREPROCESSED_EXTENSION)
+        self._word_boundaries = SubDataset(self, self._get_path_to_word_boundaries(), suffix=WORD_BOUNDARIES_EXTENSION)
 
     def __eq__(self, o: object) -> bool:
         if isinstance(o, Dataset):
@@ -116,7 +130,8 @@ class Dataset(object):
                    self._dataset_last_modified == o._dataset_last_modified and \
                    self._original == o._original and \
                    self._parsed == o._parsed and \
-                   self._preprocessed == o._preprocessed
+                   self._preprocessed == o._preprocessed and \
+                   self._word_boundaries == o._word_boundaries
         return False
 
     #####################################################
@@ -169,11 +184,42 @@ class Dataset(object):
 
     @property
     def get_dataset_dir_name(self) -> str:
-        name = f'{self.name}_{self.dataset_last_modified}'
+        return self._get_dataset_dir_name(self.dataset_last_modified)
+
+    def _get_dataset_dir_name(self, timestamp: str) -> str:
+        name = f'{self.name}_{timestamp}'
         if self._normalized_extension_list:
             name += ('_' + "_".join(self._normalized_extension_list))
         return name
 
+    @property
+    def manifest(self) -> Optional[Manifest]:
+        """
+        Current state of the files of the dataset. Not available if the dataset is a single file.
+        """
+        if self._manifest is None and os.path.isdir(self.path):
+            self._manifest = scan(os.path.abspath(self.path), self._normalized_extension_list)
+        return self._manifest
+
+    def find_previous_build(self, path: str) -> Optional[str]:
+        """
+        :param path: path to an output of the pipeline, e.g. parsed dataset or vocab dir
+        :return: path to the same output built when the dataset had a different modification timestamp
+        (so that the output can be updated instead of being built from scratch), None if there is no such output
+        """
+        dataset_dir_name = self.get_dataset_dir_name
+        if dataset_dir_name not in path:
+            return None
+        placeholder = '\0'
+        pattern = glob.escape(path.replace(dataset_dir_name, self._get_dataset_dir_name(placeholder)))
+        candidates = []
+        for candidate in glob.glob(pattern.replace(placeholder, TIMESTAMP_GLOB)):
+            manifest_path = get_manifest_path(candidate)
+            if candidate != path and os.path.exists(manifest_path) \
+                    and read_manifest_header(manifest_path)['original_path'] == os.path.abspath(self.path):
+                candidates.append((os.path.getmtime(manifest_path), candidate))
+        return max(candidates)[1] if candidates else None
+
     @property
     def parsed(self) -> SubDataset:
         return self._parsed
@@ -201,6 +247,16 @@ class Dataset(object):
 
         return os.path.join(prefix, basename)
 
+    @property
+    def word_boundaries(self) -> SubDataset:
+        """
+        Word boundaries of the preprocessed files, each written as an array of uint32 token indices.
+        """
+        return self._word_boundaries
+
+    def _get_path_to_word_boundaries(self) -> str:
+        return os.path.join(DEFAULT_WORD_BOUNDARIES_DIR, os.path.basename(self.preprocessed.path))
+
     @property
     def original(self) -> SubDataset:
         return self._original
@@ -231,6 +287,16 @@ class Dataset(object):
     def path_to_bpe_vocab_file(self) -> str:
         return os.path.join(self.base_bpe_vocab_path, VOCAB_FILENAME)
 
+    @property
+    def all_vocab_paths(self) -> List[str]:
+        """
+        Dirs of the vocabs calculated from the preprocessed dataset: the vocab and the base bpe vocab
+        if the dataset is preprocessed to learn bpe (it is usually the same dir).
+        """
+        if self._bpe_config and self.base_bpe_vocab_path != self.vocab_path:
+            return [self.vocab_path, self.base_bpe_vocab_path]
+        return [self.vocab_path]
+
     @property
     def path_to_nonbpe_vocab_file(self) -> str:
         return os.path.join(self.base_bpe_vocab_path if self._bpe_config else self.vocab_path, NONBPE_VOCAB_FILENAME)
@@ -251,6 +317,10 @@ class Dataset(object):
     def path_to_prep_corpus_size_file(self) -> str:
         return os.path.join(DEFAULT_CORPUS_SIZES_DIR, f'{os.path.basename(self.preprocessed.path)}')
 
+    @property
+    def path_to_numericalized_corpus(self) -> str:
+        return os.path.join(DEFAULT_NUMERICALIZED_DIR, f'{os.path.basename(self.preprocessed.path)}')
+
     def get_all_files(self, return_dirs_instead_of_regular_files: bool=False) -> Generator[bytes, None, None]:
         if self.files_need_to_be_saved():
             if not os.path.exists(self.path_to_file_list_folder):
@@ -263,9 +333,15 @@ class Dataset(object):
             set_path_ready(self.path_to_file_list_folder)
         else:
             file_to_save_to = DIR_LIST_FILENAME if return_dirs_instead_of_regular_files else FILE_LIST_FILENAME
-            with open(os.path.join(self.path_to_file_list_folder, file_to_save_to)) as f:
-                for line in f:
-                    yield ast.literal_eval(line)
+            yield from read_file_list(os.path.join(self.path_to_file_list_folder, file_to_save_to))
+
+    def count_files(self) -> Optional[int]:
+        """
+        :return: the number of files in the dataset if the list of files has already been saved, None otherwise
+        """
+        if self.files_need_to_be_saved():
+            return None
+        return count_files_in_list(os.path.join(self.path_to_file_list_folder, FILE_LIST_FILENAME))
 
     ###################################
 
@@ -275,6 +351,11 @@ class Dataset(object):
     def __str__(self) -> str:
         return self.to_summary()
 
+    def invalidate_file_list(self) -> None:
+        modif_file = _get_last_modif_file_path_for_dir(self.path_to_file_list_folder)
+        if os.path.exists(modif_file):
+            os.remove(modif_file)
+
     def files_need_to_be_saved(self) -> bool:
         return not is_path_ready(self.path_to_file_list_folder) or is_path_outdated(self.path_to_file_list_folder)
 
@@ -314,6 +395,18 @@ def archive_path(path: str) -> None:
         os.makedirs(DEFAULT_PREP_DATASETS_DIR)
     os.rename(path, os.path.join(DEFAULT_PREP_DATASETS_DIR, f'{os.path.basename(path)}.{ARCHIVED_EXT}.{timestamp}'))
     os.rename(modif_file, os.path.join(DEFAULT_PREP_DATASETS_DIR, f'{os.path.basename(modif_file)}.{ARCHIVED_EXT}.{timestamp}'))
+    if os.path.exists(get_manifest_path(path)):
+        os.remove(get_manifest_path(path))
+
+
+def move_path(path: str, new_path: str) -> None:
+    """
+    Moves the output of the pipeline together with its metadata files.
+    """
+    os.rename(path, new_path)
+    for get_metadata_path in [_get_last_modif_file_path_for_dir, get_manifest_path]:
+        if os.path.exists(get_metadata_path(path)):
+            os.rename(get_metadata_path(path), get_metadata_path(new_path))
 
 
 def normalize_extension_string(extensions: Optional[str]) -> Optional[List[str]]:
@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Manifest of a dataset: size, modification time and, optionally, the content hash of each file.
+
+A manifest is saved next to each output of the pipeline (parsed and preprocessed dataset, vocab),
+recording the state of the original dataset the output was built from. Comparing it with the current state
+gives the files that have been added, changed and removed, so that only those have to be processed again.
+"""
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Optional, List, NamedTuple
+
+from codeprep.dirutils import parallel_walk
+from codeprep.fileutils import has_one_of_extensions
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_EXT = 'manifest'
+NO_HASH = b'-'
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class ManifestEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    hash: Optional[bytes] = None
+
+
+class ManifestDelta(NamedTuple):
+    added: List[bytes]
+    changed: List[bytes]
+    removed: List[bytes]
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.changed or self.removed)
+
+    def __str__(self) -> str:
+        return f'{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed'
+
+
+def get_manifest_path(path: str) -> str:
+    dirname, filename = os.path.split(path)
+    return os.path.join(dirname, f'.{filename}.{MANIFEST_EXT}')
+
+
+def hash_file(path: bytes) -> bytes:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            h.update(block)
+    return h.hexdigest().encode()
+
+
+class Manifest(object):
+    """
+    >>> manifest = Manifest('/dataset', {b'./a.java': ManifestEntry(10, 1), b'./b.java': ManifestEntry(5, 1)})
+    >>> new_manifest = Manifest('/dataset', {b'./a.java': ManifestEntry(12, 2), b'./c.java': ManifestEntry(1, 1)})
+    >>> manifest.diff(new_manifest)
+    ManifestDelta(added=[b'./c.java'], changed=[b'./a.java'], removed=[b'./b.java'])
+    >>> manifest.digest == Manifest('/dataset', dict(reversed(list(manifest.entries.items())))).digest
+    True
+    """
+    def __init__(self, original_path: str, entries: Dict[bytes, ManifestEntry]):
+        self.original_path = original_path
+        self.entries = entries
+
+    @property
+    def digest(self) -> str:
+        """
+        Identifies the state of the dataset, hashes are not taken into account.
+        """
+        h = hashlib.sha1()
+        for path in sorted(self.entries):
+            entry = self.entries[path]
+            h.update(b'%d\t%d\t%s\n' % (entry.size, entry.mtime_ns, path))
+        return h.hexdigest()
+
+    def _absolute(self, path: bytes) -> bytes:
+        return os.path.join(self.original_path.encode(), path)
+
+    def diff(self, new: 'Manifest') -> ManifestDelta:
+        """
+        A file whose size or modification time has changed is considered unchanged if its hash is the same.
+        """
+        added, changed = [], []
+        for path, new_entry in new.entries.items():
+            old_entry = self.entries.get(path)
+            if not old_entry:
+                added.append(path)
+            elif (old_entry.size, old_entry.mtime_ns) != (new_entry.size, new_entry.mtime_ns):
+                if old_entry.hash and old_entry.size == new_entry.size \
+                        and hash_file(new._absolute(path)) == old_entry.hash:
+                    continue
+                changed.append(path)
+        removed = [path for path in self.entries if path not in new.entries]
+        return ManifestDelta(sorted(added), sorted(changed), sorted(removed))
+
+    def fill_hashes(self, previous: Optional['Manifest'] = None) -> None:
+        """
+        Hashes of the files which have not changed since the `previous` manifest are not recalculated.
+        """
+        for path, entry in self.entries.items():
+            if entry.hash:
+                continue
+            previous_entry = previous.entries.get(path) if previous else None
+            if previous_entry and previous_entry.hash \
+                    and (previous_entry.size, previous_entry.mtime_ns) == (entry.size, entry.mtime_ns):
+                file_hash = previous_entry.hash
+            else:
+                file_hash = hash_file(self._absolute(path))
+            self.entries[path] = entry._replace(hash=file_hash)
+
+    def header(self) -> Dict:
+        return {'original_path': self.original_path, 'digest': self.digest, 'n_files': len(self.entries)}
+
+    def save(self, path: str) -> None:
+        tmp_path = path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(self.header()).encode() + b'\n')
+            for file, entry in self.entries.items():
+                f.write(b'%d\t%d\t%s\t%s\n' % (entry.size, entry.mtime_ns, entry.hash or NO_HASH, file))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> 'Manifest':
+        entries = {}
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            for line in f:
+                size, mtime_ns, file_hash, file = line.rstrip(b'\n').split(b'\t', 3)
+                entries[file] = ManifestEntry(int(size), int(mtime_ns), None if file_hash == NO_HASH else file_hash)
+        return Manifest(header['original_path'], entries)
+
+
+def read_manifest_header(path: str) -> Dict:
+    with open(path, 'rb') as f:
+        return json.loads(f.readline())
+
+
+def load_manifest_if_exists(path: str) -> Optional[Manifest]:
+    manifest_path = get_manifest_path(path)
+    return Manifest.load(manifest_path) if os.path.exists(manifest_path) else None
+
+
+def save_manifest_digest(manifest: Manifest, path: str) -> None:
+    """
+    For outputs which are not updated file by file (e.g. vocab), only the header with the digest is saved.
+    """
+    with open(get_manifest_path(path), 'wb') as f:
+        f.write(json.dumps(manifest.header()).encode() + b'\n')
+
+
+def get_manifest_digest(path: str) -> Optional[str]:
+    manifest_path = get_manifest_path(path)
+    return read_manifest_header(manifest_path)['digest'] if os.path.exists(manifest_path) else None
+
+
+def scan(path: str, extensions: Optional[List[str]]) -> Manifest:
+    """
+    Files are listed with `codeprep.dirutils.parallel_walk`, the same way as by `codeprep.dirutils.walk_and_save`:
+    symlinks to directories are followed, symlinks to files are skipped, and the paths are relative to `path`.
+    """
+    path_bin = path.encode()
+    extensions_bin = [e.encode() for e in extensions] if extensions else None
+    entries = {}
+    for scanned_dir in parallel_walk(path_bin, stat_files=True):
+        for file in scanned_dir.files:
+            rel_path = os.path.join(scanned_dir.rel_path, file.name)
+            if extensions_bin and not has_one_of_extensions(rel_path, extensions_bin):
+                continue
+            # already stat-ed by the walker
+            file_stat = file.stat(follow_symlinks=False)
+            entries[rel_path] = ManifestEntry(file_stat.st_size, file_stat.st_mtime_ns)
+    return Manifest(path, entries)
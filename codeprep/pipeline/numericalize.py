@@ -0,0 +1,208 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Numericalized corpus: the tokens of the preprocessed files replaced with their ids in the vocab.
+
+Ids are assigned in the order of the frequency-sorted vocab, the id after the last word is reserved
+for the tokens which are not in the vocab (e.g. if it has been pruned). The tokens of all the files are
+written one after another into a single binary file of uint16 (or uint32 if the vocab does not fit) ids,
+the word boundaries are written the same way, so that the corpus is read with `np.memmap` without any parsing.
+"""
+import json
+import logging
+import os
+import shutil
+from multiprocessing.pool import Pool
+from typing import Dict, Tuple, Iterator, Optional
+
+import numpy as np
+from tqdm import tqdm
+
+from codeprep.config import CHUNKSIZE
+from codeprep.dirutils import get_timestamp
+from codeprep.filelist import FileListWriter, FileList
+from codeprep.fileutils import read_file_contents
+from codeprep.pipeline.dataset import SubDataset
+from codeprep.pipeline.manifest import get_manifest_digest
+from codeprep.pipeline.vocab import _read_run, NOT_FINISHED_EXT
+from codeprep.util import ProgressChannel, init_progress_channel, report_progress
+
+logger = logging.getLogger(__name__)
+
+TOKENS_FILENAME = 'tokens.bin'
+TOKEN_OFFSETS_FILENAME = 'token_offsets.npy'
+WORD_BOUNDARIES_FILENAME = 'word_boundaries.bin'
+WORD_BOUNDARY_OFFSETS_FILENAME = 'word_boundary_offsets.npy'
+FILES_FILENAME = 'files'
+METADATA_FILENAME = 'metadata.json'
+
+WORD_BOUNDARIES_DTYPE = np.uint32
+
+
+def get_id_dtype(vocab_size: int) -> np.dtype:
+    """
+    One more id is needed for the tokens that are not in the vocab.
+
+    >>> get_id_dtype(65535)
+    dtype('uint16')
+    >>> get_id_dtype(65536)
+    dtype('uint32')
+    """
+    return np.dtype(np.uint16) if vocab_size < 2 ** 16 else np.dtype(np.uint32)
+
+
+def load_word_ids(path_to_vocab: str) -> Dict[str, int]:
+    return {word: i for i, (word, _) in enumerate(_read_run(path_to_vocab))}
+
+
+def init_numericalization(word_ids: Dict[str, int], progress: ProgressChannel) -> None:
+    global global_word_ids
+    global_word_ids = word_ids
+    init_progress_channel(progress)
+
+
+def numericalize_file(params: Tuple[bytes, bytes, np.dtype]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    file, word_boundaries_file, dtype = params
+    lines, _ = read_file_contents(file)
+    unk_id = len(global_word_ids)
+    ids = np.array([global_word_ids.get(word, unk_id) for line in lines for word in line.split(' ')], dtype=dtype)
+    if os.path.exists(word_boundaries_file):
+        word_boundaries = np.fromfile(word_boundaries_file, dtype=WORD_BOUNDARIES_DTYPE)
+    else:
+        word_boundaries = None
+    report_progress(files=1, tokens=len(ids))
+    return ids, word_boundaries
+
+
+def _get_prep_dataset_state(prep_dataset: SubDataset) -> Dict[str, str]:
+    digest = get_manifest_digest(prep_dataset.path)
+    if digest is not None:
+        return {'prep_dataset_manifest_digest': digest}
+    # there is no manifest if the dataset is a single file
+    return {'prep_dataset_timestamp': get_timestamp(prep_dataset.path)}
+
+
+def _is_numericalized_corpus_ready(path: str, prep_dataset: SubDataset, path_to_vocab: str) -> bool:
+    path_to_metadata = os.path.join(path, METADATA_FILENAME)
+    if not os.path.exists(path_to_metadata):
+        return False
+    with open(path_to_metadata, 'r') as f:
+        metadata = json.load(f)
+    return all(metadata.get(k) == v for k, v in _get_prep_dataset_state(prep_dataset).items()) \
+        and metadata['vocab_timestamp'] == os.path.getmtime(path_to_vocab)
+
+
+def numericalize(prep_dataset: SubDataset, word_boundaries: SubDataset, path_to_vocab: str, path: str) -> None:
+    """
+    Writes the numericalized corpus to `path`, the files are written in the order of `prep_dataset.file_iterator()`.
+    Word boundaries are available only for the files preprocessed by this version of codeprep.
+    """
+    if _is_numericalized_corpus_ready(path, prep_dataset, path_to_vocab):
+        logger.info(f'Numericalized corpus is already at {path}')
+        return
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    word_ids = load_word_ids(path_to_vocab)
+    dtype = get_id_dtype(len(word_ids))
+
+    def param_gen() -> Iterator[Tuple[bytes, bytes, np.dtype]]:
+        for file in prep_dataset.file_iterator():
+            yield file, prep_dataset.get_new_file_name(file, word_boundaries), dtype
+
+    files_total = prep_dataset.count_files()
+    token_offsets, word_boundary_offsets = [0], [0]
+    all_word_boundaries_present = True
+    progress = ProgressChannel()
+    with open(os.path.join(path, TOKENS_FILENAME), 'wb') as tokens_file, \
+            open(os.path.join(path, WORD_BOUNDARIES_FILENAME), 'wb') as word_boundaries_file, \
+            FileListWriter(os.path.join(path, FILES_FILENAME)) as files_file, \
+            Pool(initializer=init_numericalization, initargs=(word_ids, progress)) as pool:
+        it = pool.imap(numericalize_file, param_gen(), chunksize=CHUNKSIZE)
+        with tqdm(zip(prep_dataset.file_iterator(), it), total=files_total) as progress_bar:
+            for file, (ids, file_word_boundaries) in progress_bar:
+                tokens_file.write(ids.tobytes())
+                token_offsets.append(token_offsets[-1] + len(ids))
+                if file_word_boundaries is None:
+                    all_word_boundaries_present = False
+                else:
+                    word_boundaries_file.write(file_word_boundaries.tobytes())
+                    word_boundary_offsets.append(word_boundary_offsets[-1] + len(file_word_boundaries))
+                files_file.write(os.path.relpath(file, prep_dataset.path.encode()))
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+    logger.info(f'Numericalized: {progress}')
+
+    np.save(os.path.join(path, TOKEN_OFFSETS_FILENAME), np.array(token_offsets, dtype=np.int64))
+    if all_word_boundaries_present:
+        np.save(os.path.join(path, WORD_BOUNDARY_OFFSETS_FILENAME), np.array(word_boundary_offsets, dtype=np.int64))
+    else:
+        logger.warning('Word boundaries are not available for some files, '
+                       'preprocess the dataset again to have them in the numericalized corpus.')
+        os.remove(os.path.join(path, WORD_BOUNDARIES_FILENAME))
+
+    # the metadata file is written last, its presence means that the corpus is complete
+    tmp_path_to_metadata = os.path.join(path, METADATA_FILENAME + NOT_FINISHED_EXT)
+    with open(tmp_path_to_metadata, 'w') as f:
+        json.dump({
+            'dtype': dtype.name,
+            'vocab_size': len(word_ids),
+            'unk_id': len(word_ids),
+            **_get_prep_dataset_state(prep_dataset),
+            'vocab_timestamp': os.path.getmtime(path_to_vocab),
+        }, f)
+    os.rename(tmp_path_to_metadata, os.path.join(path, METADATA_FILENAME))
+
+
+class NumericalizedCorpus(object):
+    """
+    Read-only memory-mapped view of a numericalized corpus: `corpus[i]` are the token ids of the i-th file.
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, METADATA_FILENAME), 'r') as f:
+            metadata = json.load(f)
+        self.path = path
+        self.dtype = np.dtype(metadata['dtype'])
+        self.vocab_size = metadata['vocab_size']
+        self.unk_id = metadata['unk_id']
+        self.token_offsets = np.load(os.path.join(path, TOKEN_OFFSETS_FILENAME), mmap_mode='r')
+        self.tokens = self._memmap(TOKENS_FILENAME, self.dtype)
+        if os.path.exists(os.path.join(path, WORD_BOUNDARY_OFFSETS_FILENAME)):
+            self.word_boundary_offsets = np.load(os.path.join(path, WORD_BOUNDARY_OFFSETS_FILENAME), mmap_mode='r')
+            self._word_boundaries = self._memmap(WORD_BOUNDARIES_FILENAME, WORD_BOUNDARIES_DTYPE)
+        else:
+            self.word_boundary_offsets = None
+            self._word_boundaries = None
+
+    def _memmap(self, filename: str, dtype: np.dtype) -> np.ndarray:
+        path = os.path.join(self.path, filename)
+        # np.memmap cannot map an empty file
+        if os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def __len__(self) -> int:
+        return len(self.token_offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.tokens[self.token_offsets[i]:self.token_offsets[i + 1]]
+
+    @property
+    def n_tokens(self) -> int:
+        return int(self.token_offsets[-1])
+
+    def word_boundaries(self, i: int) -> np.ndarray:
+        """
+        Indices of the tokens of the i-th file at which the words start, the last element is the number of tokens.
+        """
+        if self._word_boundaries is None:
+            raise ValueError(f'Word boundaries are not available in {self.path}')
+        return self._word_boundaries[self.word_boundary_offsets[i]:self.word_boundary_offsets[i + 1]]
+
+    def files(self) -> FileList:
+        """
+        Paths of the files relative to the preprocessed dataset.
+        """
+        return FileList(os.path.join(self.path, FILES_FILENAME))
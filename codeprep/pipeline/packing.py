@@ -0,0 +1,170 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Export of the numericalized corpus as fixed-length token sequences for language model training.
+
+Files are taken in a shuffled (but deterministic given the seed) order, joined with a separator token
+and cut into windows of `seq_len` tokens, a new window starting every `stride` tokens.
+The file order is split into shards which are packed in parallel, each shard is written
+as an `.npy` matrix of shape (number of windows, `seq_len`), so it can be loaded with `np.load(mmap_mode='r')`.
+Windows do not span shard boundaries, the tokens at the end of a shard that do not fill a window are dropped.
+"""
+import json
+import logging
+import multiprocessing
+import os
+from multiprocessing.pool import Pool
+from typing import List, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from codeprep.pipeline.numericalize import NumericalizedCorpus
+from codeprep.pipeline.vocabgrowth import shuffle_files, SHUFFLE_SEED
+from codeprep.util import groupify, ProgressChannel, init_progress_channel, report_progress
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'index.json'
+FILE_ORDER_FILENAME = 'file_order.npy'
+
+
+def get_n_windows(n_tokens: int, seq_len: int, stride: int) -> int:
+    """
+    >>> get_n_windows(10, 4, 4)
+    2
+    >>> get_n_windows(10, 4, 2)
+    4
+    >>> get_n_windows(3, 4, 2)
+    0
+    """
+    return (n_tokens - seq_len) // stride + 1 if n_tokens >= seq_len else 0
+
+
+def _with_separator(tokens: np.ndarray, separator_id: Optional[int]) -> np.ndarray:
+    """
+    The separator is not added if the file already ends with it, e.g. with <EOF> placeholder.
+
+    >>> _with_separator(np.array([1, 2]), 0).tolist()
+    [1, 2, 0]
+    >>> _with_separator(np.array([1, 0]), 0).tolist()
+    [1, 0]
+    >>> _with_separator(np.array([1, 2]), None).tolist()
+    [1, 2]
+    """
+    if separator_id is None or (len(tokens) and tokens[-1] == separator_id):
+        return tokens
+    return np.append(tokens, np.array(separator_id, dtype=tokens.dtype))
+
+
+def _shard_length(corpus: NumericalizedCorpus, file_indices: List[int], separator_id: Optional[int]) -> int:
+    n_tokens = int(np.sum(corpus.token_offsets[np.array(file_indices) + 1] - corpus.token_offsets[file_indices]))
+    if separator_id is not None:
+        n_tokens += sum(1 for i in file_indices if not len(corpus[i]) or corpus[i][-1] != separator_id)
+    return n_tokens
+
+
+def pack_shard(params: Tuple[int, str, List[int], str, int, int, Optional[int]]) -> Tuple[int, int]:
+    """
+    The tokens of the files are streamed into the windows, so only one file and one window are kept in memory.
+
+    :return: index of the shard and the number of windows written
+    """
+    shard_index, path_to_numericalized, file_indices, path_to_shard, seq_len, stride, separator_id = params
+    corpus = NumericalizedCorpus(path_to_numericalized)
+    n_windows = get_n_windows(_shard_length(corpus, file_indices, separator_id), seq_len, stride) if file_indices else 0
+    matrix = np.lib.format.open_memmap(path_to_shard, mode='w+', dtype=corpus.dtype, shape=(n_windows, seq_len))
+
+    buffer = np.empty(0, dtype=corpus.dtype)
+    tokens_to_skip = 0
+    row = 0
+    window_offsets = np.arange(seq_len)
+    for i in file_indices:
+        tokens = _with_separator(corpus[i], separator_id)
+        report_progress(files=1, tokens=len(tokens))
+        # with stride > seq_len some tokens between the windows are skipped
+        skipped = min(tokens_to_skip, len(tokens))
+        tokens_to_skip -= skipped
+        buffer = np.concatenate([buffer, tokens[skipped:]])
+        n_ready = get_n_windows(len(buffer), seq_len, stride)
+        if n_ready:
+            starts = np.arange(n_ready) * stride
+            matrix[row:row + n_ready] = buffer[starts[:, None] + window_offsets]
+            row += n_ready
+            consumed = n_ready * stride
+            tokens_to_skip = max(consumed - len(buffer), 0)
+            buffer = buffer[consumed:]
+    assert row == n_windows
+    matrix.flush()
+    del matrix
+    return shard_index, n_windows
+
+
+def _get_shard_path(output_path: str, shard_index: int) -> str:
+    return os.path.join(output_path, f'shard_{shard_index:05d}.npy')
+
+
+def pack(path_to_numericalized: str, output_path: str, seq_len: int, stride: Optional[int] = None,
+         separator_id: Optional[int] = None, n_shards: Optional[int] = None, seed: int = SHUFFLE_SEED) -> None:
+    """
+    :param stride: the number of tokens between the starts of consecutive windows, `seq_len` by default,
+    i.e. the windows do not overlap
+    :param separator_id: id of the token to be inserted between the files if a file does not end with it already
+    :param n_shards: the number of shards written in parallel, the number of cpus by default
+    """
+    stride = stride or seq_len
+    if seq_len <= 0 or stride <= 0:
+        raise ValueError(f'Sequence length and stride must be positive, but are {seq_len} and {stride}')
+    corpus = NumericalizedCorpus(path_to_numericalized)
+    file_order = shuffle_files(range(len(corpus)), seed)
+    n_shards = min(n_shards or multiprocessing.cpu_count(), len(file_order)) or 1
+    shards = groupify(file_order, n_shards)
+
+    os.makedirs(output_path, exist_ok=True)
+    np.save(os.path.join(output_path, FILE_ORDER_FILENAME), np.array(file_order, dtype=np.int64))
+    params = [(i, path_to_numericalized, shard, _get_shard_path(output_path, i), seq_len, stride, separator_id)
+              for i, shard in enumerate(shards)]
+    n_windows = [0] * len(shards)
+    progress = ProgressChannel()
+    with Pool(initializer=init_progress_channel, initargs=(progress,)) as pool:
+        with tqdm(pool.imap_unordered(pack_shard, params), total=len(params)) as progress_bar:
+            for shard_index, shard_n_windows in progress_bar:
+                n_windows[shard_index] = shard_n_windows
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+    logger.info(f'Packed: {progress} into {sum(n_windows)} sequences of {seq_len} tokens')
+
+    with open(os.path.join(output_path, INDEX_FILENAME), 'w') as f:
+        json.dump({
+            'seq_len': seq_len,
+            'stride': stride,
+            'separator_id': separator_id,
+            'seed': seed,
+            'dtype': corpus.dtype.name,
+            'shards': [{'path': os.path.basename(_get_shard_path(output_path, i)), 'n_sequences': n}
+                       for i, n in enumerate(n_windows)],
+        }, f, indent=2)
+
+
+class PackedSequences(object):
+    """
+    Read-only memory-mapped view of the exported sequences: `sequences[i]` is the i-th window of token ids.
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, INDEX_FILENAME), 'r') as f:
+            index = json.load(f)
+        self.path = path
+        self.seq_len = index['seq_len']
+        self.stride = index['stride']
+        self.shards = [np.load(os.path.join(path, shard['path']), mmap_mode='r') for shard in index['shards']]
+        self._shard_offsets = np.cumsum([0] + [shard['n_sequences'] for shard in index['shards']])
+
+    def __len__(self) -> int:
+        return int(self._shard_offsets[-1])
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        if not 0 <= i < len(self):
+            raise IndexError(f'Sequence index {i} is out of range')
+        shard_index = int(np.searchsorted(self._shard_offsets, i, side='right')) - 1
+        return self.shards[shard_index][i - self._shard_offsets[shard_index]]
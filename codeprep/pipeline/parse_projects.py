@@ -7,14 +7,17 @@ import logging
 import os
 import pickle
 from multiprocessing.pool import Pool
-from typing import Tuple
+from typing import Tuple, Optional, List
 
 from tqdm import tqdm
 
-from codeprep.config import REWRITE_PARSED_FILE, CHUNKSIZE, LIMIT_FILES_SCANNING
+from codeprep.config import REWRITE_PARSED_FILE, CHUNKSIZE, USE_PARSE_CACHE, \
+    DEFAULT_PARSE_CACHE_DIR, PARSE_CACHE_MAX_SIZE
 from codeprep.fileutils import read_file_contents
 from codeprep.pipeline.dataset import Dataset, NOT_FINISHED_EXTENSION
 from codeprep.parse.core import convert_text
+from codeprep.pipeline.parsecache import get_key, get_parse_cache, init_parse_cache, ParseCache
+from codeprep.util import ProgressChannel, init_progress_channel, report_progress
 
 logger = logging.getLogger(__name__)
 
@@ -30,44 +33,64 @@ def preprocess_and_write(params: Tuple[bytes, bytes]) -> None:
         logger.warning(f"File {dest_file_path} already exists! Doing nothing.")
         return
 
+    try:
+        lines_from_file, path = read_file_contents(src_file_path)
+    except FileNotFoundError:
+        logger.error(f"File was found when scanning the directory, but cannot be read: {src_file_path}. "
+                     f"Invalid symlink? Ignoring ...")
+        return
+    text = "\n".join(lines_from_file)
+    extension_bin = os.path.splitext(src_file_path)[1].decode()[1:]
+
+    parse_cache = get_parse_cache()
+    if parse_cache:
+        key = get_key(text, extension_bin)
+        if parse_cache.get(key, dest_file_path):
+            report_progress(files=1, bytes=os.path.getsize(src_file_path), cache_hits=1)
+            return
+
     not_finished_dest_file_path = dest_file_path + NOT_FINISHED_EXTENSION.encode()
     with gzip.GzipFile(not_finished_dest_file_path, 'wb') as f:
-        try:
-            lines_from_file, path = read_file_contents(src_file_path)
-        except FileNotFoundError:
-            logger.error(f"File was found when scanning the directory, but cannot be read: {src_file_path}. "
-                         f"Invalid symlink? Ignoring ...")
-            return
-        extension_bin = os.path.splitext(src_file_path)[1].decode()[1:]
-        parsed = [p for p in convert_text("\n".join(lines_from_file), extension_bin)]
+        parsed = [p for p in convert_text(text, extension_bin)]
         pickle.dump(parsed, f, pickle.HIGHEST_PROTOCOL)
 
     os.rename(not_finished_dest_file_path, dest_file_path)
+    if parse_cache:
+        parse_cache.put(key, dest_file_path)
+    report_progress(files=1, bytes=os.path.getsize(src_file_path), tokens=len(parsed))
+
+
+def init_worker(progress: ProgressChannel, parse_cache_path: Optional[str]) -> None:
+    init_progress_channel(progress)
+    init_parse_cache(parse_cache_path)
 
 
-def params_generator(dataset: Dataset):
-    for input_file_path in dataset.original.file_iterator():
+def params_generator(dataset: Dataset, files: Optional[List[bytes]] = None):
+    for input_file_path in dataset.original.file_iterator(files):
         output_file_path = dataset.original.get_new_file_name(input_file_path, dataset.parsed)
         yield (input_file_path, output_file_path)
 
 
-def run(dataset: Dataset) -> None:
+def run(dataset: Dataset, files: Optional[List[bytes]] = None) -> None:
+    """
+    :param files: if specified, only these files are parsed (relative paths as returned by `Dataset.get_all_files()`)
+    """
     logger.info(f"Getting files from {dataset.original.path}")
     logger.info(f"Writing preprocessed files to {dataset.parsed.path}")
 
-    if dataset.files_need_to_be_saved():
-        files_total = 0
-        for _ in dataset.get_all_files():
-            files_total += 1
-            print(f"Files scanned: {files_total}", end='\r')
-            if files_total > LIMIT_FILES_SCANNING:
-                files_total = None
-                logger.info(f"Total files to be preprocessed: {LIMIT_FILES_SCANNING}+")
-                break
-    else:
-        files_total = len([f for f in dataset.get_all_files()])
-    with Pool() as pool:
-        it = pool.imap_unordered(preprocess_and_write, params_generator(dataset), chunksize=CHUNKSIZE)
-        for _ in tqdm(it, total=files_total):
-            pass
+    # if the list of files is not saved yet, the files are passed to the workers while the dataset is being walked
+    files_total = len(files) if files is not None else dataset.count_files()
+    progress = ProgressChannel()
+    parse_cache_path = DEFAULT_PARSE_CACHE_DIR if USE_PARSE_CACHE else None
+    with Pool(initializer=init_worker, initargs=(progress, parse_cache_path)) as pool:
+        it = pool.imap_unordered(preprocess_and_write, params_generator(dataset, files), chunksize=CHUNKSIZE)
+        with tqdm(it, total=files_total) as progress_bar:
+            for _ in progress_bar:
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+    logger.info(f"Parsed: {progress}")
+    if parse_cache_path:
+        n_files = progress.snapshot()['files']
+        if n_files:
+            logger.info(f"Parse cache hit rate: {progress.snapshot()['cache_hits'] / n_files:.1%}")
+        ParseCache(parse_cache_path).evict(PARSE_CACHE_MAX_SIZE)
     dataset.parsed.set_ready()
\ No newline at end of file
@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Content-addressed store of parsed files shared by all the datasets.
+
+The same file contents often occur in multiple projects (forks, vendored dependencies) and in overlapping datasets.
+A parsed file is stored under the hash of the contents, the lexer used and the version of codeprep,
+and is hard-linked to the parsed dataset when the same contents are parsed again.
+The least recently used entries are removed when the store exceeds the maximum size.
+"""
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import time
+from typing import Optional, Dict, List
+
+import pygments
+from pygments.lexers import get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from codeprep.config import version
+
+logger = logging.getLogger(__name__)
+
+ACCESS_LOG_PREFIX = 'access_'
+ACCESS_LOG_EXT = 'log'
+NOT_FINISHED_EXT = '.part'
+
+
+def get_lexer_identity(extension: str) -> str:
+    """
+    >>> get_lexer_identity('java')
+    'JavaLexer'
+    >>> get_lexer_identity('unknownext')
+    'guessed'
+    """
+    try:
+        return type(get_lexer_by_name(extension or 'java')).__name__
+    except ClassNotFound:
+        # the lexer is guessed from the contents which are part of the key anyway
+        return 'guessed'
+
+
+def get_key(text: str, extension: str) -> str:
+    h = hashlib.sha1()
+    h.update(f'codeprep {version} pygments {pygments.__version__} {get_lexer_identity(extension)}\0'.encode())
+    h.update(text.encode('utf-8', 'surrogatepass'))
+    return h.hexdigest()
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    try:
+        os.link(src, dest)
+    except (FileExistsError, FileNotFoundError):
+        raise
+    except OSError:
+        # e.g. the store and the dataset are on different file systems
+        shutil.copyfile(src, dest)
+
+
+class ParseCache(object):
+    def __init__(self, path: str):
+        self.path = path
+        self._access_log = None
+
+    def _get_entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def _log_access(self, key: str) -> None:
+        if not self._access_log:
+            os.makedirs(self.path, exist_ok=True)
+            # each process writes to its own log, so that the lines from different processes are not interleaved
+            self._access_log = open(os.path.join(self.path, f'{ACCESS_LOG_PREFIX}{os.getpid()}.{ACCESS_LOG_EXT}'),
+                                    'a', buffering=1)
+        self._access_log.write(f'{time.time()} {key}\n')
+
+    def get(self, key: str, dest_path: bytes) -> bool:
+        """
+        :return: True if the parsed file is in the store, in this case it is linked to `dest_path`
+        """
+        not_finished_dest_path = os.fsencode(dest_path) + NOT_FINISHED_EXT.encode()
+        if os.path.exists(not_finished_dest_path):
+            os.remove(not_finished_dest_path)
+        try:
+            _link_or_copy(self._get_entry_path(key), not_finished_dest_path)
+        except FileNotFoundError:
+            return False
+        os.replace(not_finished_dest_path, dest_path)
+        self._log_access(key)
+        return True
+
+    def put(self, key: str, parsed_file_path: bytes) -> None:
+        entry_path = self._get_entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        try:
+            _link_or_copy(parsed_file_path, entry_path)
+        except FileExistsError:
+            # the same contents have been parsed by another worker in the meantime
+            pass
+        self._log_access(key)
+
+    def _get_entries(self) -> Dict[str, List]:
+        """
+        :return: size and the last access time of each entry
+        """
+        entries = {}
+        for shard in os.scandir(self.path):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    stat = entry.stat()
+                    entries[entry.name] = [stat.st_size, stat.st_mtime]
+        return entries
+
+    def _read_access_logs(self, entries: Dict[str, List]) -> List[str]:
+        access_logs = glob.glob(os.path.join(self.path, f'{ACCESS_LOG_PREFIX}*.{ACCESS_LOG_EXT}'))
+        for access_log in access_logs:
+            with open(access_log, 'r') as f:
+                for line in f:
+                    access_time, _, key = line.rstrip('\n').partition(' ')
+                    if key in entries:
+                        entries[key][1] = max(entries[key][1], float(access_time))
+        return access_logs
+
+    def evict(self, max_size: int) -> int:
+        """
+        Removes the least recently used entries until the size of the store does not exceed `max_size`.
+        The files linked to the parsed datasets are not affected.
+
+        :return: the number of entries removed
+        """
+        if not os.path.exists(self.path):
+            return 0
+        entries = self._get_entries()
+        access_logs = self._read_access_logs(entries)
+        total_size = sum(size for size, _ in entries.values())
+        n_removed = 0
+        for key, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if total_size <= max_size:
+                break
+            os.remove(self._get_entry_path(key))
+            del entries[key]
+            total_size -= size
+            n_removed += 1
+
+        # access logs are compacted to the last access time of each entry
+        compacted_log = os.path.join(self.path, f'{ACCESS_LOG_PREFIX}compacted.{ACCESS_LOG_EXT}')
+        with open(compacted_log + NOT_FINISHED_EXT, 'w') as f:
+            for key, (_, access_time) in entries.items():
+                f.write(f'{access_time} {key}\n')
+        for access_log in access_logs:
+            os.remove(access_log)
+        if entries:
+            os.rename(compacted_log + NOT_FINISHED_EXT, compacted_log)
+        else:
+            os.remove(compacted_log + NOT_FINISHED_EXT)
+        if n_removed:
+            logger.info(f'Removed {n_removed} least recently used entries from parse cache {self.path}')
+        return n_removed
+
+
+_parse_cache: Optional[ParseCache] = None
+
+
+def init_parse_cache(path: Optional[str]) -> None:
+    global _parse_cache
+    _parse_cache = ParseCache(path) if path else None
+
+
+def get_parse_cache() -> Optional[ParseCache]:
+    return _parse_cache
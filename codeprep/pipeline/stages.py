@@ -3,45 +3,222 @@
 # SPDX-License-Identifier: Apache-2.0
 
 """This module runs different stages of preprocessing flow and makes sure not to rerun a stage if its results are already available.
+
+If a stage has been run before on an older version of the dataset, only the files added or changed since then are processed,
+the outputs of removed files are deleted (see `codeprep.pipeline.manifest`).
 """
 import logging
 import os
-from typing import Optional
+import shutil
+import tempfile
+from collections import Counter
+from typing import Optional, List
 
-from codeprep.pipeline import parse_projects, to_repr
+from codeprep import config
+from codeprep.pipeline import parse_projects, to_repr, vocabalgebra
 from codeprep.pipeline.bperegistry import CustomBpeConfig
-from codeprep.pipeline.dataset import Dataset, is_path_ready, is_path_outdated, archive_path
-from codeprep.pipeline.vocab import calc_vocab
+from codeprep.pipeline.dataset import Dataset, is_path_ready, is_path_outdated, archive_path, move_path, SubDataset
+from codeprep.pipeline.manifest import ManifestDelta, load_manifest_if_exists, get_manifest_path, \
+    save_manifest_digest, get_manifest_digest
+from codeprep.pipeline.vocab import calc_vocab, get_vocab, _dump_vocab_dict, write_vocab_growth_stats, \
+    VOCABSIZE_FILENAME, VOCAB_FILENAME
 
 logger = logging.getLogger(__name__)
 
+
+def _move_previous_build_in_place(dataset: Dataset, path: str) -> Optional[str]:
+    """
+    If the output at `path` has not been built, but the same output has been built for an older version
+    of the dataset, the latter is moved to `path` to be updated.
+
+    :return: the path the output has been moved from
+    """
+    if os.path.exists(path) and (is_path_ready(path) or os.listdir(path)):
+        return None
+    previous = dataset.find_previous_build(path)
+    if not previous:
+        return None
+    logger.info(f'Reusing the output built from an older version of the dataset: {previous}')
+    if os.path.exists(path):
+        os.rmdir(path)
+    move_path(previous, path)
+    return previous
+
+
+def _get_delta(dataset: Dataset, path: str) -> Optional[ManifestDelta]:
+    """
+    :return: changes in the dataset since the output at `path` has been built,
+    None if they cannot be determined because there is no manifest
+    """
+    if not dataset.manifest:
+        return None
+    manifest = load_manifest_if_exists(path)
+    return manifest.diff(dataset.manifest) if manifest else None
+
+
+def _save_manifest(dataset: Dataset, path: str) -> None:
+    if not dataset.manifest:
+        return
+    if config.MANIFEST_CONTENT_HASH:
+        dataset.manifest.fill_hashes(load_manifest_if_exists(path))
+    dataset.manifest.save(get_manifest_path(path))
+
+
+def _remove_outputs(subdataset: SubDataset, files: List[bytes]) -> List[bytes]:
+    """
+    :return: paths to the removed outputs
+    """
+    removed = []
+    for path in subdataset.file_iterator(files):
+        if os.path.exists(path):
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
 #TODO remove code duplication in methods below
 def run_parsing(dataset: Dataset) -> None:
     logger.info("Parsing...")
+    _move_previous_build_in_place(dataset, dataset.parsed.path)
+    delta = _get_delta(dataset, dataset.parsed.path) if dataset.parsed.ready() else None
     if not dataset.parsed.ready():
         parse_projects.run(dataset)
+    elif delta is not None:
+        if delta.is_empty():
+            logger.info("Parsed dataset is up-to-date.")
+            return
+        logger.info(f"Parsing the files changed since the last run: {delta}")
+        dataset.invalidate_file_list()
+        _remove_outputs(dataset.parsed, delta.changed + delta.removed)
+        parse_projects.run(dataset, delta.added + delta.changed)
     elif dataset.parsed.is_outdated():
         dataset.parsed.archive()
         parse_projects.run(dataset)
     else:
         logger.info("Parsed dataset is up-to-date.")
+    _save_manifest(dataset, dataset.parsed.path)
+
+
+def _move_previous_preprocessed_dataset_in_place(dataset: Dataset) -> None:
+    previous = _move_previous_build_in_place(dataset, dataset.preprocessed.path)
+    if not previous:
+        return
+    basename, previous_basename = os.path.basename(dataset.preprocessed.path), os.path.basename(previous)
+    # these outputs are named after the preprocessed dataset
+    for path in [dataset.word_boundaries.path, dataset.path_to_prep_corpus_size_file]:
+        previous_path = os.path.join(os.path.dirname(path), os.path.basename(path).replace(basename, previous_basename))
+        if os.path.exists(previous_path) and not os.path.exists(path):
+            os.rename(previous_path, path)
+
+
+def _update_corpus_size(dataset: Dataset, removed_words: Counter, added_words: Counter) -> None:
+    if not os.path.exists(dataset.path_to_prep_corpus_size_file):
+        return
+    with open(dataset.path_to_prep_corpus_size_file, 'r') as f:
+        corpus_size = int(f.read())
+    corpus_size += sum(added_words.values()) - sum(removed_words.values())
+    with open(dataset.path_to_prep_corpus_size_file, 'w') as f:
+        f.write(f'{corpus_size}')
 
 
-def run_until_preprocessing(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None) -> None:
+def _invalidate_vocab(vocab_path: str) -> None:
+    """
+    Removes the vocab and its stats, so that they are calculated from scratch when needed.
+    The non-bpe vocab in the same dir is kept, it is updated when the files are preprocessed.
+    """
+    logger.info(f"Vocab at {vocab_path} cannot be updated, it will be recalculated")
+    for path in [os.path.join(vocab_path, VOCAB_FILENAME), os.path.join(vocab_path, VOCABSIZE_FILENAME),
+                 get_manifest_path(vocab_path)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _update_vocab(dataset: Dataset, vocab_path: str, previous_digest: str,
+                  removed_words: Counter, added_words: Counter) -> None:
+    """
+    The vocab is updated only if it has been calculated from the previous version of the preprocessed dataset,
+    otherwise it is invalidated and calculated from scratch when needed.
+    """
+    path_to_vocab_file = os.path.join(vocab_path, VOCAB_FILENAME)
+    if not os.path.exists(path_to_vocab_file):
+        return
+    if get_manifest_digest(vocab_path) != previous_digest:
+        _invalidate_vocab(vocab_path)
+        return
+    logger.info(f"Updating vocab: {path_to_vocab_file}")
+    path_to_dump = tempfile.mkdtemp(prefix='vocab_delta', dir=vocab_path)
+    try:
+        added_vocab, removed_vocab, merged_vocab, updated_vocab = \
+            [os.path.join(path_to_dump, name) for name in ['added', 'removed', 'merged', 'updated']]
+        _dump_vocab_dict(added_words.most_common(), added_vocab, to_literal=False)
+        _dump_vocab_dict(removed_words.most_common(), removed_vocab, to_literal=False)
+        vocabalgebra.merge([path_to_vocab_file, added_vocab], merged_vocab)
+        vocab_size, non_eng = vocabalgebra.subtract(merged_vocab, [removed_vocab], updated_vocab)
+        os.replace(updated_vocab, path_to_vocab_file)
+    finally:
+        shutil.rmtree(path_to_dump)
+
+    n_files = len(dataset.manifest.entries)
+    # vocab growth cannot be updated, only the final vocab size is written
+    write_vocab_growth_stats([(n_files, vocab_size, non_eng)], os.path.join(vocab_path, VOCABSIZE_FILENAME))
+    save_manifest_digest(dataset.manifest, vocab_path)
+
+
+def _update_preprocessed_dataset(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig],
+                                 delta: ManifestDelta) -> None:
+    logger.info(f"Preprocessing the files changed since the last run: {delta}")
+    previous_digest = get_manifest_digest(dataset.preprocessed.path)
+    dataset.invalidate_file_list()
+    # moved before preprocessing, so that the non-bpe vocab is updated with the preprocessed files
+    for vocab_path in dataset.all_vocab_paths:
+        _move_previous_build_in_place(dataset, vocab_path)
+
+    removed_files = [file for file in dataset.preprocessed.file_iterator(delta.changed + delta.removed)
+                     if os.path.exists(file)]
+    removed_words = get_vocab(removed_files)
+    _remove_outputs(dataset.preprocessed, delta.changed + delta.removed)
+    _remove_outputs(dataset.word_boundaries, delta.changed + delta.removed)
+
+    to_repr.run(dataset, custom_bpe_config, files=delta.added + delta.changed)
+    added_words = get_vocab(list(dataset.preprocessed.file_iterator(delta.added + delta.changed)))
+
+    _update_corpus_size(dataset, removed_words, added_words)
+    for vocab_path in dataset.all_vocab_paths:
+        _update_vocab(dataset, vocab_path, previous_digest, removed_words, added_words)
+
+
+def run_until_preprocessing(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None,
+                            vocab_output_dir: Optional[str]=None) -> None:
+    """
+    :param vocab_output_dir: if the dataset needs to be preprocessed, the words are counted on the way
+    and the vocab calculated by `calc_vocab` with this dir is ready without reading the preprocessed files again.
+    """
     run_parsing(dataset)
     logger.info("Preprocessing...")
+    _move_previous_preprocessed_dataset_in_place(dataset)
+    delta = _get_delta(dataset, dataset.preprocessed.path) if dataset.preprocessed.ready() else None
     if not dataset.preprocessed.ready():
-        to_repr.run(dataset, custom_bpe_config)
+        to_repr.run(dataset, custom_bpe_config, vocab_output_dir)
+    elif delta is not None:
+        if delta.is_empty():
+            logger.info(f"Dataset is already preprocessed and up-to-date.")
+            return
+        _update_preprocessed_dataset(dataset, custom_bpe_config, delta)
     elif dataset.preprocessed.is_outdated():
         dataset.preprocessed.archive()
-        to_repr.run(dataset, custom_bpe_config)
+        to_repr.run(dataset, custom_bpe_config, vocab_output_dir)
     else:
         logger.info(f"Dataset is already preprocessed and up-to-date.")
+    _save_manifest(dataset, dataset.preprocessed.path)
 
 
 def run_until_base_bpe_vocab(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None) -> None:
-    run_until_preprocessing(dataset, custom_bpe_config)
+    vocab_needs_calculation = not is_path_ready(dataset.path_to_bpe_vocab_file) \
+                              or is_path_outdated(dataset.path_to_bpe_vocab_file)
+    run_until_preprocessing(dataset, custom_bpe_config,
+                            dataset.base_bpe_vocab_path if vocab_needs_calculation else None)
     logger.info("Computing base bpe vocab...")
+    vocab_existed = os.path.exists(dataset.path_to_bpe_vocab_file)
     if not is_path_ready(dataset.path_to_bpe_vocab_file):
         calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.base_bpe_vocab_path)
     elif is_path_outdated(dataset.path_to_bpe_vocab_file):
@@ -49,22 +226,31 @@ def run_until_base_bpe_vocab(dataset: Dataset, custom_bpe_config: Optional[Custo
         calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.base_bpe_vocab_path)
     else:
         logger.info("Vocabulary is already computed and up-to-date")
+    # the digest lets the vocab be updated when only some files of the dataset change
+    if not vocab_existed and dataset.manifest:
+        save_manifest_digest(dataset.manifest, dataset.base_bpe_vocab_path)
+
+
+def _is_vocab_up_to_date(dataset: Dataset) -> bool:
+    if not os.path.exists(dataset.path_to_vocab_file):
+        return False
+    digest = get_manifest_digest(dataset.vocab_path)
+    # vocabs calculated before manifests were introduced are considered up-to-date
+    return digest is None or not dataset.manifest or digest == dataset.manifest.digest
 
 
 def run_until_vocab(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]=None) -> None:
     logger.info(f'Checking first if vocabulary file exists: {dataset.path_to_vocab_file}')
-    if os.path.exists(dataset.path_to_vocab_file):
+    if _is_vocab_up_to_date(dataset):
         logger.info("Vocabulary is already computed and up-to-date")
         return
 
-    if not is_path_ready(dataset.path_to_vocab_file):
-        run_until_preprocessing(dataset, custom_bpe_config)
-        logger.info("Computing vocab...")
-        calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.vocab_path)
-    elif is_path_outdated(dataset.path_to_vocab_file):
-        run_until_preprocessing(dataset, custom_bpe_config)
-        logger.info("Computing vocab...")
-        archive_path(dataset.path_to_bpe_vocab_file)
-        calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.vocab_path)
-    else:
-        raise AssertionError()
\ No newline at end of file
+    # if only some files have changed, the vocab is updated when they are preprocessed
+    run_until_preprocessing(dataset, custom_bpe_config, dataset.vocab_path)
+    if _is_vocab_up_to_date(dataset):
+        logger.info("Vocabulary has been updated")
+        return
+    logger.info("Computing vocab...")
+    calc_vocab(dataset.preprocessed.path, dataset.preprocessed.file_iterator(), dataset.vocab_path)
+    if dataset.manifest:
+        save_manifest_digest(dataset.manifest, dataset.vocab_path)
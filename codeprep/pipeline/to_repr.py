@@ -10,16 +10,19 @@ from multiprocessing.pool import Pool
 from typing import List, Tuple
 from typing import Optional
 
+import numpy as np
 import time
 from tqdm import tqdm
 
 from codeprep.bpepkg.bpe_encode import read_merges, BpeData
 from codeprep.bpepkg.cache import read_bpe_cache
 from codeprep.config import DEFAULT_BPE_DIR, NO_CASE_DIR, CASE_DIR, DEFAULT_BPE_CACHE_DIR, REWRITE_PREPROCESSED_FILE, \
-    CHUNKSIZE, LIMIT_FILES_SCANNING
+    CHUNKSIZE
 from codeprep.pipeline import vocabloader
 from codeprep.pipeline.bperegistry import CustomBpeConfig
 from codeprep.pipeline.dataset import Dataset, NOT_FINISHED_EXTENSION
+from codeprep.pipeline.vocab import count_words_inline, init_inline_vocab_counting, start_inline_vocab_counting, \
+    finish_inline_vocab_counting
 from codeprep.prepconfig import PrepParam, PrepConfig
 from codeprep.preprocess.core import to_repr_list
 from codeprep.preprocess.metadata import PreprocessingMetadata
@@ -27,7 +30,7 @@ from codeprep.preprocess.metadata import save_metadata
 from codeprep.preprocess.placeholders import placeholders
 from codeprep.tokens.rootclasses import ParsedToken
 from codeprep.tokens.word import SpecialToken
-from codeprep.util import to_literal_str
+from codeprep.util import to_literal_str, ProgressChannel, init_progress_channel, report_progress
 
 logger = logging.getLogger(__name__)
 
@@ -56,8 +59,20 @@ def to_token_str(tokens: List) -> str:
     return " ".join(map(lambda t: str(t), tokens))
 
 
-def preprocess_and_write(params: Tuple[bytes, bytes, PrepConfig, str]):
-    src_file_path, dest_file_path, prep_config, part_nonbpe_vocab_folder = params
+def write_word_boundaries(metadata: PreprocessingMetadata, path: bytes) -> None:
+    dirname = os.path.dirname(path)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname, exist_ok=True)
+    not_finished_path = path + NOT_FINISHED_EXTENSION.encode()
+    np.array(metadata.word_boundaries, dtype=np.uint32).tofile(not_finished_path)
+    os.rename(not_finished_path, path)
+
+
+def preprocess_and_write(params: Tuple[bytes, bytes, bytes, PrepConfig, str]) -> bool:
+    """
+    :return: whether the file has been preprocessed and written
+    """
+    src_file_path, dest_file_path, word_boundaries_file_path, prep_config, part_nonbpe_vocab_folder = params
 
     dest_dirname = os.path.dirname(dest_file_path)
     if not os.path.exists(dest_dirname):
@@ -65,18 +80,30 @@ def preprocess_and_write(params: Tuple[bytes, bytes, PrepConfig, str]):
 
     if not REWRITE_PREPROCESSED_FILE and os.path.exists(dest_file_path):
         logger.warning(f"File {dest_file_path} already exists! Doing nothing.")
-        return
+        return False
 
     not_finished_dest_file_path = dest_file_path + NOT_FINISHED_EXTENSION.encode()
     with gzip.GzipFile(src_file_path, 'rb') as i, open(not_finished_dest_file_path, 'w') as o:
         token_list = pickle.load(i)
         repr, metadata = to_repr(prep_config, token_list + [SpecialToken(placeholders['ect'])], get_global_bpe_data_if_available())
-        o.write(to_literal_str(to_token_str(repr)) + '\n')
+        line = to_literal_str(to_token_str(repr))
+        o.write(line + '\n')
 
     if part_nonbpe_vocab_folder:
         save_metadata(metadata, os.path.join(part_nonbpe_vocab_folder, f'{os.path.basename(dest_file_path)}_-_{time.time()}'))
+    # written before the preprocessed file so that the boundaries exist for every preprocessed file
+    write_word_boundaries(metadata, word_boundaries_file_path)
 
     os.rename(not_finished_dest_file_path, dest_file_path)
+    count_words_inline(line)
+    report_progress(files=1, tokens=len(repr))
+    return True
+
+
+def init_worker(progress: ProgressChannel, inline_vocab_counting: Optional[Tuple[str, int]]) -> None:
+    init_progress_channel(progress)
+    if inline_vocab_counting:
+        init_inline_vocab_counting(*inline_vocab_counting)
 
 #TODO make this method independent of actual directory structure
 def init_bpe_data(prep_config: PrepConfig, custom_bpe_config: Optional[CustomBpeConfig], force_reinit: bool=True):
@@ -113,13 +140,20 @@ def init_bpe_data(prep_config: PrepConfig, custom_bpe_config: Optional[CustomBpe
         global_bpe_data.merges = read_merges(bpe_merges_file)
 
 
-def params_generator(dataset: Dataset, path_to_part_metadata: Optional[str]):
-    for input_file_path in dataset.parsed.file_iterator():
+def params_generator(dataset: Dataset, path_to_part_metadata: Optional[str], files: Optional[List[bytes]] = None):
+    for input_file_path in dataset.parsed.file_iterator(files):
         output_file_path = dataset.parsed.get_new_file_name(input_file_path, dataset.preprocessed)
-        yield (input_file_path, output_file_path, dataset.prep_config, path_to_part_metadata)
+        word_boundaries_file_path = dataset.parsed.get_new_file_name(input_file_path, dataset.word_boundaries)
+        yield (input_file_path, output_file_path, word_boundaries_file_path, dataset.prep_config, path_to_part_metadata)
 
 
-def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]) -> None:
+def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig], vocab_output_dir: Optional[str] = None,
+        files: Optional[List[bytes]] = None) -> None:
+    """
+    :param vocab_output_dir: if specified, the words are counted while the files are preprocessed,
+    and the partial vocabs are left in this dir for `calc_vocab`
+    :param files: if specified, only these files are preprocessed (relative paths as returned by `Dataset.get_all_files()`)
+    """
     path_to_parsed_dataset = dataset.parsed.path
 
     if not os.path.exists(path_to_parsed_dataset):
@@ -130,7 +164,9 @@ def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]) -> None:
     if dataset.prep_config.is_bpe():
         init_bpe_data(dataset.prep_config, custom_bpe_config)
 
-    if not os.path.exists(dataset.path_to_nonbpe_vocab_file) and dataset.prep_config.is_base_bpe_config():
+    # if only some files are preprocessed, their non-bpe tokens are added to the existing non-bpe vocab
+    nonbpe_vocab_needed = not os.path.exists(dataset.path_to_nonbpe_vocab_file) or files is not None
+    if nonbpe_vocab_needed and dataset.prep_config.is_base_bpe_config():
         path_to_part_metadata = f'{dataset.path_to_nonbpe_vocab_file}_part'
     else:
         path_to_part_metadata = None
@@ -139,21 +175,24 @@ def run(dataset: Dataset, custom_bpe_config: Optional[CustomBpeConfig]) -> None:
 
     logger.info(f"Writing preprocessed files to {dataset.preprocessed.path}")
 
-    if dataset.files_need_to_be_saved():
-        files_total = 0
-        for _ in dataset.get_all_files():
-            files_total += 1
-            print(f"Files scanned: {files_total}", end='\r')
-            if files_total > LIMIT_FILES_SCANNING:
-                files_total = None
-                logger.info(f"Total files to be preprocessed: {LIMIT_FILES_SCANNING}+")
-                break
-    else:
-        files_total = len([f for f in dataset.get_all_files()])
-    with Pool() as pool:
-        it = pool.imap_unordered(preprocess_and_write, params_generator(dataset, path_to_part_metadata), chunksize=CHUNKSIZE)
-        for _ in tqdm(it, total=files_total):
-            pass
+    # if the list of files is not saved yet, the files are passed to the workers while the dataset is being walked
+    files_total = len(files) if files is not None else dataset.count_files()
+    inline_vocab_counting = start_inline_vocab_counting(vocab_output_dir) if vocab_output_dir else None
+    n_files = 0
+    progress = ProgressChannel()
+    with Pool(initializer=init_worker, initargs=(progress, inline_vocab_counting)) as pool:
+        it = pool.imap_unordered(preprocess_and_write, params_generator(dataset, path_to_part_metadata, files), chunksize=CHUNKSIZE)
+        with tqdm(it, total=files_total) as progress_bar:
+            for _ in progress_bar:
+                n_files += 1
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+        # the workers dump the words they have counted when they exit
+        pool.close()
+        pool.join()
+    logger.info(f"Preprocessed: {progress}")
+    if inline_vocab_counting:
+        # files that already existed and were not preprocessed are not counted
+        finish_inline_vocab_counting(*inline_vocab_counting, n_files)
 
     if path_to_part_metadata:
         vocabloader.gather_non_bpe_vocab(dataset)
@@ -2,203 +2,186 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
+import heapq
+import itertools
 import logging.config
 import multiprocessing
 import os
 import platform
 import shutil
-from collections import Counter, defaultdict
-from fnmatch import fnmatch
-from multiprocessing import Queue
+import struct
+import zlib
+from collections import Counter
+from multiprocessing.util import Finalize
 from multiprocessing.pool import Pool
-from queue import Empty
-from typing import List, Tuple, Dict, Iterator, Set
+from typing import List, Tuple, Dict, Iterator, Set, Optional, Iterable
 
-import dill as pickle
+import numpy as np
 import time
 from tqdm import tqdm
 
 from codeprep.fileutils import read_file_contents
+from codeprep.pipeline.vocabgrowth import VocabGrowthSketch, shuffle_files, estimate_vocab_growth
 from codeprep.preprocess.placeholders import placeholders
-from codeprep.util import to_literal_str, to_non_literal_str, AtomicInteger, merge_dicts_, groupify, \
-    create_chunk_generator
+from codeprep.util import to_literal_str, to_non_literal_str, merge_dicts_, groupify, ProgressChannel, \
+    init_progress_channel, report_progress
 
 logger = logging.getLogger(__name__)
 
-queue_size = AtomicInteger()
-
 PARTVOCAB_EXT = 'partvocab'
 PARTIAL_VOCABS_READY_FILENAME = 'ready'
+PARTITION_VOCAB_PREFIX = 'partition_'
+NOT_FINISHED_EXT = '.part'
 
 VOCABSIZE_FILENAME = 'vocabsize'
 VOCAB_FILENAME = 'vocab'
 
-N_CHUNKS = 20
-BLOCKING_TIMEOUT_SECONDS_SHORT = 5
-BLOCKING_TIMEOUT_SECONDS_LONG = 300
 MAX_INIT_PARTIAL_VOCABS = 256 * 20
+# the number of groups of files per cpu the words are counted in, each group gives a partial vocab
+PARTIAL_VOCABS_PER_CPU = 16
+
+RUN_EXT = 'run'
+# the number of distinct words a process of the bounded-memory vocab calculation keeps in memory
+MAX_WORDS_IN_MEMORY = 1000 * 1000
+MAX_RUNS_TO_MERGE = 64
+# the number of files after which a worker counting words inline dumps its counts
+INLINE_VOCAB_BATCH_FILES = 1000
+
+PARTVOCAB_MAGIC = b'CPV4'
+# magic, id length, chunk, n_files, n_words, arena length (in characters)
+PARTVOCAB_HEADER = struct.Struct('<4sqqqqq')
+# body length, crc32 of the body, magic
+PARTVOCAB_FOOTER = struct.Struct('<QI4s')
+
+
+class PartialVocabFileCorrupted(Exception):
+    pass
 
 
 class PartialVocab(object):
-    CLASS_VERSION = '2.0.0'
+    CLASS_VERSION = '4.0.0'
 
     def __init__(self, word_counts: Counter, chunk: int):
         if not isinstance(word_counts, Counter):
             raise TypeError(f'Vocab must be a Counter, but is {type(word_counts)}')
 
         self.merged_word_counts = word_counts
-        self.stats = [(1,
-                       len(self.merged_word_counts),
-                       self.merged_word_counts[placeholders['non_eng']])]
         self.n_files = 1
         self.chunk = chunk
         self.id = self._generate_id()
 
     def _generate_id(self) -> str:
-        return str(os.getpid()) + ''.join(str(time.time()).split('.'))
-
-    def renew_id(self) -> None:
-        self.id = self._generate_id()
-
-    def set_path_to_dump(self, path: str) -> None:
-        self.path_to_dump = path
+        return _generate_id()
 
     def add_vocab(self, partial_vocab: 'PartialVocab') -> List[str]:
         self.merged_word_counts, new_words = merge_dicts_(self.merged_word_counts, partial_vocab.merged_word_counts)
-        cur_vocab_size = len(self.merged_word_counts)
-
         self.n_files += partial_vocab.n_files
-        new_stats_entry = (self.n_files,
-                           cur_vocab_size,
-                           self.merged_word_counts[placeholders['non_eng']])
-        self.stats.extend(partial_vocab.stats + [new_stats_entry])
         return new_words
 
-    def write_stats(self, path_to_stats_file: str) -> None:
-        stats = self.__generate_stats()
-        with open(path_to_stats_file, 'w') as f:
-            vocabsize = int(stats[-1][1][0])
-            f.write(f'{vocabsize}\n')
-            for percent, (v, n) in stats:
-                f.write(f"{percent:.4f} {int(v)} {int(n)}\n")
-
-    def limit_max_vocab(self, vocab_size_threshold: int) -> None:
-        sorted_vocab = sorted(self.merged_word_counts.items(), key=lambda x: x[1], reverse=True)
-        if vocab_size_threshold > len(sorted_vocab):
-            return
-        min_freq_excluded = sorted_vocab[vocab_size_threshold][1]
-        adjusted_threshold = vocab_size_threshold - 1
-        while adjusted_threshold >= 0 and sorted_vocab[adjusted_threshold][1] == min_freq_excluded:
-            adjusted_threshold -= 1
-        self.merged_word_counts = {k: v for (k, v) in sorted_vocab[:adjusted_threshold + 1]}
-
     def write_vocab(self, path_to_vocab_file: str) -> None:
         sorted_vocab = sorted(self.merged_word_counts.items(), key=lambda x: x[1], reverse=True)
         _dump_vocab_dict(sorted_vocab, path_to_vocab_file, to_literal=False)
 
-    def __generate_stats(self):
-        d = defaultdict(list)
-        for entry in self.stats:
-            d[entry[0]].append(tuple(entry[1:]))
-        fin = {(float(k) / self.n_files): tuple([sum(elm) / len(elm) for elm in zip(*v)]) for k, v in d.items()}
-        return sorted(fin.items())
-
-
-class VocabMerger(multiprocessing.Process):
-    def __init__(self, id: int, tasks: Dict[int, Queue], path_to_dump: str, process_counter: AtomicInteger,
-                 chunk_queue: Queue, merges_left_counter: AtomicInteger,
-                 vocab_file_path: str, vocab_size_file_path: str):
-        multiprocessing.Process.__init__(self)
-        self.id = id
-        self.tasks = tasks
-        self.path_to_dump = path_to_dump
-        self.process_counter = process_counter
-        self.chunk_queue = chunk_queue
-        self.merges_left_counter = merges_left_counter
-        self.total_merges = merges_left_counter.value
-        self.vocab_file_path = vocab_file_path
-        self.vocav_size_file_path = vocab_size_file_path
-
-    def run(self) -> None:
-        while True:
-            chunk_assigned = self.chunk_queue.get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_SHORT)
-            if chunk_assigned == -1:
-                if not self.process_counter.compare_and_dec(1):
-                    logger.debug(
-                        f"[{self.id}] No vocabs available for merge. "
-                        f"Terminating process..., mergers left: {self.process_counter.value}")
-                    break
-                else:
-                    logger.debug("Leaving 1 process to finish the merges")
-                    self._finish_merges()
-                    logger.debug(f'[{self.id}] Vocab files are saved. Terminating the process...')
-                    break
-
-            first = None
-            try:
-                first = self.tasks[chunk_assigned].get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_LONG)
-                second = self.tasks[chunk_assigned].get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_LONG)
-            except Empty:
-                logger.debug(f"[{self.id}] Could not get a task from queue. Terminating")
-                if first:
-                    self.tasks[chunk_assigned].put_nowait(first)
-                return
-
-            start = time.time()
-
-            merges_left = self.merges_left_counter.get_and_dec()
-            merges_done = self.total_merges - merges_left
-            log_this_merge = (merges_left & (merges_left - 1) == 0 or merges_done & (merges_done - 1) == 0)
-            if log_this_merge:
-                logger.info(
-                    f'[{self.id}] Merging vocabs ({self.total_merges - merges_left} out of {self.total_merges})')
-
-            first, new_words = self._merge(first, second)
-
-            if log_this_merge:
-                self._log_merge_results(new_words, len(first.merged_word_counts), time.time() - start)
-
-            self.tasks[chunk_assigned].put_nowait(first)
-
-    def _finish_merges(self) -> None:
-        logger.info("===============     Finishing merges    ===============")
-        list_from_chunks = [queue.get(block=True, timeout=BLOCKING_TIMEOUT_SECONDS_SHORT) for queue in
-                            self.tasks.values()]
-
-        percents_in_one_chunk = 100 // len(list_from_chunks)
-
-        first = list_from_chunks.pop()
-        for i, vocab in enumerate(list_from_chunks):
-            logger.info(
-                f'{(i+1)* percents_in_one_chunk}% + {percents_in_one_chunk}%  ---> {(i+2) * percents_in_one_chunk}%')
-
-            start = time.time()
-
-            first, new_words = self._merge(first, vocab)
-
-            self._log_merge_results(new_words, len(first.merged_word_counts), time.time() - start)
-
-        first.write_stats(self.vocav_size_file_path)
-        first.write_vocab(self.vocab_file_path)
-        shutil.rmtree(self.path_to_dump)
-
-    def _log_merge_results(self, new_words: List[str], resulting_vocab_size: int, time: float) -> None:
-        logger.debug(f"[{self.id}] New words: {new_words[:10]} ..., total: {len(new_words)}")
-        logger.debug(
-            f"[{self.id}] Merging took {time:.3f} s, current vocab size: {resulting_vocab_size}")
-
-    def _merge(self, first: PartialVocab, second: PartialVocab) -> Tuple[PartialVocab, List[str]]:
-        first_id = first.id
-        second_id = second.id
-
-        new_words = first.add_vocab(second)
-
-        first.renew_id()
-        path_to_new_file = os.path.join(self.path_to_dump, f'{first_id}_{second_id}_{first.id}.{PARTVOCAB_EXT}')
-        pickle.dump(first, open(path_to_new_file, 'wb'))
-        finish_file_dumping(path_to_new_file)
-
-        return first, new_words
+    def dump(self, path: str) -> None:
+        """
+        Words are stored as one string (arena) with their offsets in it, the counts as an int64 array.
+        The file is followed by a footer with the length and the checksum of its contents,
+        and is renamed to `path` when it is completely written.
+        """
+        words = list(self.merged_word_counts.keys())
+        arena = ''.join(words)
+        offsets = np.cumsum([0] + [len(word) for word in words], dtype=np.int64)
+        counts = np.fromiter(self.merged_word_counts.values(), dtype=np.int64, count=len(words))
+        id_bytes = self.id.encode('utf-8')
+        body = b''.join([
+            PARTVOCAB_HEADER.pack(PARTVOCAB_MAGIC, len(id_bytes), self.chunk, self.n_files, len(words), len(arena)),
+            id_bytes,
+            offsets.tobytes(),
+            counts.tobytes(),
+            arena.encode('utf-8', 'surrogatepass'),
+        ])
+        with open(path + NOT_FINISHED_EXT, 'wb') as f:
+            f.write(body)
+            f.write(PARTVOCAB_FOOTER.pack(len(body), zlib.crc32(body), PARTVOCAB_MAGIC))
+        os.rename(path + NOT_FINISHED_EXT, path)
+
+    @staticmethod
+    def load(path: str) -> 'PartialVocab':
+        """
+        >>> import tempfile
+        >>> vocab = PartialVocab(Counter({'a': 3, 'bc': 1, 'Привет': 2}), 5)
+        >>> with tempfile.TemporaryDirectory() as d:
+        ...     vocab.dump(os.path.join(d, 'vocab'))
+        ...     loaded = PartialVocab.load(os.path.join(d, 'vocab'))
+        >>> loaded.merged_word_counts, loaded.chunk, loaded.n_files, loaded.id == vocab.id
+        (Counter({'a': 3, 'Привет': 2, 'bc': 1}), 5, 1, True)
+        """
+        with open(path, 'rb') as f:
+            body = _read_partial_vocab_body(f, path)
+        _, id_length, chunk, n_files, n_words, arena_length = PARTVOCAB_HEADER.unpack_from(body)
+        offset = PARTVOCAB_HEADER.size
+        partial_vocab_id = body[offset:offset + id_length].decode('utf-8')
+        offset += id_length
+        word_offsets = np.frombuffer(body, dtype=np.int64, count=n_words + 1, offset=offset).tolist()
+        offset += (n_words + 1) * 8
+        counts = np.frombuffer(body, dtype=np.int64, count=n_words, offset=offset).tolist()
+        offset += n_words * 8
+        arena = body[offset:].decode('utf-8', 'surrogatepass')
+        if len(arena) != arena_length:
+            raise PartialVocabFileCorrupted(f'{path}: expected {arena_length} characters of words, found {len(arena)}')
+
+        partial_vocab = PartialVocab.__new__(PartialVocab)
+        partial_vocab.merged_word_counts = Counter(
+            {arena[word_offsets[i]:word_offsets[i + 1]]: counts[i] for i in range(n_words)})
+        partial_vocab.n_files = n_files
+        partial_vocab.chunk = chunk
+        partial_vocab.id = partial_vocab_id
+        return partial_vocab
+
+
+def _read_partial_vocab_footer(f, path: str) -> Tuple[int, int]:
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    if file_size < PARTVOCAB_HEADER.size + PARTVOCAB_FOOTER.size:
+        raise PartialVocabFileCorrupted(f'{path}: file is too short ({file_size} bytes)')
+    f.seek(file_size - PARTVOCAB_FOOTER.size)
+    body_length, checksum, magic = PARTVOCAB_FOOTER.unpack(f.read(PARTVOCAB_FOOTER.size))
+    if magic != PARTVOCAB_MAGIC or body_length != file_size - PARTVOCAB_FOOTER.size:
+        raise PartialVocabFileCorrupted(f'{path}: not a partial vocab file or the file is incomplete')
+    return body_length, checksum
+
+
+def _read_partial_vocab_body(f, path: str) -> bytes:
+    body_length, checksum = _read_partial_vocab_footer(f, path)
+    f.seek(0)
+    body = f.read(body_length)
+    if zlib.crc32(body) != checksum:
+        raise PartialVocabFileCorrupted(f'{path}: checksum mismatch')
+    return body
+
+
+def is_partial_vocab_file_valid(path: str, verify_checksum: bool = True) -> bool:
+    """
+    Checks the footer of the file, the vocab is not deserialized.
+    Without `verify_checksum` only the footer is read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if verify_checksum:
+                _read_partial_vocab_body(f, path)
+            else:
+                _read_partial_vocab_footer(f, path)
+        return True
+    except PartialVocabFileCorrupted:
+        return False
+
+
+_id_counter = itertools.count()
+
+
+def _generate_id() -> str:
+    # the counter makes ids generated by the same process within the timer resolution different
+    return str(os.getpid()) + ''.join(str(time.time()).split('.')) + f'_{next(_id_counter)}'
 
 
 def get_vocab(file_paths: List[str], represented_as_literal_str: bool = True) -> Counter:
@@ -211,103 +194,247 @@ def get_vocab(file_paths: List[str], represented_as_literal_str: bool = True) ->
     return vocab
 
 
-def create_and_dump_partial_vocab(param: Tuple[List[str], str, int]) -> PartialVocab:
-    path_to_file, path_to_dump, chunk = param
-    vocab = get_vocab(path_to_file)
-    partial_vocab = PartialVocab(vocab, chunk)
-    pickle.dump(partial_vocab, open(os.path.join(path_to_dump, f'{partial_vocab.id}.{PARTVOCAB_EXT}'), 'wb'))
-    return partial_vocab
+def get_partition(word: str, n_partitions: int) -> int:
+    """
+    Unlike `hash()`, gives the same result in all the processes and across runs.
 
+    >>> get_partition('hello', 4), get_partition('world', 4)
+    (2, 3)
+    """
+    return zlib.crc32(word.encode('utf-8', 'surrogatepass')) % n_partitions
 
-def finish_file_dumping(path_to_new_file: str) -> None:
-    try:
-        pickle.load(open(path_to_new_file, 'rb'))
-    except EOFError:
-        # file has not been written properly
-        os.remove(path_to_new_file)
-        return
 
-    dir, base = os.path.split(path_to_new_file)
-    spl = base.split('.')[0].split('_')
-    if len(spl) != 3:
-        raise AssertionError(f'Wrong file: {path_to_new_file}')
-    first_id, second_id, new_id = spl[0], spl[1], spl[2]
+def split_into_partitions(word_counts: Counter, n_partitions: int) -> List[Counter]:
+    """
+    >>> split_into_partitions(Counter({'hello': 1, 'world': 2, 'hi': 3}), 4)
+    [Counter({'hi': 3}), Counter(), Counter({'hello': 1}), Counter({'world': 2})]
+    """
+    partitions = [Counter() for _ in range(n_partitions)]
+    for word, count in word_counts.items():
+        partitions[get_partition(word, n_partitions)][word] = count
+    return partitions
 
-    first_file = os.path.join(dir, f'{first_id}.{PARTVOCAB_EXT}')
-    if os.path.exists(first_file):
-        os.remove(first_file)
 
-    second_file = os.path.join(dir, f'{second_id}.{PARTVOCAB_EXT}')
-    if os.path.exists(second_file):
-        os.remove(second_file)
+def _get_partition_dir(path_to_dump: str, partition: int) -> str:
+    return os.path.join(path_to_dump, str(partition))
 
-    new_file = os.path.join(dir, f'{new_id}.{PARTVOCAB_EXT}')
-    os.rename(path_to_new_file, new_file)
+
+def _create_partition_dirs(path_to_dump: str, n_partitions: int) -> None:
+    """
+    Partial vocabs of each partition are kept in a separate directory, so that a reducer lists only its own files.
+    """
+    if os.path.exists(path_to_dump):
+        shutil.rmtree(path_to_dump)
+    for partition in range(n_partitions):
+        os.makedirs(_get_partition_dir(path_to_dump, partition))
 
 
-def list_to_queue(lst: List) -> Queue:
-    queue = Queue()
-    for elm in lst:
-        queue.put_nowait(elm)
-    return queue
+def _get_partial_vocab_file_name(partial_vocab: PartialVocab) -> str:
+    return f'{partial_vocab.id}.{PARTVOCAB_EXT}'
 
 
-def create_initial_partial_vocabs(all_files: List[bytes], path_to_dump: str) -> List[PartialVocab]:
-    partial_vocabs_queue = []
-    file_groups = groupify(all_files, MAX_INIT_PARTIAL_VOCABS)
-    file_groups_total = len(file_groups)
-    chunk_generator = create_chunk_generator(len(file_groups), N_CHUNKS)
-    params = [(file_group, path_to_dump, chunk) for file_group, chunk in zip(file_groups, chunk_generator)]
-    pool = Pool()
-    partial_vocab_it = pool.imap_unordered(create_and_dump_partial_vocab, params)
-    for partial_vocab in tqdm(partial_vocab_it, total=file_groups_total):
-        partial_vocabs_queue.append(partial_vocab)
-    return partial_vocabs_queue
+def _get_n_file_groups(n_files: int) -> int:
+    """
+    >>> from unittest import mock
+    >>> with mock.patch('codeprep.pipeline.vocab.multiprocessing.cpu_count', return_value=4):
+    ...     _get_n_file_groups(10), _get_n_file_groups(1000), _get_n_file_groups(10 ** 6)
+    (10, 64, 64)
+    """
+    return min(n_files, multiprocessing.cpu_count() * PARTIAL_VOCABS_PER_CPU, MAX_INIT_PARTIAL_VOCABS)
 
 
-def create_chunk_queue(chunk_sizes: Dict[int, int], num_mergers: int) -> Tuple[Queue, int]:
-    chunk_queue_list = [chunk for chunk, chunk_size in chunk_sizes.items() for _ in range(chunk_size - 1)]
-    return list_to_queue(chunk_queue_list + [-1 for _ in range(num_mergers)]), len(chunk_queue_list)
+def create_and_dump_partial_vocab(param: Tuple[List[str], str, int]) -> str:
+    """
+    Map step: counts the words in a group of files and dumps the counts split into partitions by word hash.
+    All the partitions of a group get the same id, so that all the reducers add them up in the same order.
+    """
+    path_to_file, path_to_dump, n_partitions = param
+    vocab = get_vocab(path_to_file)
+    report_progress(files=len(path_to_file), tokens=sum(vocab.values()))
+    return _dump_partitioned(vocab, len(path_to_file), path_to_dump, n_partitions)
+
+
+def _dump_partitioned(vocab: Counter, n_files: int, path_to_dump: str, n_partitions: int) -> str:
+    partial_vocab_id = _generate_id()
+    for partition, word_counts in enumerate(split_into_partitions(vocab, n_partitions)):
+        partial_vocab = PartialVocab(word_counts, partition)
+        partial_vocab.id = partial_vocab_id
+        partial_vocab.n_files = n_files
+        partial_vocab.dump(os.path.join(_get_partition_dir(path_to_dump, partition),
+                                        _get_partial_vocab_file_name(partial_vocab)))
+    return partial_vocab_id
+
+
+class InlineVocabCounter(object):
+    """
+    Counts the words of the files preprocessed by a worker process, so that the files do not have to be
+    read again to calculate the vocab. The counts are dumped as partial vocabs every `INLINE_VOCAB_BATCH_FILES` files
+    and when the worker exits.
+    """
+    def __init__(self, path_to_dump: str, n_partitions: int):
+        self.path_to_dump = path_to_dump
+        self.n_partitions = n_partitions
+        self.word_counts = Counter()
+        self.n_files = 0
+
+    def add_file(self, line: str) -> None:
+        self.word_counts.update(line.split(' '))
+        self.n_files += 1
+        if self.n_files >= INLINE_VOCAB_BATCH_FILES or len(self.word_counts) >= MAX_WORDS_IN_MEMORY:
+            self.dump()
+
+    def dump(self) -> None:
+        if not self.n_files:
+            return
+        _dump_partitioned(self.word_counts, self.n_files, self.path_to_dump, self.n_partitions)
+        self.word_counts = Counter()
+        self.n_files = 0
 
 
-def mapify_tasks(tasks: List[PartialVocab]) -> Tuple[Dict[int, Queue], Dict[int, int]]:
-    task_lists_in_chunks = defaultdict(list)
-    for task in tasks:
-        task_lists_in_chunks[task.chunk].append(task)
-    return {chunk: list_to_queue(task_list_in_chunk) for chunk, task_list_in_chunk in
-            task_lists_in_chunks.items()}, {k: len(v) for k, v in task_lists_in_chunks.items()}
+_inline_vocab_counter: Optional[InlineVocabCounter] = None
 
 
-def load_partial_vocabs(path: str) -> List[PartialVocab]:
-    logger.info(f"Loading partially calculated vocabs from {path} ...")
-    for file in os.listdir(path):
-        if fnmatch(file, f'[0-9]*_[0-9]*_[0-9]*.{PARTVOCAB_EXT}'):
-            # hasn't been terminated properly
-            finish_file_dumping(os.path.join(path, file))
+def init_inline_vocab_counting(path_to_dump: str, n_partitions: int) -> None:
+    """
+    To be called in a worker process of a pool. The rest of the counts is dumped when the worker exits,
+    i.e. the pool has to be closed and joined, not terminated.
+    """
+    global _inline_vocab_counter
+    _inline_vocab_counter = InlineVocabCounter(path_to_dump, n_partitions)
+    Finalize(None, _inline_vocab_counter.dump, exitpriority=10)
 
-    task_list = []
-    for file in os.listdir(path):
-        if file.endswith(PARTVOCAB_EXT):
-            part_vocab = pickle.load(open(os.path.join(path, file), 'rb'))
-            if not isinstance(part_vocab, PartialVocab):
-                raise TypeError(f"Object {str(part_vocab)} must be VocabMerger version {part_vocab.VERSION}")
-            task_list.append(part_vocab)
 
-    return task_list
+def count_words_inline(line: str) -> None:
+    """
+    :param line: preprocessed file as it is written to disk
+    """
+    if _inline_vocab_counter:
+        _inline_vocab_counter.add_file(line)
 
 
-def create_partial_vocabs(file_iterator: Iterator[bytes], path_to_dump: str) -> List[PartialVocab]:
-    logger.info(f"Calculating vocabulary from scratch")
-    if os.path.exists(path_to_dump):
+def start_inline_vocab_counting(output_dir: str) -> Tuple[str, int]:
+    path_to_dump = os.path.join(output_dir, 'part_vocab')
+    n_partitions = multiprocessing.cpu_count()
+    _create_partition_dirs(path_to_dump, n_partitions)
+    return path_to_dump, n_partitions
+
+
+def finish_inline_vocab_counting(path_to_dump: str, n_partitions: int, n_files: int) -> bool:
+    """
+    Marks the partial vocabs dumped by the workers as ready to be added up by `calc_vocab`
+    if the words of all the `n_files` files have been counted.
+    """
+    n_files_counted = 0
+    # each partial vocab is split into all the partitions, the first one is enough to count the files
+    partition_dir = _get_partition_dir(path_to_dump, 0)
+    for file in os.listdir(partition_dir):
+        if file.endswith(f'.{PARTVOCAB_EXT}'):
+            with open(os.path.join(partition_dir, file), 'rb') as f:
+                n_files_counted += PARTVOCAB_HEADER.unpack(f.read(PARTVOCAB_HEADER.size))[3]
+    if n_files_counted != n_files:
+        logger.warning(f'Words of {n_files_counted} out of {n_files} files are counted during preprocessing, '
+                       f'the vocab will be calculated from the preprocessed files.')
         shutil.rmtree(path_to_dump)
-    os.makedirs(path_to_dump)
+        return False
+    with open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'w') as f:
+        f.write(f'{n_partitions}\n')
+    return True
+
+
+def create_initial_partial_vocabs(all_files: List[bytes], path_to_dump: str, n_partitions: int) -> List[str]:
+    partial_vocab_ids = []
+    file_groups = groupify(all_files, _get_n_file_groups(len(all_files)))
+    params = [(file_group, path_to_dump, n_partitions) for file_group in file_groups]
+    progress = ProgressChannel()
+    with Pool(initializer=init_progress_channel, initargs=(progress,)) as pool:
+        partial_vocab_it = pool.imap_unordered(create_and_dump_partial_vocab, params)
+        with tqdm(partial_vocab_it, total=len(file_groups)) as progress_bar:
+            for partial_vocab_id in progress_bar:
+                partial_vocab_ids.append(partial_vocab_id)
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+    logger.info(f"Counted words: {progress}")
+    return partial_vocab_ids
+
+
+def load_partial_vocabs(path: str, partition: int) -> Iterator[PartialVocab]:
+    """
+    Partial vocabs are loaded one at a time in the order of their ids,
+    so that all the reducers add them up in the same order.
+    """
+    partition_dir = _get_partition_dir(path, partition)
+    for file in sorted(file for file in os.listdir(partition_dir) if file.endswith(f'.{PARTVOCAB_EXT}')):
+        yield PartialVocab.load(os.path.join(partition_dir, file))
+
+
+def reduce_partition(param: Tuple[str, int]) -> List[Tuple[int, int]]:
+    """
+    Reduce step: adds up the counts of all the partial vocabs of the partition and writes them sorted by frequency.
+
+    :return: the vocab size of the partition and the number of non-english words in it
+    after each of the partial vocabs is added
+    """
+    path_to_dump, partition = param
+    merged = None
+    stats = []
+    for partial_vocab in load_partial_vocabs(path_to_dump, partition):
+        if merged is None:
+            merged = partial_vocab
+        else:
+            merged.add_vocab(partial_vocab)
+            report_progress(merges=1)
+        stats.append((len(merged.merged_word_counts), merged.merged_word_counts[placeholders['non_eng']]))
+    path = _get_path_to_partition_vocab(path_to_dump, partition)
+    if merged:
+        merged.write_vocab(path + NOT_FINISHED_EXT)
+    else:
+        open(path + NOT_FINISHED_EXT, 'w').close()
+    os.rename(path + NOT_FINISHED_EXT, path)
+    return stats
+
+
+def _get_path_to_partition_vocab(path_to_dump: str, partition: int) -> str:
+    return os.path.join(path_to_dump, f'{PARTITION_VOCAB_PREFIX}{partition}')
+
+
+def _read_sorted_vocab_lines(path: str) -> Iterator[Tuple[int, str]]:
+    with open(path, 'r') as f:
+        for line in f:
+            yield int(line[line.rindex(VOCAB_DICT_DELIM) + 1:]), line
+
+
+def merge_partition_vocabs(path_to_dump: str, n_partitions: int, vocab_file_path: str) -> None:
+    """
+    Partitions are disjoint and sorted by frequency, so the vocab is their k-way merge.
+    """
+    partition_vocabs = [_read_sorted_vocab_lines(_get_path_to_partition_vocab(path_to_dump, partition))
+                        for partition in range(n_partitions)]
+    with open(vocab_file_path, 'w') as f:
+        for _, line in heapq.merge(*partition_vocabs, key=lambda x: -x[0]):
+            f.write(line)
+
+
+def write_vocab_growth_stats(stats: List[Tuple[int, int, int]], path_to_stats_file: str) -> None:
+    """
+    :param stats: vocab size and the number of non-english words after each number of partial vocabs added up
+    """
+    n_files = stats[-1][0] if stats else 0
+    with open(path_to_stats_file, 'w') as f:
+        f.write(f'{stats[-1][1] if stats else 0}\n')
+        for n, vocab_size, non_eng in stats:
+            f.write(f"{n / n_files:.4f} {vocab_size} {non_eng}\n")
+
+
+def create_partial_vocabs(file_iterator: Iterator[bytes], path_to_dump: str, n_partitions: int) -> List[str]:
+    logger.info(f"Calculating vocabulary from scratch")
+    _create_partition_dirs(path_to_dump, n_partitions)
 
     all_files = [file for file in file_iterator]
     if not all_files:
         logger.warning("No preprocessed files found.")
         exit(4)
-    task_list = create_initial_partial_vocabs(all_files, path_to_dump)
-    open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'a').close()
+    task_list = create_initial_partial_vocabs(all_files, path_to_dump, n_partitions)
+    with open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'w') as f:
+        f.write(f'{n_partitions}\n')
     return task_list
 
 
@@ -315,6 +442,28 @@ def partial_vocabs_ready(path_to_dump: str) -> bool:
     return os.path.exists(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME))
 
 
+def _read_n_partitions(path_to_dump: str) -> Optional[int]:
+    """
+    :return: the number of partitions the partial vocabs were split into or None if they cannot be reused
+    """
+    with open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'r') as f:
+        content = f.read().strip()
+    # partial vocabs written before the vocab was partitioned
+    if not content:
+        return None
+    n_partitions = int(content)
+    if not all(os.path.isdir(_get_partition_dir(path_to_dump, partition)) for partition in range(n_partitions)):
+        logger.warning(f'Partial vocabs at {path_to_dump} are not split into partition directories.')
+        return None
+    for dir, _, files in os.walk(path_to_dump):
+        for file in files:
+            if file.endswith(f'.{PARTVOCAB_EXT}') and \
+                    not is_partial_vocab_file_valid(os.path.join(dir, file), verify_checksum=False):
+                logger.warning(f'Partial vocab {file} is incomplete or written in an old format.')
+                return None
+    return n_partitions
+
+
 def _dump_vocab_dict(lst: List[Tuple[str, int]], file: str, to_literal=True) -> None:
     with open(file, 'w') as f:
         for word, freq in lst:
@@ -326,14 +475,16 @@ def _dump_vocab_dict(lst: List[Tuple[str, int]], file: str, to_literal=True) ->
 VOCAB_DICT_DELIM = '\t'
 
 
-def _load_vocab_dict(file) -> Dict[str, int]:
-    words = {}
+def _read_vocab_dict(file) -> Iterator[Tuple[str, int]]:
     with open(file, 'r') as f:
         for line in f:
             line = line.rstrip('\n')
             splits = line.split(VOCAB_DICT_DELIM)
-            words[to_non_literal_str(splits[0])] = int(splits[1])
-    return words
+            yield to_non_literal_str(splits[0]), int(splits[1])
+
+
+def _load_vocab_dict(file) -> Dict[str, int]:
+    return dict(_read_vocab_dict(file))
 
 
 def _load_vocab_set(file: str) -> Set[str]:
@@ -344,7 +495,189 @@ def _load_vocab_set(file: str) -> Set[str]:
     return non_bpe_tokens
 
 
-def calc_vocab(path: str, file_iterator: Iterator[bytes], output_dir: str):
+def _write_run(entries: Iterable[Tuple[str, int]], path: str) -> None:
+    with open(path + NOT_FINISHED_EXT, 'w') as f:
+        for word, count in entries:
+            f.write(f'{word}{VOCAB_DICT_DELIM}{count}\n')
+    os.rename(path + NOT_FINISHED_EXT, path)
+
+
+def _read_run(path: str) -> Iterator[Tuple[str, int]]:
+    with open(path, 'r') as f:
+        for line in f:
+            word, _, count = line.rstrip('\n').rpartition(VOCAB_DICT_DELIM)
+            yield word, int(count)
+
+
+def _sum_equal_words(entries_sorted_by_word: Iterable[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+    """
+    >>> list(_sum_equal_words([('a', 1), ('a', 2), ('b', 1)]))
+    [('a', 3), ('b', 1)]
+    """
+    for word, group in itertools.groupby(entries_sorted_by_word, key=lambda e: e[0]):
+        yield word, sum(count for _, count in group)
+
+
+def _merge_sorted_runs(run_paths: List[str], by_frequency: bool) -> Iterator[Tuple[str, int]]:
+    """
+    Runs sorted by word are merged summing up the counts of equal words,
+    runs sorted by frequency (descending) are just merged.
+    """
+    runs = [_read_run(path) for path in run_paths]
+    if by_frequency:
+        return heapq.merge(*runs, key=lambda e: -e[1])
+    else:
+        return _sum_equal_words(heapq.merge(*runs, key=lambda e: e[0]))
+
+
+def create_sorted_runs(param: Tuple[int, List[bytes], str, int]) -> Tuple[int, List[str], VocabGrowthSketch]:
+    """
+    Counts the words in a group of files. Every time the number of distinct words exceeds `max_words_in_memory`,
+    the counts are dumped to a new run file sorted by word.
+    """
+    group_index, file_group, path_to_dump, max_words_in_memory = param
+    run_paths = []
+    word_counts = Counter()
+    growth_sketch = VocabGrowthSketch()
+
+    def dump_run():
+        path = os.path.join(path_to_dump, f'{_generate_id()}_{len(run_paths)}.{RUN_EXT}')
+        _write_run(sorted(word_counts.items()), path)
+        run_paths.append(path)
+        word_counts.clear()
+
+    for file in file_group:
+        lines, _ = read_file_contents(file)
+        file_words = [word for line in lines for word in line.split(' ')]
+        word_counts.update(file_words)
+        growth_sketch.add_file(file_words)
+        report_progress(files=1, tokens=len(file_words))
+        if len(word_counts) >= max_words_in_memory:
+            dump_run()
+    if word_counts:
+        dump_run()
+    return group_index, run_paths, growth_sketch
+
+
+def merge_run_batch(param: Tuple[List[str], str, bool]) -> str:
+    run_paths, path_to_dump, by_frequency = param
+    path = os.path.join(path_to_dump, f'{_generate_id()}.{RUN_EXT}')
+    _write_run(_merge_sorted_runs(run_paths, by_frequency), path)
+    for run_path in run_paths:
+        os.remove(run_path)
+    return path
+
+
+def reduce_number_of_runs(run_paths: List[str], path_to_dump: str, by_frequency: bool) -> List[str]:
+    """
+    Merges the runs in batches until they can be merged at once without opening too many files.
+    """
+    while len(run_paths) > MAX_RUNS_TO_MERGE:
+        logger.debug(f'Merging {len(run_paths)} runs in batches of {MAX_RUNS_TO_MERGE}')
+        params = [(run_paths[i:i + MAX_RUNS_TO_MERGE], path_to_dump, by_frequency)
+                  for i in range(0, len(run_paths), MAX_RUNS_TO_MERGE)]
+        with Pool() as pool:
+            run_paths = list(tqdm(pool.imap(merge_run_batch, params), total=len(params)))
+    return run_paths
+
+
+def sort_externally(entries: Iterable[Tuple[str, int]], path_to_dump: str, by_frequency: bool) -> List[str]:
+    """
+    Sorts the entries by word or by frequency (descending) keeping at most `MAX_WORDS_IN_MEMORY` of them in memory.
+
+    :return: sorted runs, which can be merged at once with `_merge_sorted_runs`
+    """
+    run_paths = []
+    buffer = []
+
+    def dump_run():
+        run_paths.append(os.path.join(path_to_dump, f'{_generate_id()}.{RUN_EXT}'))
+        if by_frequency:
+            buffer.sort(key=lambda e: e[1], reverse=True)
+        else:
+            buffer.sort()
+        _write_run(buffer, run_paths[-1])
+        buffer.clear()
+
+    for entry in entries:
+        buffer.append(entry)
+        if len(buffer) >= MAX_WORDS_IN_MEMORY:
+            dump_run()
+    if buffer:
+        dump_run()
+    return reduce_number_of_runs(run_paths, path_to_dump, by_frequency)
+
+
+def write_sorted_by_frequency(entries: Iterable[Tuple[str, int]], path_to_dump: str,
+                              vocab_file_path: str) -> Tuple[int, int]:
+    """
+    :return: the size of the written vocab and the number of non-english words in it
+    """
+    vocab_size = 0
+    non_eng = 0
+
+    def counted(entries):
+        nonlocal vocab_size, non_eng
+        for word, count in entries:
+            vocab_size += 1
+            if word == placeholders['non_eng']:
+                non_eng = count
+            yield word, count
+
+    frequency_runs = sort_externally(counted(entries), path_to_dump, by_frequency=True)
+    _write_run(_merge_sorted_runs(frequency_runs, by_frequency=True), vocab_file_path)
+    for run_path in frequency_runs:
+        os.remove(run_path)
+    return vocab_size, non_eng
+
+
+def calc_vocab_bounded_memory(file_iterator: Iterator[bytes], path_to_dump: str,
+                              vocab_file_path: str, vocab_size_file_path: str) -> None:
+    """
+    External sort-merge: the memory used does not depend on the size of the vocabulary.
+    Word counts are written to runs sorted by word, which are merged summing up the counts of equal words.
+    The resulting stream is sorted by frequency with another external sort.
+
+    The growth of the vocab is estimated with `codeprep.pipeline.vocabgrowth`, only the final vocab size is exact.
+    """
+    if os.path.exists(path_to_dump):
+        shutil.rmtree(path_to_dump)
+    os.makedirs(path_to_dump)
+
+    all_files = [file for file in file_iterator]
+    if not all_files:
+        logger.warning("No preprocessed files found.")
+        exit(4)
+    file_groups = groupify(shuffle_files(all_files), MAX_INIT_PARTIAL_VOCABS)
+    params = [(i, file_group, path_to_dump, MAX_WORDS_IN_MEMORY) for i, file_group in enumerate(file_groups)]
+    word_runs = []
+    growth_sketches = [None] * len(file_groups)
+    progress = ProgressChannel()
+    with Pool(initializer=init_progress_channel, initargs=(progress,)) as pool:
+        with tqdm(pool.imap_unordered(create_sorted_runs, params), total=len(params)) as progress_bar:
+            for group_index, run_paths, growth_sketch in progress_bar:
+                word_runs.extend(run_paths)
+                growth_sketches[group_index] = growth_sketch
+                progress_bar.set_postfix_str(str(progress), refresh=False)
+    logger.info(f"Counted words: {progress}")
+    word_runs = reduce_number_of_runs(word_runs, path_to_dump, by_frequency=False)
+
+    logger.debug(f'==================    Sorting the vocab by frequency    =================')
+    vocab_size, non_eng = write_sorted_by_frequency(_merge_sorted_runs(word_runs, by_frequency=False),
+                                                    path_to_dump, vocab_file_path)
+    vocab_growth = estimate_vocab_growth(growth_sketches)
+    vocab_growth[-1] = (vocab_growth[-1][0], vocab_size, non_eng)
+    write_vocab_growth_stats(vocab_growth, vocab_size_file_path)
+    shutil.rmtree(path_to_dump)
+
+
+def calc_vocab(path: str, file_iterator: Iterator[bytes], output_dir: str, bounded_memory: bool = False,
+               top_k: Optional[int] = None, count_min_size: Optional[Tuple[int, int]] = None):
+    """
+    :param bounded_memory: calculate the vocab with external sorting, so that it does not have to fit into memory
+    :param top_k: calculate approximately only the `top_k` most frequent words, see `codeprep.pipeline.approxvocab`
+    :param count_min_size: width and depth of the Count-Min sketch to estimate the counts with if `top_k` is set
+    """
     if platform.system() == 'Darwin':
         raise OSError("Calculation of vocabulary is not supported on OSX.")
     vocab_file_path = os.path.join(output_dir, VOCAB_FILENAME)
@@ -353,32 +686,45 @@ def calc_vocab(path: str, file_iterator: Iterator[bytes], output_dir: str):
         logger.info(f"Vocab files already exist at: {os.path.dirname(vocab_size_file_path)}/ . Doing nothing.")
         return
 
+    if top_k:
+        from codeprep.pipeline.approxvocab import calc_approximate_vocab
+
+        logger.debug(f"Reading files from: {path}")
+        calc_approximate_vocab(file_iterator, top_k, vocab_file_path, vocab_size_file_path, count_min_size)
+        logger.info(f"Approximate vocab is available at {vocab_file_path}")
+        return
+
+    if bounded_memory:
+        logger.debug(f"Reading files from: {path}")
+        calc_vocab_bounded_memory(file_iterator, os.path.join(output_dir, 'vocab_runs'),
+                                  vocab_file_path, vocab_size_file_path)
+        logger.info(f"Vocab is available at {vocab_file_path}")
+        return
+
     path_to_dump = os.path.join(output_dir, 'part_vocab')
 
-    if partial_vocabs_ready(path_to_dump):
-        task_list = load_partial_vocabs(path_to_dump)
+    n_partitions = _read_n_partitions(path_to_dump) if partial_vocabs_ready(path_to_dump) else None
+    if n_partitions:
+        logger.info(f"Using partially calculated vocabs from {path_to_dump}")
     else:
         logger.debug(f"Reading files from: {path}")
-        task_list = create_partial_vocabs(file_iterator, path_to_dump)
-
-    n_processes = multiprocessing.cpu_count()
-    logger.debug(f"Using {n_processes} mergers, number of partial vocabs: {len(task_list)}")
-    tasks_queues, chunk_sizes = mapify_tasks(task_list)
-    chunk_queue, merges_to_be_done = create_chunk_queue(chunk_sizes, n_processes)
-    logger.debug(f'==================    Starting merging    =================')
-    logger.debug(f'Merges need to be done: {merges_to_be_done}')
-    process_counter = AtomicInteger(n_processes)
-    merges_left_counter = AtomicInteger(merges_to_be_done)
-    mergers = [VocabMerger(i + 1, tasks_queues, path_to_dump, process_counter, chunk_queue,
-                           merges_left_counter,
-                           vocab_file_path=vocab_file_path,
-                           vocab_size_file_path=vocab_size_file_path)
-               for i in range(n_processes)]
-    for merger in mergers:
-        merger.start()
-
-    for merger in mergers:
-        merger.join()
+        n_partitions = multiprocessing.cpu_count()
+        create_partial_vocabs(file_iterator, path_to_dump, n_partitions)
+
+    logger.debug(f'==================    Adding up partial vocabs in {n_partitions} partitions    =================')
+    params = [(path_to_dump, partition) for partition in range(n_partitions)]
+    progress = ProgressChannel()
+    with Pool(n_partitions, initializer=init_progress_channel, initargs=(progress,)) as pool:
+        partition_stats = list(tqdm(pool.imap(reduce_partition, params), total=n_partitions))
+    logger.debug(f"Partial vocabs added up: {progress}")
+
+    merge_partition_vocabs(path_to_dump, n_partitions, vocab_file_path)
+    # all the reducers add up the partial vocabs in the same order, so the sizes of the partitions
+    # after the same number of partial vocabs can be summed up to get the size of the whole vocab
+    vocab_growth = [(i + 1, sum(size for size, _ in step), sum(non_eng for _, non_eng in step))
+                    for i, step in enumerate(zip(*partition_stats))]
+    write_vocab_growth_stats(vocab_growth, vocab_size_file_path)
+    shutil.rmtree(path_to_dump)
 
     logger.info(f"Vocab is available at {vocab_file_path}")
-    logger.info(f"Vocab stats is available at {vocab_size_file_path}")
\ No newline at end of file
+    logger.info(f"Vocab stats is available at {vocab_size_file_path}")
@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Operations on already calculated vocab files, so that the vocab does not have to be recalculated
+when projects are added to or removed from a dataset.
+
+Vocab files are sorted by frequency. To merge or subtract them, they are sorted by word externally
+and then joined in one streaming pass, so only `MAX_WORDS_IN_MEMORY` words are kept in memory at a time.
+"""
+import logging
+import os
+import shutil
+import tempfile
+from typing import List, Iterator, Tuple, Optional
+
+from codeprep.pipeline.vocab import sort_externally, write_sorted_by_frequency, _read_run, _write_run, \
+    _merge_sorted_runs, reduce_number_of_runs
+
+logger = logging.getLogger(__name__)
+
+
+class VocabNotSortedError(Exception):
+    pass
+
+
+def _read_sorted_by_word(vocab_paths: List[str], path_to_dump: str) -> Iterator[Tuple[str, int]]:
+    """
+    Counts of the same word from different vocabs are summed up.
+    The runs of all the vocabs are merged in batches like in `sort_externally`, so that not too many files are open.
+    """
+    run_paths = []
+    for vocab_path in vocab_paths:
+        run_paths.extend(sort_externally(_read_run(vocab_path), path_to_dump, by_frequency=False))
+    run_paths = reduce_number_of_runs(run_paths, path_to_dump, by_frequency=False)
+    return _merge_sorted_runs(run_paths, by_frequency=False)
+
+
+def _subtract_sorted(minuend: Iterator[Tuple[str, int]],
+                     subtrahend: Iterator[Tuple[str, int]]) -> Iterator[Tuple[str, int]]:
+    """
+    >>> list(_subtract_sorted(iter([('a', 3), ('b', 2), ('d', 1)]), iter([('b', 2), ('c', 5), ('d', 3)])))
+    [('a', 3)]
+    >>> list(_subtract_sorted(iter([('a', 3), ('b', 2)]), iter([('a', 1)])))
+    [('a', 2), ('b', 2)]
+    """
+    subtracted = next(subtrahend, None)
+    for word, count in minuend:
+        while subtracted is not None and subtracted[0] < word:
+            subtracted = next(subtrahend, None)
+        if subtracted is not None and subtracted[0] == word:
+            count -= subtracted[1]
+        if count > 0:
+            yield word, count
+
+
+def _run_in_temp_dir(output_path: str, operation) -> Tuple[int, int]:
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    path_to_dump = tempfile.mkdtemp(prefix='vocab_runs', dir=output_dir)
+    try:
+        vocab_size, non_eng = operation(path_to_dump)
+    finally:
+        shutil.rmtree(path_to_dump)
+    logger.info(f'Vocab of {vocab_size} words is written to {output_path}')
+    return vocab_size, non_eng
+
+
+def merge(vocab_paths: List[str], output_path: str) -> Tuple[int, int]:
+    """
+    Sums up the counts of the words in the vocabs.
+
+    :return: the size of the resulting vocab and the number of non-english words in it
+    """
+    return _run_in_temp_dir(output_path, lambda path_to_dump: write_sorted_by_frequency(
+        _read_sorted_by_word(vocab_paths, path_to_dump), path_to_dump, output_path))
+
+
+def subtract(vocab_path: str, subtracted_vocab_paths: List[str], output_path: str) -> Tuple[int, int]:
+    """
+    Subtracts the counts of the words in `subtracted_vocab_paths`, e.g. the vocab of removed projects.
+    The words whose counts drop to zero or below are removed.
+
+    :return: the size of the resulting vocab and the number of non-english words in it
+    """
+    def operation(path_to_dump: str) -> Tuple[int, int]:
+        minuend = _read_sorted_by_word([vocab_path], path_to_dump)
+        subtrahend = _read_sorted_by_word(subtracted_vocab_paths, path_to_dump)
+        return write_sorted_by_frequency(_subtract_sorted(minuend, subtrahend), path_to_dump, output_path)
+
+    return _run_in_temp_dir(output_path, operation)
+
+
+def _prune_sorted(entries: Iterator[Tuple[str, int]], top_k: Optional[int],
+                  min_count: Optional[int]) -> Iterator[Tuple[str, int]]:
+    """
+    >>> list(_prune_sorted(iter([('a', 5), ('b', 3), ('c', 3), ('d', 1)]), top_k=3, min_count=2))
+    [('a', 5), ('b', 3), ('c', 3)]
+    >>> list(_prune_sorted(iter([('a', 5), ('b', 3), ('c', 3), ('d', 1)]), top_k=None, min_count=4))
+    [('a', 5)]
+    >>> list(_prune_sorted(iter([('a', 1), ('b', 3)]), top_k=None, min_count=None))
+    Traceback (most recent call last):
+    ...
+    codeprep.pipeline.vocabalgebra.VocabNotSortedError: Vocab must be sorted by frequency, but b (3) follows a (1)
+    """
+    previous = None
+    for i, (word, count) in enumerate(entries):
+        if previous and previous[1] < count:
+            raise VocabNotSortedError(f'Vocab must be sorted by frequency, '
+                                      f'but {word} ({count}) follows {previous[0]} ({previous[1]})')
+        if (top_k is not None and i >= top_k) or (min_count is not None and count < min_count):
+            return
+        yield word, count
+        previous = word, count
+
+
+def prune(vocab_path: str, output_path: str, top_k: Optional[int] = None, min_count: Optional[int] = None) -> None:
+    """
+    Leaves the `top_k` most frequent words and/or the words occurring at least `min_count` times.
+    The vocab is already sorted by frequency, so it is read only until the first word to be pruned.
+    """
+    _write_run(_prune_sorted(_read_run(vocab_path), top_k, min_count), output_path)
+    logger.info(f'Pruned vocab is written to {output_path}')
@@ -0,0 +1,117 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Estimation of the vocab growth (Heaps' law) that does not depend on how the vocab itself is calculated.
+
+Files are processed in a random order split into groups. For each group, the distinct words are counted
+with a HyperLogLog sketch, which takes a few KB regardless of the number of words. Merging the sketches
+of the groups one by one gives the number of distinct words after each group of files.
+"""
+import logging
+import math
+import random
+from hashlib import blake2b
+from typing import Iterable, List, Tuple, TypeVar
+
+import numpy as np
+
+from codeprep.preprocess.placeholders import placeholders
+
+logger = logging.getLogger(__name__)
+
+HYPERLOGLOG_PRECISION = 12
+SHUFFLE_SEED = 13
+
+T = TypeVar('T')
+
+
+class HyperLogLog(object):
+    """
+    >>> hll = HyperLogLog()
+    >>> hll.add(f'word{i}' for i in range(5000))
+    >>> hll.add(f'word{i}' for i in range(1000))
+    >>> abs(hll.estimate() - 5000) < 5000 * 3 * hll.relative_error
+    True
+    """
+    def __init__(self, precision: int = HYPERLOGLOG_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8)
+
+    def add(self, words: Iterable[str]) -> None:
+        hashes = [int.from_bytes(blake2b(word.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+                  for word in words]
+        if not hashes:
+            return
+        hashes = np.array(hashes, dtype=np.uint64)
+        n_bits = 64 - self.precision
+        indices = (hashes >> np.uint64(n_bits)).astype(np.int64)
+        rest = (hashes & np.uint64((1 << n_bits) - 1)).astype(np.float64)
+        # position of the leftmost 1-bit in the remaining bits
+        ranks = np.where(rest > 0, n_bits - np.floor(np.log2(np.maximum(rest, 1))), n_bits + 1).astype(np.uint8)
+        np.maximum.at(self.registers, indices, ranks)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw_estimate = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        n_empty = int(np.count_nonzero(self.registers == 0))
+        if raw_estimate <= 2.5 * m and n_empty:
+            return int(round(m * math.log(m / n_empty)))
+        return int(round(raw_estimate))
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class VocabGrowthSketch(object):
+    """
+    Distinct words and the number of non-english words in a group of files.
+    """
+    def __init__(self):
+        self.hll = HyperLogLog()
+        self.n_files = 0
+        self.non_eng = 0
+
+    def add_file(self, words: List[str]) -> None:
+        self.hll.add(set(words))
+        self.non_eng += words.count(placeholders['non_eng'])
+        self.n_files += 1
+
+
+def shuffle_files(files: List[T], seed: int = SHUFFLE_SEED) -> List[T]:
+    """
+    The vocab growth is measured in a random order of files, so that it does not depend on how the files
+    are sorted in the dataset.
+    """
+    files = list(files)
+    random.Random(seed).shuffle(files)
+    return files
+
+
+def estimate_vocab_growth(sketches: List[VocabGrowthSketch]) -> List[Tuple[int, int, int]]:
+    """
+    :param sketches: sketches of the groups of files in the order the files were shuffled in
+    :return: the number of files, the estimated vocab size and the number of non-english words
+    after each group of files
+
+    >>> first, second = VocabGrowthSketch(), VocabGrowthSketch()
+    >>> first.add_file(['a', 'b', 'c', 'a'])
+    >>> second.add_file(['c', 'd'])
+    >>> estimate_vocab_growth([first, second])
+    [(1, 3, 0), (2, 4, 0)]
+    """
+    growth = []
+    hll = HyperLogLog()
+    n_files, non_eng = 0, 0
+    for sketch in sketches:
+        hll.merge(sketch.hll)
+        n_files += sketch.n_files
+        non_eng += sketch.non_eng
+        growth.append((n_files, hll.estimate(), non_eng))
+    return growth
@@ -22,7 +22,12 @@ def all(merge_list_id: str) -> Dict[str, int]:
 
 def nonbpe(merge_list_id: str) -> Set[str]:
     bpe_dir = get_base_vocab_dir(merge_list_id)
-    return _load_vocab_set(os.path.join(bpe_dir, NONBPE_VOCAB_FILENAME))
+    path_to_nonbpe_vocab = os.path.join(bpe_dir, NONBPE_VOCAB_FILENAME)
+    if not os.path.exists(path_to_nonbpe_vocab):
+        # bpe codes learned with the wild engine are learned without the base vocab
+        logger.warning(f'Non-bpe vocab not found: {path_to_nonbpe_vocab}. Only placeholders will not be split.')
+        return set(placeholders.values())
+    return _load_vocab_set(path_to_nonbpe_vocab)
 
 
 def base(merge_list_id: str) -> Dict[str, int]:
@@ -40,9 +45,15 @@ def bpe(merge_list_id: str, n_merges: int) -> Dict[str, int]:
 
 
 def gather_non_bpe_vocab(dataset: Dataset):
+    """
+    If the non-bpe vocab already exists, the gathered tokens are added to it. Tokens of the files removed
+    from the dataset are not removed from it, which only prevents these tokens from being split.
+    """
     logger.info("Gathering non-bpe vocab...")
     part_nonbpe_vocab_dir = f'{dataset.path_to_nonbpe_vocab_file}_part'
     non_bpe_tokens: Set[str] = set()
+    if os.path.exists(dataset.path_to_nonbpe_vocab_file):
+        non_bpe_tokens.update(_load_vocab_set(dataset.path_to_nonbpe_vocab_file))
     for idx, file in enumerate(os.listdir(part_nonbpe_vocab_dir)):
         if idx % 569 == 0:
             print(f'Files processed: {idx}', end='\r')
@@ -32,49 +32,118 @@ def merge_dicts_(dict1, dict2) -> Tuple[Dict, List]:
 
 
 class AtomicInteger(object):
+    """
+    Integer in shared memory. Can be used by the processes it is passed to when they are created.
+
+    >>> counter = AtomicInteger(2)
+    >>> counter.inc()
+    3
+    >>> counter.compare_and_dec(3), counter.value
+    (True, 2)
+    >>> counter.get_and_dec(), counter.value
+    (2, 1)
+    """
     def __init__(self, v=0):
-        self._lock = multiprocessing.Lock()
-        self._queue = multiprocessing.Queue()
-        for i in range(v):
-            self._queue.put(1)
+        self._value = multiprocessing.Value('q', v)
 
-    def inc(self):
-        with self._lock:
-            self._queue.put(1)
-            return self._queue.qsize()
+    def inc(self, delta=1):
+        with self._value.get_lock():
+            self._value.value += delta
+            return self._value.value
 
     def dec(self):
-        with self._lock:
-            self._queue.get()
-            return self._queue.qsize()
+        with self._value.get_lock():
+            self._value.value -= 1
+            return self._value.value
 
     def compare_and_dec(self, val):
-        with self._lock:
-            result = self._queue.qsize() == val
-            self._queue.get()
+        """
+        Decrements the value and tells whether it was equal to `val` before the decrement.
+        """
+        with self._value.get_lock():
+            result = self._value.value == val
+            self._value.value -= 1
             return result
 
     def get_and_dec(self):
-        with self._lock:
-            result = self._queue.qsize()
-            self._queue.get()
+        with self._value.get_lock():
+            result = self._value.value
+            self._value.value -= 1
             return result
 
     @property
     def value(self):
-        with self._lock:
-            return self._queue.qsize()
+        return self._value.value
 
     @value.setter
     def value(self, v):
-        with self._lock:
-            self._queue = multiprocessing.Queue()
-            for i in range(v):
-                self._queue.put(1)
+        with self._value.get_lock():
+            self._value.value = v
+
+
+class ProgressChannel(object):
+    """
+    Metrics reported by the worker processes of a pool.
+    To be available in the workers, the channel has to be passed to `init_progress_channel` when the pool is created:
+
+    >>> progress = ProgressChannel()
+    >>> progress.report(files=3, bytes=60)
+    >>> progress.snapshot()
+    {'files': 3, 'bytes': 60, 'tokens': 0, 'merges': 0, 'cache_hits': 0}
+    >>> str(progress)
+    'files: 3, bytes: 60'
+    """
+    METRICS = ('files', 'bytes', 'tokens', 'merges', 'cache_hits')
+
+    def __init__(self):
+        self._counters = {metric: AtomicInteger() for metric in ProgressChannel.METRICS}
+
+    def report(self, **increments: int) -> None:
+        for metric, increment in increments.items():
+            if metric not in self._counters:
+                raise ValueError(f'Unknown metric: {metric}, available metrics: {ProgressChannel.METRICS}')
+            self._counters[metric].inc(increment)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {metric: counter.value for metric, counter in self._counters.items()}
+
+    def __str__(self):
+        return ', '.join(f'{metric}: {value}' for metric, value in self.snapshot().items() if value)
+
+
+_progress_channel: Optional[ProgressChannel] = None
+
+
+def init_progress_channel(progress_channel: ProgressChannel) -> None:
+    global _progress_channel
+    _progress_channel = progress_channel
+
+
+def report_progress(**increments: int) -> None:
+    """
+    Reports to the channel the current worker was initialized with. Does nothing outside of such workers.
+    """
+    if _progress_channel:
+        _progress_channel.report(**increments)
+
+
+class _RemovedTask(object):
+    """
+    Placeholder for a removed task. Sorts before any task it is compared with when the priorities are equal,
+    so that tasks of any type (not only strings) can be put to the queue.
+    """
+    def __lt__(self, other):
+        return other is not self
+
+    def __gt__(self, other):
+        return False
+
+    def __repr__(self):
+        return '<removed-task>'
 
 
 class PriorityCounter(object):
-    REMOVED = '<removed-task>'  # placeholder for a removed task
+    REMOVED = _RemovedTask()  # placeholder for a removed task
 
     def __init__(self, d: Dict, automatic_count: bool=True):
         self.counter = itertools.count() if automatic_count else None
@@ -111,6 +180,18 @@ class PriorityCounter(object):
                 return pair, -priority
         raise KeyError('pop from an empty priority queue')
 
+    def peek_pair(self):
+        'Return the lowest priority task without removing it. Raise KeyError if empty.'
+        while self.pq:
+            (priority, count), pair = self.pq[0]
+            if pair is not PriorityCounter.REMOVED:
+                return pair, -priority
+            heappop(self.pq)
+        raise KeyError('peek from an empty priority queue')
+
+    def __len__(self):
+        return len(self.entry_finder)
+
 
 import sys
 from numbers import Number
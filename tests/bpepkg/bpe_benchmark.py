@@ -0,0 +1,214 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+"""Reproducible benchmark of the bpe learners.
+
+usage:
+    bpe_benchmark.py run [-o <output>] [--quick] [--n-merges <n>] [--seed <seed>] [--plot]
+    bpe_benchmark.py compare <results> <baseline> [--tolerance <tolerance>]
+
+Options:
+    -o, --output <output>        Json file to write the results to [default: bpe_benchmark.json].
+    --quick                      Run on the small grid only.
+    --n-merges <n>               The number of merges to do in each case [default: 1000].
+    --seed <seed>                Seed of the generated data [default: 17].
+    --plot                       Plot the performance stats of wild bpe (requires matplotlib).
+    --tolerance <tolerance>      A metric is flagged as a regression if it is worse than in the baseline
+                                 by more than this fraction [default: 0.2].
+"""
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+from docopt import docopt
+
+from codeprep.bpepkg import wild_bpe
+from codeprep.bpepkg.bpe_encode import escape
+from codeprep.bpepkg.bpe_learn import do_merges, get_stats
+from codeprep.bpepkg.performance_stats import BpePerformanceStatsCollector, BpePerformanceStatsEntry
+from tests.bpepkg.wild_bpe_performance import gen_performance_test_case, plotting_function
+
+logger = logging.getLogger(__name__)
+
+WILD_ENGINE = 'wild'
+CLASSIC_ENGINE = 'classic'
+
+GRID = [{'mb': mb, 'entropy': entropy} for mb in [0.05, 0.5, 5] for entropy in [1, 2, 3]]
+QUICK_GRID = [{'mb': 0.01, 'entropy': entropy} for entropy in [1, 2, 3]]
+
+# the classic learner computes the vocab size for every stats entry, so per-merge times are sampled
+CLASSIC_STATS_EVERY_N_MERGES = 10
+MAX_WORD_LENGTH = 10
+PERCENTILES = [50, 90, 99]
+
+# metrics compared against the baseline; the higher, the worse
+COMPARED_METRICS = ['index_build_time', 'merge_time_p50', 'merge_time_p90', 'merge_time_p99', 'peak_memory_mb']
+
+
+def split_into_words(text: str, seed: int) -> Dict[str, int]:
+    """
+    The classic learner works on a vocabulary: the generated text is cut into words of random length.
+
+    >>> split_into_words('aabaab', seed=1)
+    {'a a b @': 2}
+    """
+    rnd = random.Random(seed)
+    words = Counter()
+    i = 0
+    while i < len(text):
+        length = rnd.randint(1, MAX_WORD_LENGTH)
+        words[escape(' '.join(text[i:i + length]))] += 1
+        i += length
+    return dict(words)
+
+
+def _percentiles(merge_times: List[float]) -> Dict[str, Optional[float]]:
+    return {f'merge_time_p{p}': float(np.percentile(merge_times, p)) if merge_times else None for p in PERCENTILES}
+
+
+def _measure_peak_memory_mb(func) -> float:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e+6
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_wild(text: str, n_merges: int) -> Dict[str, Any]:
+    start = time.time()
+    merges = wild_bpe.run([text], n_merges, include_performance_stats_every_n_merges=1, memory_budget_mb=None)
+    stats: List[BpePerformanceStatsEntry] = []
+    time_to_first_merge = None
+    n_merges_done = 0
+    for _, _, stats in merges:
+        if time_to_first_merge is None:
+            time_to_first_merge = time.time() - start
+        n_merges_done += 1
+    # the first entry is recorded right after the indices are built, the next ones after each merge
+    merge_times = [entry.time_for_last_merge for entry in stats[1:]]
+    last_entry = stats[-1] if stats else None
+    return {
+        'n_merges_done': n_merges_done,
+        'index_build_time': time_to_first_merge - merge_times[0] if merge_times else None,
+        **_percentiles(merge_times),
+        'peak_memory_mb': _measure_peak_memory_mb(lambda: list(wild_bpe.run([text], n_merges, memory_budget_mb=None))),
+        'final_index_sizes': {
+            'n_index_entries': last_entry.n_index_entries,
+            'n_positions': last_entry.n_positions,
+            'n_neighbour_links': last_entry.n_neighbour_links,
+            'n_priority_queue_entries': last_entry.n_priority_queue_entries,
+            'location_index_size_mb': last_entry.location_index_obj_size,
+            'neighbour_index_size_mb': last_entry.neighbour_index_obj_size,
+            'priority_counter_size_mb': last_entry.priority_counter_obj_size,
+        } if last_entry else {},
+        '_stats': stats
+    }
+
+
+def benchmark_classic(text: str, n_merges: int, seed: int) -> Dict[str, Any]:
+    vocab = split_into_words(text, seed)
+    start = time.time()
+    get_stats(vocab)
+    index_build_time = time.time() - start
+
+    stats_collector = BpePerformanceStatsCollector(CLASSIC_STATS_EVERY_N_MERGES)
+    _, merges = do_merges(vocab, n_merges, stats_collector=stats_collector)
+    merge_times = [entry.time_for_last_merge for entry in stats_collector.entries[1:]]
+    last_entry = stats_collector.entries[-1]
+    return {
+        'n_merges_done': len(merges),
+        'index_build_time': index_build_time,
+        **_percentiles(merge_times),
+        'peak_memory_mb': _measure_peak_memory_mb(lambda: do_merges(vocab, n_merges)),
+        'final_index_sizes': {
+            'n_priority_queue_entries': last_entry.n_priority_queue_entries,
+            'n_live_priority_queue_entries': last_entry.n_live_priority_queue_entries,
+            'vocab_size': last_entry.vocab_size,
+        }
+    }
+
+
+def run_benchmark(grid: List[Dict[str, float]], n_merges: int, seed: int, plot: bool = False) -> Dict[str, Any]:
+    results = []
+    for case in grid:
+        text = ''.join(gen_performance_test_case(case['mb'], case['entropy'], seed=seed))
+        for engine in [WILD_ENGINE, CLASSIC_ENGINE]:
+            logger.info(f'Running {engine} bpe on {case["mb"]} MB, entropy: {case["entropy"]} bit')
+            if engine == WILD_ENGINE:
+                result = benchmark_wild(text, n_merges)
+                stats = result.pop('_stats')
+                if plot:
+                    plotting_function(case['mb'], case['entropy'], wild_bpe.__version__, stats, final_show=False)
+            else:
+                result = benchmark_classic(text, n_merges, seed)
+            results.append({'engine': engine, **case, **result})
+    return {
+        'metadata': {
+            'seed': seed,
+            'n_merges': n_merges,
+            'wild_bpe_version': wild_bpe.__version__,
+            'python': platform.python_version(),
+        },
+        'results': results
+    }
+
+
+def _case_key(result: Dict[str, Any]):
+    return result['engine'], result['mb'], result['entropy']
+
+
+def find_regressions(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    >>> baseline = {'results': [{'engine': 'wild', 'mb': 1, 'entropy': 2, 'index_build_time': 1.0, 'peak_memory_mb': 10}]}
+    >>> results = {'results': [{'engine': 'wild', 'mb': 1, 'entropy': 2, 'index_build_time': 1.5, 'peak_memory_mb': 11}]}
+    >>> find_regressions(results, baseline, tolerance=0.2)
+    ['wild, 1 MB, entropy 2: index_build_time 1.0 -> 1.5 (+50%)']
+    """
+    baseline_by_case = {_case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        baseline_result = baseline_by_case.get(_case_key(result))
+        if not baseline_result:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = baseline_result.get(metric), result.get(metric)
+            if old and new is not None and new > old * (1 + tolerance):
+                regressions.append(f'{result["engine"]}, {result["mb"]} MB, entropy {result["entropy"]}: '
+                                   f'{metric} {old} -> {new} ({(new - old) / old:+.0%})')
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    args = docopt(__doc__, argv=argv)
+    if args['run']:
+        results = run_benchmark(QUICK_GRID if args['--quick'] else GRID, int(args['--n-merges']),
+                                int(args['--seed']), plot=args['--plot'])
+        with open(args['--output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results are saved to {args["--output"]}')
+    else:
+        with open(args['<results>']) as f:
+            results = json.load(f)
+        with open(args['<baseline>']) as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, float(args['--tolerance']))
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            return 1
+        print('No regressions found.')
+    return 0
+
+
+if __name__ == '__main__':
+    logging.getLogger('codeprep').setLevel(logging.INFO)
+    sys.exit(main(sys.argv[1:]))
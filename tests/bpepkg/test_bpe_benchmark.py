@@ -0,0 +1,18 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from tests.bpepkg.bpe_benchmark import run_benchmark, find_regressions, COMPARED_METRICS
+
+
+def test_benchmark_is_reproducible_and_has_no_regressions_against_itself():
+    grid = [{'mb': 0.001, 'entropy': 2}]
+
+    results = run_benchmark(grid, n_merges=10, seed=3)
+
+    assert [(r['engine'], r['n_merges_done']) for r in results['results']] == [('wild', 10), ('classic', 10)]
+    for result in results['results']:
+        assert all(result[metric] is not None for metric in COMPARED_METRICS)
+    assert results['results'][0]['final_index_sizes'] == \
+           run_benchmark(grid, n_merges=10, seed=3)['results'][0]['final_index_sizes']
+    assert find_regressions(results, results, tolerance=0.0) == []
@@ -0,0 +1,75 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import random
+from unittest import mock
+
+import pytest
+
+from codeprep.bpepkg import bpe_learn, bpe_learn_bounded
+from codeprep.bpepkg.bpe_encode import escape
+from codeprep.bpepkg.checkpoint import BpeCheckpointer, find_latest_checkpoint, remove_checkpoints
+from codeprep.bpepkg.merge import MergeList
+
+
+def generate_vocab(seed: int):
+    rnd = random.Random(seed)
+    vocab = {}
+    for _ in range(rnd.randint(5, 80)):
+        word = ''.join(rnd.choice('aab@cd') for _ in range(rnd.randint(1, 9)))
+        vocab[escape(' '.join(word))] = rnd.randint(1, 6)
+    return vocab
+
+
+@pytest.mark.parametrize('max_pairs_in_memory', [1, 3, 20, 1000])
+@pytest.mark.parametrize('seed', range(5))
+def test_same_merges_as_unbounded(seed, max_pairs_in_memory, tmp_path):
+    vocab = generate_vocab(seed)
+    expected_vocab, expected_merges = bpe_learn.do_merges(vocab, 60)
+
+    actual_vocab, actual_merges = bpe_learn_bounded.do_merges(vocab, 60, max_pairs_in_memory=max_pairs_in_memory,
+                                                              spill_dir=str(tmp_path / 'spill'))
+
+    assert expected_merges == actual_merges
+    assert expected_vocab == actual_vocab
+    assert not (tmp_path / 'spill').exists()
+
+
+def test_pruned_words_are_kept_and_split():
+    vocab = {"t h e @": 50, "t h e r e @": 11, "w h e r e @": 7, "h e r e @": 4, "t h e s e @": 1, "x y @": 1}
+    _, expected_merges = bpe_learn.do_merges(vocab, 3)
+
+    actual_vocab, actual_merges = bpe_learn_bounded.do_merges(vocab, 3, min_word_freq=2)
+
+    # frequencies do not include the pruned words
+    assert [m.pair for m in expected_merges] == [m.pair for m in actual_merges]
+    assert sum(actual_vocab.values()) == sum(vocab.values())
+    assert actual_vocab["the s e @"] == 1
+    assert actual_vocab["x y @"] == 1
+
+
+def test_resume_from_compact_checkpoint(tmp_path):
+    vocab = {"t h e @": 50, "t h e r e @": 11, "w h e r e @": 7, "h e r e @": 4, "t h e s e @": 1, "x y @": 1}
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    expected_vocab, expected_merges = bpe_learn_bounded.do_merges(vocab, 6, min_word_freq=2)
+
+    checkpointer = BpeCheckpointer(checkpoint_dir, MergeList(), every_n_merges=1, every_seconds=0)
+    with mock.patch.object(bpe_learn_bounded, '_assemble_vocab', wraps=bpe_learn_bounded._assemble_vocab) as assemble:
+        bpe_learn_bounded.do_merges(vocab, 3, min_word_freq=2, checkpointer=checkpointer)
+    checkpointer.close()
+    checkpoint = find_latest_checkpoint(checkpoint_dir, max_merges=6)
+
+    # the full vocab is only assembled for the result
+    assert assemble.call_count == 1
+    assert isinstance(checkpoint.split_base_vocab, bpe_learn_bounded.PrunedSplitVocab)
+    actual_vocab, merges = bpe_learn_bounded.do_merges(checkpoint.split_base_vocab, 6 - len(checkpoint),
+                                                       already_done_merges=checkpoint.merges)
+    assert expected_merges == checkpoint.merges + merges
+    assert expected_vocab == actual_vocab
+
+    os.remove(checkpoint.split_base_vocab.path_to_pruned_words)
+    assert find_latest_checkpoint(checkpoint_dir, max_merges=6) is None
+    remove_checkpoints(checkpoint_dir, up_to_merges=6)
+    assert not os.path.exists(checkpoint_dir)
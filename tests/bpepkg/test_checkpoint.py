@@ -0,0 +1,98 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from codeprep.bpepkg import checkpoint as checkpoint_module
+from codeprep.bpepkg.bpe_learn import do_merges
+from codeprep.bpepkg.checkpoint import BpeCheckpoint, BpeCheckpointer, dump_checkpoint, read_checkpoint, \
+    find_latest_checkpoint, list_checkpoints, remove_checkpoints, InvalidCheckpointError, MAX_CHECKPOINTS_TO_KEEP
+from codeprep.bpepkg.merge import MergeList, Merge
+
+
+# no ties between pair frequencies, so the order of merges does not depend on the order of the priority queue
+VOCAB = {
+    "t h e @": 50,
+    "t h e r e @": 11,
+    "w h e r e @": 7,
+    "h e r e @": 4,
+}
+
+
+def create_merges(*pairs) -> MergeList:
+    merges = MergeList()
+    for pair in pairs:
+        merges.append(Merge(pair, freq=1))
+    return merges
+
+
+def test_truncated_checkpoint_is_invalid(tmp_path):
+    path = dump_checkpoint(BpeCheckpoint(create_merges(('a', 'b')), {'ab @': 1}), str(tmp_path))
+    with open(path, 'rb') as f:
+        content = f.read()
+    with open(path, 'wb') as f:
+        f.write(content[:len(content) // 2])
+
+    with pytest.raises(InvalidCheckpointError):
+        read_checkpoint(path)
+
+
+def test_find_latest_checkpoint_skips_invalid_and_too_big(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    dump_checkpoint(BpeCheckpoint(create_merges(('a', 'b')), {'ab @': 1}), checkpoint_dir)
+    dump_checkpoint(BpeCheckpoint(create_merges(('a', 'b'), ('ab', '@')), {'ab@': 1}), checkpoint_dir)
+    dump_checkpoint(BpeCheckpoint(create_merges(('a', 'b'), ('ab', '@'), ('x', 'y')), {'ab@': 1}), checkpoint_dir)
+    with open(os.path.join(checkpoint_dir, '2.ckpt'), 'wb') as f:
+        f.write(b'garbage')
+
+    actual = find_latest_checkpoint(checkpoint_dir, max_merges=2)
+
+    assert actual.merges == create_merges(('a', 'b'))
+    assert actual.split_base_vocab == {'ab @': 1}
+
+
+def test_remove_checkpoints(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    dump_checkpoint(BpeCheckpoint(create_merges(('a', 'b')), {}), checkpoint_dir)
+    dump_checkpoint(BpeCheckpoint(create_merges(('a', 'b'), ('ab', '@')), {}), checkpoint_dir)
+
+    remove_checkpoints(checkpoint_dir, up_to_merges=1)
+
+    assert [n for n, _ in list_checkpoints(checkpoint_dir)] == [2]
+
+
+def test_resume_from_checkpoint_gives_same_result(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    expected_vocab, expected_merges = do_merges(VOCAB, 8)
+
+    checkpointer = BpeCheckpointer(checkpoint_dir, MergeList(), every_n_merges=1, every_seconds=0)
+    do_merges(VOCAB, 3, checkpointer)
+    checkpointer.close()
+    checkpoint = find_latest_checkpoint(checkpoint_dir, max_merges=8)
+
+    assert len(list_checkpoints(checkpoint_dir)) <= MAX_CHECKPOINTS_TO_KEEP
+    assert 1 <= len(checkpoint) <= 3
+    actual_vocab, merges = do_merges(checkpoint.split_base_vocab, 8 - len(checkpoint))
+    assert expected_vocab == actual_vocab
+    assert expected_merges == checkpoint.merges + merges
+
+
+@pytest.mark.parametrize('use_fork', [True, False])
+def test_checkpoint_has_state_at_the_time_of_saving(tmp_path, monkeypatch, use_fork):
+    if not use_fork:
+        monkeypatch.setattr(checkpoint_module, '_get_fork_context', lambda: None)
+    checkpoint_dir = str(tmp_path)
+    checkpointer = BpeCheckpointer(checkpoint_dir, create_merges(('a', 'b')), every_n_merges=1, every_seconds=0)
+    split_base_vocab = {'ab c @': 3}
+
+    checkpointer.save(split_base_vocab, create_merges(('ab', 'c')))
+    split_base_vocab['abc @'] = split_base_vocab.pop('ab c @')
+    checkpointer.close()
+
+    checkpoint = find_latest_checkpoint(checkpoint_dir, max_merges=2)
+    assert checkpoint.merges == create_merges(('a', 'b'), ('ab', 'c'))
+    assert checkpoint.split_base_vocab == {'ab c @': 3}
+    assert checkpointer.pause_seconds > 0
@@ -0,0 +1,162 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import random
+
+import pytest
+
+from codeprep.bpepkg.wild_bpe import merge_lists, self_merge, merge_lists_both, choose_positions_to_merge, \
+    build_indices, run_from_file, run, IndexSizeCounter, update_location_index, update_neighbour_index
+from codeprep.util import PriorityCounter
+
+
+# straightforward implementations the vectorized ones are checked against
+
+
+def merge_lists_reference(main_list, list2, position_shift):
+    list2_result, result = [], []
+    i = 0; j = 0
+    while i < len(main_list) and j < len(list2):
+        if main_list[i] + position_shift == list2[j]:
+            result.append(min(main_list[i], list2[j]))
+            i += 1; j += 1
+        elif main_list[i] + position_shift > list2[j]:
+            list2_result.append(list2[j])
+            j += 1
+        else:
+            i += 1
+    list2_result.extend(list2[j:])
+    return list2_result, result
+
+
+def self_merge_reference(main_list, position_shift):
+    result = []
+    i = 0
+    while i < len(main_list) - 1:
+        if main_list[i] + position_shift == main_list[i + 1]:
+            result.append(main_list[i])
+            i += 2
+        else:
+            i += 1
+    return result
+
+
+def choose_positions_to_merge_reference(main_list, position_shift):
+    result_main, result_disappearing = [], []
+    i = 0
+    while i < len(main_list) - 1:
+        result_main.append(main_list[i])
+        if main_list[i] + position_shift == main_list[i + 1]:
+            result_disappearing.append(main_list[i + 1])
+            i += 1
+        i += 1
+    if i == len(main_list) - 1:
+        result_main.append(main_list[i])
+    return result_main, result_disappearing
+
+
+def merge_lists_both_reference(main_list, list2, position_shift):
+    list2_result, result = [], []
+    i = 0; j = 0
+    while i < len(main_list) - 1 and j < len(list2):
+        if main_list[i] + position_shift[0] == list2[j]:
+            if main_list[i + 1] + position_shift[1] == list2[j]:
+                result.append(main_list[i])
+            else:
+                list2_result.append(list2[j])
+            i += 1; j += 1
+        elif main_list[i] + position_shift[0] > list2[j]:
+            list2_result.append(list2[j])
+            j += 1
+        else:
+            i += 1
+    list2_result.extend(list2[j:])
+    return list2_result, result
+
+
+def random_positions(rnd: random.Random):
+    return sorted(rnd.sample(range(60), rnd.randint(0, 30)))
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_kernels_same_as_reference(seed):
+    rnd = random.Random(seed)
+    main_list, list2 = random_positions(rnd), random_positions(rnd)
+    shift = rnd.randint(1, 3)
+
+    assert [a.tolist() for a in merge_lists(main_list, list2, shift)] == \
+           list(merge_lists_reference(main_list, list2, shift))
+    assert [a.tolist() for a in merge_lists(main_list, list2, -shift)] == \
+           list(merge_lists_reference(main_list, list2, -shift))
+    assert [a.tolist() for a in choose_positions_to_merge(main_list, shift)] == \
+           list(choose_positions_to_merge_reference(main_list, shift))
+    assert self_merge(main_list, shift)[1].tolist() == self_merge_reference(main_list, shift)
+    if main_list != list2:
+        both_shift = (shift, -rnd.randint(1, 3))
+        assert [a.tolist() for a in merge_lists_both(main_list, list2, both_shift)] == \
+               list(merge_lists_both_reference(main_list, list2, both_shift))
+
+
+def test_build_indices_from_blocks_same_as_from_chars():
+    text = 'abcabcaab|ca'
+    location_index_blocks, neighbour_index_blocks, symbols_blocks = build_indices([text[:5], text[5:]])
+    location_index_chars, neighbour_index_chars, symbols_chars = build_indices(iter(text))
+
+    assert symbols_blocks.symbols == symbols_chars.symbols
+
+    assert {k: v.tolist() for k, v in location_index_blocks.items()} == \
+           {k: v.tolist() for k, v in location_index_chars.items()}
+    assert dict(neighbour_index_blocks) == dict(neighbour_index_chars)
+
+
+def test_run_on_file(tmp_path):
+    path = tmp_path / 'file.py'
+    path.write_text('aaaa aaaa')
+
+    merges = [(m, occ) for m, occ, _ in run_from_file(str(path))]
+
+    assert merges[0] == ('a a', 4)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_index_size_counter_same_as_recount(seed):
+    rnd = random.Random(seed)
+    text = ''.join(rnd.choice('abxc') for _ in range(rnd.randint(2, 300)))
+    location_index, neighbour_index, symbols = build_indices([text])
+    sizes = IndexSizeCounter.count(location_index, neighbour_index)
+    priority_counter = PriorityCounter({k: (len(v), int(v[0])) for k, v in location_index.items()},
+                                       automatic_count=False)
+
+    for _ in range(30):
+        try:
+            pair, _ = priority_counter.pop_pair()
+        except KeyError:
+            break
+        occurence_changes = update_location_index(location_index, neighbour_index, pair, symbols, sizes)
+        for (appeared_pair, first_appeared, disappearing_pair, first_disappearing, n) in occurence_changes:
+            priority_counter.add(appeared_pair, n, first_appeared)
+            if disappearing_pair != pair:
+                priority_counter.add(disappearing_pair, -n, first_disappearing)
+        update_neighbour_index(location_index, neighbour_index, pair, symbols, sizes)
+
+        recounted = IndexSizeCounter.count(location_index, neighbour_index)
+        assert (sizes.n_positions, sizes.n_neighbour_links) == (recounted.n_positions, recounted.n_neighbour_links)
+
+
+def test_run_stops_when_memory_budget_exceeded():
+    text = ''.join(random.Random(1).choice('abxc') for _ in range(1000))
+
+    merges = list(run([text], 50, memory_budget_mb=0.0))
+
+    assert len(merges) == 1
+
+
+def test_run_with_traced_memory():
+    text = ''.join(random.Random(1).choice('abxc') for _ in range(1000))
+
+    *_, (_, _, stats) = run([text], 10, include_performance_stats_every_n_merges=5, trace_memory=True)
+
+    assert stats[-1].merges_done == 5
+    assert all(entry.traced_memory_size > 0 for entry in stats)
+    assert all(entry.n_positions > 0 for entry in stats)
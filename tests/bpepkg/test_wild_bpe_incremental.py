@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import random
+
+import pytest
+
+from codeprep.bpepkg.wild_bpe import run_from_text, IndexSizeCounter
+from codeprep.bpepkg.wild_bpe_incremental import IncrementalWildBpe
+
+
+def gen_text(seed: int, length: int) -> str:
+    rnd = random.Random(seed)
+    return ''.join(rnd.choice('abxc') for _ in range(length))
+
+
+def encode_reference(text: str, merges):
+    symbols = list(text)
+    for merge in merges:
+        left, right = merge.split(' ')
+        result, i = [], 0
+        while i < len(symbols):
+            if i + 1 < len(symbols) and symbols[i] == left and symbols[i + 1] == right:
+                result.append(left + right)
+                i += 2
+            else:
+                result.append(symbols[i])
+                i += 1
+        symbols = result
+    return symbols
+
+
+def pair_positions(symbols, offset):
+    positions = {}
+    position = offset
+    for left, right in zip(symbols, symbols[1:]):
+        positions.setdefault(f'{left} {right}', []).append(position)
+        position += len(left)
+    return positions
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_learning_from_scratch_same_as_wild_bpe(seed):
+    text = gen_text(seed, 300)
+    bpe = IncrementalWildBpe()
+
+    bpe.append([text])
+
+    assert list(bpe.learn(30)) == [(m, occ) for m, occ, _ in run_from_text(text, 30)]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_appended_text_is_rewritten_under_learned_merges(seed):
+    text, new_text = gen_text(seed, 300), gen_text(seed + 100, 200)
+    bpe = IncrementalWildBpe()
+    bpe.append([text])
+    list(bpe.learn(20))
+    old_positions = {bpe.state.symbols.to_str(pair): positions.tolist()
+                     for pair, positions in bpe.state.location_index.items()}
+
+    bpe.append([new_text])
+
+    expected_new_positions = pair_positions(encode_reference(new_text, bpe.merges), offset=len(text))
+    for pair, positions in bpe.state.location_index.items():
+        pair_str = bpe.state.symbols.to_str(pair)
+        assert positions.tolist() == old_positions.get(pair_str, []) + expected_new_positions.get(pair_str, [])
+        assert bpe.state.priority_counter.entry_finder[pair][0][0] == -len(positions)
+    recounted = IndexSizeCounter.count(bpe.state.location_index, bpe.state.neighbour_index)
+    assert (bpe.state.sizes.n_positions, bpe.state.sizes.n_neighbour_links) == \
+           (recounted.n_positions, recounted.n_neighbour_links)
+
+
+def test_learning_continues_the_same_after_save_and_load(tmp_path):
+    path = str(tmp_path / 'state.pickle')
+    bpe = IncrementalWildBpe()
+    bpe.append([gen_text(1, 500)])
+    list(bpe.learn(10))
+    bpe.save(path)
+
+    expected = list(bpe.learn(20))
+    actual = list(IncrementalWildBpe.load(path).learn(20))
+
+    assert actual == expected
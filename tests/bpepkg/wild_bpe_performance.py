@@ -4,16 +4,17 @@
 
 import random
 
-from typing import List
+from typing import List, Optional
 
 from codeprep.bpepkg import wild_bpe
 from codeprep.bpepkg.wild_bpe import BpePerformanceStatsEntry, run
 
 
-def gen_performance_test_case(data_size_mb: float, entropy: int):
+def gen_performance_test_case(data_size_mb: float, entropy: int, seed: Optional[int] = None):
+    rnd = random.Random(seed)
     char_list = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
     for i in range(int(data_size_mb * (2 ** 20))):
-        w = random.choice(char_list[:2 ** entropy])
+        w = rnd.choice(char_list[:2 ** entropy])
         for i in range(len(w)):
             yield w[i]
 
@@ -551,7 +551,7 @@ def test_yes_false_java_yes(abspath_mock, bpe_learner_mock, dataset_mock):
         BpeParam.UNICODE: 'yes',
     })
     dataset_mock.create.assert_called_with(PATH_TO_DATASET_STUB, prep_config, 'java', None, bpe_config)
-    bpe_learner_mock.run.assert_called_with(dataset_mock, 1000, bpe_config)
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config)
 
 
 @mock.patch('codeprep.cli.impl.Dataset', autospec=True)
@@ -583,7 +583,7 @@ def test_no_true_code_no(abspath_mock, bpe_learner_mock, dataset_mock):
         BpeParam.UNICODE: 'no',
     })
     dataset_mock.create.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None, None, bpe_config)
-    bpe_learner_mock.run.assert_called_with(dataset_mock, 1000, bpe_config)
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config)
 
 
 @mock.patch('codeprep.cli.impl.Dataset', autospec=True)
@@ -615,4 +615,149 @@ def test_true_true_code_bytes(abspath_mock, bpe_learner_mock, dataset_mock):
         BpeParam.UNICODE: 'bytes',
     })
     dataset_mock.create.assert_called_with(PATH_TO_DATASET_STUB, prep_config, None, None, bpe_config)
-    bpe_learner_mock.run.assert_called_with(dataset_mock, 1000, bpe_config)
\ No newline at end of file
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config)
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_multiple_n_merges(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '5000', '10000', '-p', PATH_TO_DATASET_STUB]
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000, 5000, 10000], bpe_config)
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_memory_bounded(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB, '--min-word-freq', '3',
+            '--max-pairs-in-memory', '1000000', '--sample', '0.01']
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config,
+                                            min_word_freq=3, max_pairs_in_memory=1000000, sample_rate=0.01)
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_with_performance_stats(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB, '--stats-every', '100', '--stats-format', 'csv']
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run.assert_called_with(dataset_mock, [1000], bpe_config,
+                                            stats_every_n_merges=100, stats_format='csv')
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_with_unknown_stats_format(abspath_mock, bpe_learner_mock, dataset_mock):
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB, '--stats-every', '100', '--stats-format', 'xml']
+
+    with pytest.raises(DocoptExit):
+        parse_and_run(argv)
+    bpe_learner_mock.run.assert_not_called()
+
+
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+@mock.patch('codeprep.pipeline.dataset.os.path.abspath', autospec=True)
+def test_learn_bpe_wild_engine(abspath_mock, bpe_learner_mock, dataset_mock):
+
+    # given
+    abspath_mock.return_value = PATH_TO_DATASET_STUB
+    dataset_mock.create = Mock(spec=dataset_mock, return_value=dataset_mock)
+    argv = ['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB, '--engine', 'wild']
+
+    # when
+    parse_and_run(argv)
+
+    # then
+    bpe_config = BpeConfig({
+        BpeParam.CASE: 'yes',
+        BpeParam.WORD_END: False,
+        BpeParam.BASE: 'code',
+        BpeParam.UNICODE: 'yes',
+    })
+    bpe_learner_mock.run_wild.assert_called_with(dataset_mock, [1000], bpe_config)
+    bpe_learner_mock.run.assert_not_called()
+
+
+@pytest.mark.parametrize('options', [
+    ['--engine', 'fast'],
+    ['--engine', 'wild', '--sample', '0.01'],
+    ['--engine', 'wild', '--min-word-freq', '3'],
+    ['--engine', 'wild', '--max-pairs-in-memory', '1000'],
+    ['--engine', 'wild', '--stats-every', '100'],
+])
+@mock.patch('codeprep.cli.impl.Dataset', autospec=True)
+@mock.patch('codeprep.cli.impl.bpelearner', autospec=True)
+def test_learn_bpe_invalid_engine_options(bpe_learner_mock, dataset_mock, options):
+    with pytest.raises(DocoptExit):
+        parse_and_run(['learn-bpe', '1000', '-p', PATH_TO_DATASET_STUB] + options)
+    bpe_learner_mock.run.assert_not_called()
+    bpe_learner_mock.run_wild.assert_not_called()
+
+
+@mock.patch('codeprep.api.vocab.vocabalgebra', autospec=True)
+def test_vocab_merge(vocabalgebra_mock):
+    parse_and_run(['vocab', 'merge', 'vocab1', 'vocab2', '-o', 'merged'])
+
+    vocabalgebra_mock.merge.assert_called_with(['vocab1', 'vocab2'], 'merged')
+
+
+@mock.patch('codeprep.api.vocab.vocabalgebra', autospec=True)
+def test_vocab_subtract(vocabalgebra_mock):
+    parse_and_run(['vocab', 'subtract', 'vocab', 'removed1', 'removed2', '-o', 'result'])
+
+    vocabalgebra_mock.subtract.assert_called_with('vocab', ['removed1', 'removed2'], 'result')
+
+
+@mock.patch('codeprep.api.vocab.vocabalgebra', autospec=True)
+def test_vocab_prune(vocabalgebra_mock):
+    parse_and_run(['vocab', 'prune', 'vocab', '-o', 'pruned', '--min-count', '5'])
+
+    vocabalgebra_mock.prune.assert_called_with('vocab', 'pruned', None, 5)
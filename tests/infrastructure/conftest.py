@@ -0,0 +1,45 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from typing import List, Tuple, Optional
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from codeprep.pipeline.vocab import _dump_vocab_dict
+
+
+@pytest.fixture
+def create_prep_dataset(tmp_path):
+    """
+    Writes the preprocessed files, their word boundaries (if given) and the vocab into `tmp_path`.
+    The created function returns a mock of the dataset and the path to the vocab.
+    """
+    def create(files: List[str], vocab: List[Tuple[str, int]],
+               word_boundaries: Optional[List[Optional[List[int]]]] = None) -> Tuple[Mock, str]:
+        prep_path = os.path.join(str(tmp_path), 'prep')
+        word_boundaries_path = os.path.join(str(tmp_path), 'wb')
+        os.makedirs(prep_path)
+        os.makedirs(word_boundaries_path)
+        paths = []
+        for i, content in enumerate(files):
+            path = os.path.join(prep_path, f'{i}.prep')
+            with open(path, 'w') as f:
+                f.write(content + '\n')
+            if word_boundaries and word_boundaries[i]:
+                np.array(word_boundaries[i], dtype=np.uint32).tofile(os.path.join(word_boundaries_path, f'{i}.wb'))
+            paths.append(path.encode())
+
+        dataset = Mock(path=prep_path)
+        dataset.file_iterator = lambda: iter(paths)
+        dataset.count_files = lambda: len(paths)
+        dataset.get_new_file_name = lambda file, _: os.path.join(word_boundaries_path.encode(),
+                                                                 os.path.basename(file).replace(b'.prep', b'.wb'))
+        path_to_vocab = os.path.join(str(tmp_path), 'vocab')
+        _dump_vocab_dict(vocab, path_to_vocab, to_literal=False)
+        return dataset, path_to_vocab
+
+    return create
@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import math
+import os
+import random
+from collections import Counter
+
+import pytest
+
+from codeprep.pipeline.approxvocab import MisraGriesSummary, CountMinSketch
+from codeprep.pipeline.vocab import calc_vocab, _load_vocab_dict, VOCAB_FILENAME, VOCABSIZE_FILENAME
+
+
+def _zipf_words(n: int, seed: int):
+    rnd = random.Random(seed)
+    return [f'w{int(rnd.paretovariate(1.0))}' for _ in range(n)]
+
+
+def test_misra_gries_merged_bounds():
+    words = _zipf_words(20000, seed=3)
+    true_counts = Counter(words)
+    summaries = []
+    for i in range(0, len(words), 1000):
+        summary = MisraGriesSummary(50)
+        summary.update(words[i:i + 1000])
+        summaries.append(summary)
+    merged = summaries[0]
+    for summary in summaries[1:]:
+        merged.merge(summary)
+
+    assert merged.total == len(words)
+    assert merged.max_underestimation <= len(words) / 51
+    estimates = dict(merged.top())
+    assert len(estimates) <= 50
+    for word, count in true_counts.items():
+        assert count - merged.max_underestimation <= estimates.get(word, 0) <= count
+
+
+def test_count_min_never_underestimates():
+    words = _zipf_words(5000, seed=5)
+    sketch = CountMinSketch(width=256, depth=4)
+    sketch.update(words[:2500])
+    other = CountMinSketch(width=256, depth=4)
+    other.update(words[2500:])
+    sketch.merge(other)
+
+    for word, count in Counter(words).items():
+        assert sketch.estimate(word) >= count
+
+
+def test_count_min_different_sizes():
+    with pytest.raises(ValueError):
+        CountMinSketch(width=256, depth=4).merge(CountMinSketch(width=128, depth=4))
+
+
+@pytest.mark.parametrize('count_min_size', [None, (1024, 4)])
+def test_calc_approximate_vocab(tmp_path, count_min_size):
+    words = _zipf_words(3000, seed=7)
+    files = []
+    for i in range(0, len(words), 300):
+        path = os.path.join(str(tmp_path), f'{i}.prep')
+        with open(path, 'w') as f:
+            f.write(' '.join(words[i:i + 300]))
+        files.append(path.encode())
+    output_dir = os.path.join(str(tmp_path), 'vocab')
+    os.makedirs(output_dir)
+
+    calc_vocab(str(tmp_path), iter(files), output_dir, top_k=5, count_min_size=count_min_size)
+
+    vocab = _load_vocab_dict(os.path.join(output_dir, VOCAB_FILENAME))
+    assert list(vocab.keys())[0] == Counter(words).most_common(1)[0][0]
+    assert len(vocab) <= 5
+    if count_min_size:
+        true_counts = Counter(words)
+        assert all(count >= true_counts[word] for word, count in vocab.items())
+    assert 'count_min' not in os.listdir(output_dir)
+    with open(os.path.join(output_dir, VOCABSIZE_FILENAME)) as f:
+        stats = f.read().splitlines()
+    assert abs(int(stats[0]) - len(set(words))) < len(set(words)) * 0.1
+    assert stats[-1].startswith('1.0000 ') or stats[-1].startswith('#')
+    assert '# approximate vocab: top 5 words, 3000 words in total' in stats
+    assert any(line.startswith('# count-min') for line in stats) == bool(count_min_size)
+    if count_min_size:
+        # the sketches of all the workers are added up
+        assert any(line.startswith(f'# count-min 1024x4: counts are overestimated by at most '
+                                   f'{math.e / 1024 * len(words):.1f} ') for line in stats)
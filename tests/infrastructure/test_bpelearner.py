@@ -2,12 +2,23 @@
 #
 # SPDX-License-Identifier: Apache-2.0
 
+import json
+import os
 from unittest import mock
 
 import pytest
 
 from codeprep.bpepkg.bpe_config import BpeConfig, BpeParam, BpeConfigNotSupported
-from codeprep.pipeline.bpelearner import run
+from codeprep.bpepkg.bpe_learn import do_merges, create_resulting_vocab
+from codeprep.bpepkg.bpe_learn_bounded import create_pruned_split_vocab
+from codeprep.bpepkg.checkpoint import BpeCheckpoint, dump_checkpoint
+from codeprep.bpepkg.merge import read_merges, MergeList, Merge
+from codeprep.pipeline import bpelearner
+from codeprep.pipeline.bpelearner import run, run_wild, BpeSnapshotWriter, SnapshotNotSavedError
+from codeprep.pipeline.bperegistry import MERGES_FILE_NAME, MERGES_CACHE_FILE_NAME, RESULTING_VOCAB_FILE_NAME, \
+    BPE_REASSEMBLED_VOCAB_FILE_NAME, SAMPLED_DIR_NAME, SAMPLING_REPORT_FILE_NAME, \
+    PERFORMANCE_STATS_FILE_SUFFIX, CHECKPOINTS_DIR_NAME, HOLDOUT_VOCAB_FILE_NAME
+from codeprep.pipeline.vocab import _load_vocab_dict, _dump_vocab_dict
 
 
 @mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
@@ -31,4 +42,223 @@ def test_run_bytes_bpe(mocked_dataset):
         BpeParam.CASE: 'yes'
     })
     with pytest.raises(BpeConfigNotSupported):
-        run(mocked_dataset, 1, bpe_config)
\ No newline at end of file
+        run(mocked_dataset, 1, bpe_config)
+
+@mock.patch('codeprep.pipeline.bpelearner.prepare_vocabs', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
+def test_run_with_snapshots(mocked_dataset, prepare_vocabs_mock, tmp_path):
+    bpe_config = BpeConfig({
+        BpeParam.BASE: 'code',
+        BpeParam.WORD_END: False,
+        BpeParam.UNICODE: 'yes',
+        BpeParam.CASE: 'yes'
+    })
+    mocked_dataset.bpe_path = str(tmp_path)
+    prepare_vocabs_mock.return_value = ({"t h e @": 50, "t h e r e @": 11, "w h e r e @": 7}, {"<comment>@": 4})
+
+    run(mocked_dataset, [2, 5, 4], bpe_config)
+
+    for n_merges in ['2', '4', '5']:
+        bpe_dir = os.path.join(str(tmp_path), n_merges)
+        for file in [MERGES_FILE_NAME, MERGES_CACHE_FILE_NAME, RESULTING_VOCAB_FILE_NAME,
+                     BPE_REASSEMBLED_VOCAB_FILE_NAME]:
+            assert os.path.exists(os.path.join(bpe_dir, file))
+        assert len(read_merges(os.path.join(bpe_dir, MERGES_FILE_NAME))) == int(n_merges)
+    assert read_merges(os.path.join(str(tmp_path), '5', MERGES_FILE_NAME))[:4] == \
+           read_merges(os.path.join(str(tmp_path), '4', MERGES_FILE_NAME))[:]
+    prepare_vocabs_mock.assert_called_once()
+
+
+@pytest.mark.parametrize('use_fork', [True, False])
+def test_snapshot_writer(tmp_path, monkeypatch, use_fork):
+    if not use_fork:
+        monkeypatch.setattr(bpelearner, '_get_fork_context', lambda: None)
+    already_done_merges = MergeList().append(Merge(('a', 'b'), 3))
+    snapshot_writer = BpeSnapshotWriter(str(tmp_path), already_done_merges, [2], {'<comment>@': 4})
+    assert snapshot_writer.is_due(1)
+
+    snapshot_writer.save({'ab c @': 3}, MergeList().append(Merge(('ab', 'c'), 3)))
+    snapshot_writer.close()
+
+    bpe_dir = os.path.join(str(tmp_path), '2')
+    assert read_merges(os.path.join(bpe_dir, MERGES_FILE_NAME)) == already_done_merges + \
+        MergeList().append(Merge(('ab', 'c'), 3))
+    assert _load_vocab_dict(os.path.join(bpe_dir, BPE_REASSEMBLED_VOCAB_FILE_NAME)) == {'ab c @': 3, '<comment>@': 4}
+
+
+@pytest.mark.parametrize('use_fork', [True, False])
+def test_snapshot_writer_with_pruned_split_vocab(tmp_path, monkeypatch, use_fork):
+    if not use_fork:
+        monkeypatch.setattr(bpelearner, '_get_fork_context', lambda: None)
+    already_done_merges = MergeList().append(Merge(('a', 'b'), 3))
+    vocab = create_pruned_split_vocab([('ab c @', 3), ('a b @', 1)], 2, str(tmp_path / 'spill'))
+    snapshot_writer = BpeSnapshotWriter(str(tmp_path), already_done_merges, [2], {'<comment>@': 4})
+
+    vocab.store.add_word('x @', 1)  # the state passed to the writer is not affected by the later changes
+    snapshot_writer.save(vocab, MergeList().append(Merge(('ab', 'c'), 3)))
+    vocab.store.add_word('y @', 1)
+    snapshot_writer.close()
+
+    assert _load_vocab_dict(os.path.join(str(tmp_path), '2', BPE_REASSEMBLED_VOCAB_FILE_NAME)) == \
+        {'ab c @': 3, 'x @': 1, 'ab @': 1, '<comment>@': 4}
+
+
+@pytest.mark.parametrize('use_fork', [True, False])
+def test_snapshot_writer_fails(tmp_path, monkeypatch, use_fork):
+    if not use_fork:
+        monkeypatch.setattr(bpelearner, '_get_fork_context', lambda: None)
+    monkeypatch.setattr(bpelearner, 'save_results', mock.Mock(side_effect=OSError('disk full')))
+    snapshot_writer = BpeSnapshotWriter(str(tmp_path), MergeList(), [1], {})
+
+    snapshot_writer.save({'ab @': 3}, MergeList().append(Merge(('a', 'b'), 3)))
+    with pytest.raises(SnapshotNotSavedError if use_fork else OSError):
+        snapshot_writer.close()
+
+
+@mock.patch('codeprep.pipeline.bpelearner.get_other_vocab', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.prepare_vocabs', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
+def test_resume_at_snapshot(mocked_dataset, prepare_vocabs_mock, get_other_vocab_mock, tmp_path):
+    bpe_config = BpeConfig({
+        BpeParam.BASE: 'code',
+        BpeParam.WORD_END: False,
+        BpeParam.UNICODE: 'yes',
+        BpeParam.CASE: 'yes'
+    })
+    split_base_vocab, other_vocab = {"t h e @": 50, "t h e r e @": 11, "w h e r e @": 7}, {"<comment>@": 4}
+    prepare_vocabs_mock.return_value = (split_base_vocab, other_vocab)
+    get_other_vocab_mock.return_value = other_vocab
+    mocked_dataset.bpe_path = str(tmp_path / 'uninterrupted')
+    os.makedirs(mocked_dataset.bpe_path)
+    run(mocked_dataset, [2, 5], bpe_config)
+
+    # interrupted right after the checkpoint at the first snapshot has been written
+    mocked_dataset.bpe_path = str(tmp_path / 'resumed')
+    dump_checkpoint(BpeCheckpoint(*reversed(do_merges(split_base_vocab, 2))),
+                    os.path.join(mocked_dataset.bpe_path, CHECKPOINTS_DIR_NAME))
+    run(mocked_dataset, [2, 5], bpe_config)
+
+    for n_merges in ['2', '5']:
+        for file in [MERGES_FILE_NAME, BPE_REASSEMBLED_VOCAB_FILE_NAME]:
+            expected = os.path.join(str(tmp_path), 'uninterrupted', n_merges, file)
+            actual = os.path.join(str(tmp_path), 'resumed', n_merges, file)
+            if file == MERGES_FILE_NAME:
+                assert read_merges(actual) == read_merges(expected)
+            else:
+                assert _load_vocab_dict(actual) == _load_vocab_dict(expected)
+
+
+@mock.patch('codeprep.pipeline.bpelearner.stages', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.prepare_vocabs', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
+def test_run_bounded_reads_vocab_file(mocked_dataset, prepare_vocabs_mock, stages_mock, tmp_path):
+    bpe_config = BpeConfig({
+        BpeParam.BASE: 'code',
+        BpeParam.WORD_END: False,
+        BpeParam.UNICODE: 'yes',
+        BpeParam.CASE: 'yes'
+    })
+    mocked_dataset.bpe_path = str(tmp_path / 'bpe')
+    os.makedirs(mocked_dataset.bpe_path)
+    mocked_dataset.path_to_bpe_vocab_file = str(tmp_path / 'vocab.txt')
+    mocked_dataset.path_to_nonbpe_vocab_file = str(tmp_path / 'nonbpe_vocab.txt')
+    _dump_vocab_dict([('the', 50), ('there', 11), ('where', 7), ('<comment>', 4), ('bird', 1)],
+                     mocked_dataset.path_to_bpe_vocab_file)
+    (tmp_path / 'nonbpe_vocab.txt').write_text('<comment>\n')
+
+    run(mocked_dataset, [2, 5], bpe_config, min_word_freq=2)
+
+    stages_mock.run_until_base_bpe_vocab.assert_called_once_with(mocked_dataset)
+    prepare_vocabs_mock.assert_not_called()
+    expected_vocab, expected_merges = do_merges({"t h e @": 50, "t h e r e @": 11, "w h e r e @": 7}, 5)
+    assert read_merges(os.path.join(mocked_dataset.bpe_path, '5', MERGES_FILE_NAME)) == expected_merges
+    assert _load_vocab_dict(os.path.join(mocked_dataset.bpe_path, '5', BPE_REASSEMBLED_VOCAB_FILE_NAME)) == \
+        {**expected_vocab, 'b i r d @': 1, '<comment>@': 4}
+    assert len(read_merges(os.path.join(mocked_dataset.bpe_path, '2', MERGES_FILE_NAME))) == 2
+    assert not os.path.exists(os.path.join(mocked_dataset.bpe_path, CHECKPOINTS_DIR_NAME))
+
+
+@mock.patch('codeprep.pipeline.bpelearner.prepare_vocabs', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
+def test_run_sampled(mocked_dataset, prepare_vocabs_mock, tmp_path):
+    bpe_config = BpeConfig({
+        BpeParam.BASE: 'code',
+        BpeParam.WORD_END: False,
+        BpeParam.UNICODE: 'yes',
+        BpeParam.CASE: 'yes'
+    })
+    mocked_dataset.bpe_path = str(tmp_path)
+    words = ["t h e @", "t h e r e @", "w h e r e @", "h e r e @", "t h i s @", "t h a t @"]
+    split_base_vocab = {f'{chr(ord("a") + i)} {word}': 50 - i for i in range(20) for word in words}
+    prepare_vocabs_mock.return_value = (split_base_vocab, {"<comment>@": 4})
+
+    run(mocked_dataset, [3, 5], bpe_config, sample_rate=0.5)
+
+    sampled_dir = os.path.join(str(tmp_path), SAMPLED_DIR_NAME, '0.5')
+    holdout = _load_vocab_dict(os.path.join(sampled_dir, HOLDOUT_VOCAB_FILE_NAME))
+    assert holdout
+    for n_merges in [3, 5]:
+        bpe_dir = os.path.join(sampled_dir, str(n_merges))
+        assert len(read_merges(os.path.join(bpe_dir, MERGES_FILE_NAME))) == n_merges
+        assert not os.path.exists(os.path.join(str(tmp_path), str(n_merges)))
+        with open(os.path.join(bpe_dir, SAMPLING_REPORT_FILE_NAME)) as f:
+            report = json.load(f)
+        assert report['n_merges'] == n_merges
+        assert report['n_holdout_words'] == len(holdout)
+        assert set(report['holdout_top_k_merge_overlap'].keys()) == {str(n_merges)}
+        assert set(report['compression_ratio'].keys()) == {'exact_on_holdout', 'sampled_on_holdout', 'sampled'}
+        # the holdout words are not in the sample merges are learned on
+        learned_on = _load_vocab_dict(os.path.join(bpe_dir, BPE_REASSEMBLED_VOCAB_FILE_NAME))
+        assert not {''.join(w.split(' ')) for w in holdout} & {''.join(w.split(' ')) for w in learned_on}
+    prepare_vocabs_mock.assert_called_once()
+
+
+@mock.patch('codeprep.pipeline.bpelearner.prepare_vocabs', autospec=True)
+@mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
+def test_run_with_performance_stats(mocked_dataset, prepare_vocabs_mock, tmp_path):
+    bpe_config = BpeConfig({
+        BpeParam.BASE: 'code',
+        BpeParam.WORD_END: False,
+        BpeParam.UNICODE: 'yes',
+        BpeParam.CASE: 'yes'
+    })
+    mocked_dataset.bpe_path = str(tmp_path)
+    split_base_vocab = {"t h e @": 50, "t h e r e @": 11, "w h e r e @": 7, "a a a a a @": 3}
+    prepare_vocabs_mock.return_value = (split_base_vocab, {"<comment>@": 4})
+
+    run(mocked_dataset, 5, bpe_config, stats_every_n_merges=2)
+
+    with open(os.path.join(str(tmp_path), f'5{PERFORMANCE_STATS_FILE_SUFFIX}.json')) as f:
+        stats = json.load(f)
+    assert [entry['merges_done'] for entry in stats] == [0, 1, 2, 4]
+    assert [entry['vocab_size'] for entry in stats] == \
+           [len(create_resulting_vocab(do_merges(split_base_vocab, entry['merges_done'])[0])) for entry in stats]
+    assert stats[1]['n_words_touched'] == 3
+    assert stats[1]['n_live_priority_queue_entries'] <= stats[1]['n_priority_queue_entries']
+
+
+@mock.patch('codeprep.pipeline.bpelearner.Dataset', autospec=True)
+def test_run_wild(mocked_dataset, tmp_path):
+    bpe_config = BpeConfig({
+        BpeParam.BASE: 'code',
+        BpeParam.WORD_END: False,
+        BpeParam.UNICODE: 'yes',
+        BpeParam.CASE: 'yes'
+    })
+    files = []
+    for i, text in enumerate(['the there where', 'where is the email@there']):
+        path = tmp_path / f'{i}.java'
+        path.write_text(text)
+        files.append(str(path).encode())
+    mocked_dataset.bpe_path = str(tmp_path / 'bpe')
+    mocked_dataset.original.file_iterator.return_value = files
+
+    run_wild(mocked_dataset, [3, 2], bpe_config)
+
+    for n_merges in ['2', '3']:
+        bpe_dir = os.path.join(mocked_dataset.bpe_path, n_merges)
+        for file in [MERGES_FILE_NAME, MERGES_CACHE_FILE_NAME]:
+            assert os.path.exists(os.path.join(bpe_dir, file))
+    merges = read_merges(os.path.join(mocked_dataset.bpe_path, '3', MERGES_FILE_NAME))
+    assert [m.pair for m in merges] == [('h', 'e'), ('t', 'he'), ('r', 'e')]
+    assert read_merges(os.path.join(mocked_dataset.bpe_path, '2', MERGES_FILE_NAME))[:] == merges[:2]
@@ -0,0 +1,77 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from codeprep.pipeline.manifest import scan, Manifest, get_manifest_path, save_manifest_digest, get_manifest_digest
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = str(tmp_path / 'dataset')
+    os.makedirs(os.path.join(path, 'sub'))
+    for file, content in [('a.java', 'class A {}'), (os.path.join('sub', 'b.java'), 'class B {}'), ('c.txt', 'c')]:
+        with open(os.path.join(path, file), 'w') as f:
+            f.write(content)
+    os.symlink(os.path.join(path, 'a.java'), os.path.join(path, 'link.java'))
+    return path
+
+
+def _touch(path, content):
+    stat = os.stat(path)
+    with open(path, 'w') as f:
+        f.write(content)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_scan(dataset):
+    manifest = scan(dataset, ['java'])
+
+    assert sorted(manifest.entries) == [b'./a.java', b'sub/b.java']
+    assert manifest.entries[b'./a.java'].size == len('class A {}')
+
+
+def test_diff(dataset):
+    manifest = scan(dataset, None)
+    _touch(os.path.join(dataset, 'a.java'), 'class AA {}')
+    os.remove(os.path.join(dataset, 'c.txt'))
+    with open(os.path.join(dataset, 'sub', 'd.java'), 'w') as f:
+        f.write('class D {}')
+
+    delta = manifest.diff(scan(dataset, None))
+
+    assert delta.added == [b'sub/d.java']
+    assert delta.changed == [b'./a.java']
+    assert delta.removed == [b'./c.txt']
+    assert manifest.diff(manifest).is_empty()
+
+
+def test_diff_with_hashes(dataset):
+    manifest = scan(dataset, None)
+    manifest.fill_hashes()
+    _touch(os.path.join(dataset, 'a.java'), 'class A {}')
+    _touch(os.path.join(dataset, os.path.join('sub', 'b.java')), 'class Z {}')
+
+    delta = manifest.diff(scan(dataset, None))
+
+    assert delta.changed == [b'sub/b.java']
+
+
+def test_save_and_load(dataset, tmp_path):
+    manifest = scan(dataset, None)
+    manifest.fill_hashes()
+    path = get_manifest_path(str(tmp_path / 'output'))
+
+    manifest.save(path)
+
+    loaded = Manifest.load(path)
+    assert loaded.original_path == dataset
+    assert loaded.entries == manifest.entries
+    assert loaded.digest == manifest.digest
+
+    save_manifest_digest(manifest, str(tmp_path / 'vocab'))
+    assert get_manifest_digest(str(tmp_path / 'vocab')) == manifest.digest
+    assert get_manifest_digest(str(tmp_path / 'other')) is None
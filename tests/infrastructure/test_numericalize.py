@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from codeprep.pipeline.manifest import Manifest, ManifestEntry, save_manifest_digest
+from codeprep.pipeline.numericalize import numericalize, NumericalizedCorpus, TOKENS_FILENAME
+
+FILES = [
+    'int a = b ;',
+    'a b c',
+    'int int unknown',
+]
+WORD_BOUNDARIES = [
+    [0, 1, 2, 3, 4, 5],
+    [0, 1, 3],
+    None,
+]
+VOCAB = [('int', 3), ('a', 2), ('b', 2), ('=', 1), (';', 1), ('c', 1)]
+
+
+@pytest.fixture
+def prep_dataset(create_prep_dataset):
+    return create_prep_dataset(FILES, VOCAB, WORD_BOUNDARIES)
+
+
+def test_numericalize(tmp_path, prep_dataset):
+    dataset, path_to_vocab = prep_dataset
+    path = os.path.join(str(tmp_path), 'numericalized')
+
+    numericalize(dataset, Mock(), path_to_vocab, path)
+
+    corpus = NumericalizedCorpus(path)
+    assert corpus.dtype == np.uint16
+    assert len(corpus) == 3
+    assert corpus.n_tokens == 11
+    assert list(corpus.files()) == [b'0.prep', b'1.prep', b'2.prep']
+    assert corpus[0].tolist() == [0, 1, 3, 2, 4]
+    assert corpus[1].tolist() == [1, 2, 5]
+    assert corpus[2].tolist() == [0, 0, corpus.unk_id]
+    assert corpus.unk_id == len(VOCAB)
+    # word boundaries are not available for the last file
+    with pytest.raises(ValueError):
+        corpus.word_boundaries(0)
+
+
+def test_numericalize_word_boundaries(tmp_path, prep_dataset):
+    dataset, path_to_vocab = prep_dataset
+    np.array([0, 1, 2, 3], dtype=np.uint32).tofile(os.path.join(str(tmp_path), 'wb', '2.wb'))
+    path = os.path.join(str(tmp_path), 'numericalized')
+
+    numericalize(dataset, Mock(), path_to_vocab, path)
+
+    corpus = NumericalizedCorpus(path)
+    assert corpus.word_boundaries(0).tolist() == WORD_BOUNDARIES[0]
+    assert corpus.word_boundaries(1).tolist() == WORD_BOUNDARIES[1]
+    assert corpus.word_boundaries(2).tolist() == [0, 1, 2, 3]
+
+
+def test_numericalize_is_rebuilt_when_manifest_changes(tmp_path, prep_dataset):
+    dataset, path_to_vocab = prep_dataset
+    save_manifest_digest(Manifest('/dataset', {b'0.java': ManifestEntry(10, 1)}), dataset.path)
+    path = os.path.join(str(tmp_path), 'numericalized')
+    numericalize(dataset, Mock(), path_to_vocab, path)
+    path_to_tokens = os.path.join(path, TOKENS_FILENAME)
+    mtime = os.stat(path_to_tokens).st_mtime_ns
+
+    numericalize(dataset, Mock(), path_to_vocab, path)
+    assert os.stat(path_to_tokens).st_mtime_ns == mtime
+
+    save_manifest_digest(Manifest('/dataset', {b'0.java': ManifestEntry(12, 2)}), dataset.path)
+    os.remove(path_to_tokens)
+    numericalize(dataset, Mock(), path_to_vocab, path)
+    assert len(NumericalizedCorpus(path)) == 3
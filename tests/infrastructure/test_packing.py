@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import os
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from codeprep.pipeline.numericalize import numericalize
+from codeprep.pipeline.packing import pack, PackedSequences, INDEX_FILENAME, FILE_ORDER_FILENAME
+from codeprep.util import groupify
+
+FILES = [
+    'a b c d <EOF>',
+    'e f',
+    'g <EOF>',
+    'h i j k l m n',
+    'o',
+]
+VOCAB = [('<EOF>', 2)] + [(chr(ord('a') + i), 1) for i in range(15)]
+SEPARATOR_ID = 0
+
+
+@pytest.fixture
+def numericalized(tmp_path, create_prep_dataset):
+    dataset, path_to_vocab = create_prep_dataset(FILES, VOCAB)
+    path = os.path.join(str(tmp_path), 'numericalized')
+    numericalize(dataset, Mock(), path_to_vocab, path)
+    return path
+
+
+def _expected_sequences(file_order, n_shards, seq_len, stride):
+    word_ids = {word: i for i, (word, _) in enumerate(VOCAB)}
+    sequences = []
+    for shard in groupify(file_order, n_shards):
+        tokens = []
+        for i in shard:
+            tokens.extend(word_ids[word] for word in FILES[i].split(' '))
+            if tokens[-1] != SEPARATOR_ID:
+                tokens.append(SEPARATOR_ID)
+        for start in range(0, len(tokens) - seq_len + 1, stride):
+            sequences.append(tokens[start:start + seq_len])
+    return sequences
+
+
+@pytest.mark.parametrize('n_shards', [1, 2])
+@pytest.mark.parametrize('seq_len,stride', [(4, 4), (4, 2), (3, 5), (30, 1)])
+def test_pack(tmp_path, numericalized, n_shards, seq_len, stride):
+    output_path = os.path.join(str(tmp_path), 'sequences')
+
+    pack(numericalized, output_path, seq_len, stride, SEPARATOR_ID, n_shards)
+
+    file_order = np.load(os.path.join(output_path, FILE_ORDER_FILENAME)).tolist()
+    assert sorted(file_order) == list(range(len(FILES)))
+    sequences = PackedSequences(output_path)
+    assert [sequences[i].tolist() for i in range(len(sequences))] == \
+        _expected_sequences(file_order, n_shards, seq_len, stride)
+    with open(os.path.join(output_path, INDEX_FILENAME)) as f:
+        assert len(json.load(f)['shards']) == n_shards
+
+
+def test_pack_is_deterministic(tmp_path, numericalized):
+    pack(numericalized, os.path.join(str(tmp_path), 'first'), 4, separator_id=SEPARATOR_ID, seed=1)
+    pack(numericalized, os.path.join(str(tmp_path), 'second'), 4, separator_id=SEPARATOR_ID, seed=1)
+
+    first = PackedSequences(os.path.join(str(tmp_path), 'first'))
+    second = PackedSequences(os.path.join(str(tmp_path), 'second'))
+    assert [s.tolist() for s in first.shards] == [s.tolist() for s in second.shards]
+    with pytest.raises(IndexError):
+        first[len(first)]
@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from unittest import mock
+
+from codeprep.pipeline.parsecache import ParseCache, get_key
+
+
+def _write(path, content: bytes):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def test_get_key():
+    assert get_key('int a;', 'java') == get_key('int a;', 'java')
+    assert get_key('int a;', 'java') != get_key('int b;', 'java')
+    assert get_key('int a;', 'java') != get_key('int a;', 'c')
+    key = get_key('int a;', 'java')
+    with mock.patch('codeprep.pipeline.parsecache.version', '0.0.0'):
+        assert get_key('int a;', 'java') != key
+
+
+def test_get_and_put(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    parsed = _write(str(tmp_path / 'a.parsed'), b'parsed')
+    dest = str(tmp_path / 'b.parsed')
+
+    assert not cache.get('ab12', dest)
+    cache.put('ab12', parsed)
+    cache.put('ab12', parsed)
+
+    assert cache.get('ab12', dest)
+    with open(dest, 'rb') as f:
+        assert f.read() == b'parsed'
+    assert os.path.samefile(parsed, dest)
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = ParseCache(str(tmp_path / 'cache'))
+    for key in ['aa', 'bb', 'cc']:
+        cache.put(key, _write(str(tmp_path / key), b'x' * 10))
+    cache.get('aa', str(tmp_path / 'aa_copy'))
+
+    assert cache.evict(max_size=25) == 1
+
+    assert cache.get('aa', str(tmp_path / 'aa_copy2'))
+    assert not cache.get('bb', str(tmp_path / 'bb_copy'))
+    assert cache.get('cc', str(tmp_path / 'cc_copy'))
+    # files linked from the cache are not affected
+    assert os.path.exists(str(tmp_path / 'bb'))
+    assert cache.evict(max_size=25) == 0
@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from collections import Counter
+from unittest.mock import Mock
+
+import pytest
+
+from codeprep.pipeline.manifest import save_manifest_digest, get_manifest_digest
+from codeprep.pipeline.stages import _update_vocab
+from codeprep.pipeline.vocab import _dump_vocab_dict, _load_vocab_dict, VOCAB_FILENAME, VOCABSIZE_FILENAME
+
+VOCAB = Counter({'int': 5, 'a': 3, 'b': 1})
+
+
+def _manifest(digest: str) -> Mock:
+    return Mock(entries={b'a.java': None, b'b.java': None},
+                header=lambda: {'original_path': '/dataset', 'digest': digest, 'n_files': 2})
+
+
+@pytest.fixture
+def vocab_path(tmp_path):
+    path = os.path.join(str(tmp_path), 'vocab')
+    os.makedirs(path)
+    _dump_vocab_dict(VOCAB.most_common(), os.path.join(path, VOCAB_FILENAME), to_literal=False)
+    with open(os.path.join(path, VOCABSIZE_FILENAME), 'w') as f:
+        f.write(f'{len(VOCAB)}\n')
+    return path
+
+
+def test_update_vocab(vocab_path):
+    save_manifest_digest(_manifest('previous'), vocab_path)
+    dataset = Mock(manifest=_manifest('current'))
+
+    _update_vocab(dataset, vocab_path, 'previous', Counter({'a': 3, 'int': 1}), Counter({'c': 2}))
+
+    assert _load_vocab_dict(os.path.join(vocab_path, VOCAB_FILENAME)) == {'int': 4, 'c': 2, 'b': 1}
+    with open(os.path.join(vocab_path, VOCABSIZE_FILENAME)) as f:
+        assert f.read().splitlines() == ['3', '1.0000 3 0']
+    assert get_manifest_digest(vocab_path) == 'current'
+
+
+@pytest.mark.parametrize('vocab_digest', [None, 'older'])
+def test_update_vocab_not_built_from_previous_version(vocab_path, vocab_digest):
+    if vocab_digest:
+        save_manifest_digest(_manifest(vocab_digest), vocab_path)
+    dataset = Mock(manifest=_manifest('current'))
+
+    _update_vocab(dataset, vocab_path, 'previous', Counter({'a': 3}), Counter({'c': 2}))
+
+    assert not os.path.exists(os.path.join(vocab_path, VOCAB_FILENAME))
+    assert not os.path.exists(os.path.join(vocab_path, VOCABSIZE_FILENAME))
+    assert get_manifest_digest(vocab_path) is None
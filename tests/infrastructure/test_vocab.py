@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from collections import Counter
+from multiprocessing.pool import Pool
+from unittest import mock
+
+import pytest
+
+from codeprep.pipeline.vocab import calc_vocab, VOCAB_FILENAME, VOCABSIZE_FILENAME, _load_vocab_dict, PartialVocab, \
+    PartialVocabFileCorrupted, is_partial_vocab_file_valid, PARTVOCAB_EXT, PARTVOCAB_HEADER, PARTIAL_VOCABS_READY_FILENAME, \
+    start_inline_vocab_counting, init_inline_vocab_counting, count_words_inline, finish_inline_vocab_counting, \
+    InlineVocabCounter
+
+FILES = [
+    'public class Foo\nint a = b ;',
+    'int i = 0 ;\nfor ( ; ; )',
+    'a b c d e f g h',
+    'int int int a',
+    'public static void main',
+]
+
+
+@pytest.fixture
+def prep_files(tmp_path):
+    paths = []
+    for i, content in enumerate(FILES):
+        path = os.path.join(str(tmp_path), f'{i}.prep')
+        with open(path, 'w') as f:
+            f.write(content)
+        paths.append(path.encode())
+    return paths
+
+
+@pytest.mark.parametrize('n_partitions', [1, 3, 8])
+def test_calc_vocab(tmp_path, prep_files, n_partitions):
+    output_dir = os.path.join(str(tmp_path), 'vocab')
+    os.makedirs(output_dir)
+
+    with mock.patch('codeprep.pipeline.vocab.multiprocessing.cpu_count', return_value=n_partitions):
+        calc_vocab(str(tmp_path), iter(prep_files), output_dir)
+
+    expected = Counter(' '.join(FILES).replace('\n', ' ').split(' '))
+    assert _load_vocab_dict(os.path.join(output_dir, VOCAB_FILENAME)) == expected
+    with open(os.path.join(output_dir, VOCAB_FILENAME)) as f:
+        frequencies = [int(line.rstrip('\n').split('\t')[1]) for line in f]
+    assert frequencies == sorted(frequencies, reverse=True)
+
+    with open(os.path.join(output_dir, VOCABSIZE_FILENAME)) as f:
+        stats = f.read().splitlines()
+    assert stats[0] == str(len(expected))
+    assert len(stats) == len(FILES) + 1
+    assert stats[-1] == f'1.0000 {len(expected)} 0'
+    assert not os.path.exists(os.path.join(output_dir, 'part_vocab'))
+
+
+@pytest.mark.parametrize('max_words_in_memory', [2, 1000])
+def test_calc_vocab_bounded_memory(tmp_path, prep_files, max_words_in_memory):
+    output_dir = os.path.join(str(tmp_path), 'vocab')
+    os.makedirs(output_dir)
+
+    with mock.patch('codeprep.pipeline.vocab.MAX_WORDS_IN_MEMORY', max_words_in_memory), \
+            mock.patch('codeprep.pipeline.vocab.MAX_RUNS_TO_MERGE', 2):
+        calc_vocab(str(tmp_path), iter(prep_files), output_dir, bounded_memory=True)
+
+    expected = Counter(' '.join(FILES).replace('\n', ' ').split(' '))
+    assert _load_vocab_dict(os.path.join(output_dir, VOCAB_FILENAME)) == expected
+    with open(os.path.join(output_dir, VOCAB_FILENAME)) as f:
+        frequencies = [int(line.rstrip('\n').split('\t')[1]) for line in f]
+    assert frequencies == sorted(frequencies, reverse=True)
+
+    with open(os.path.join(output_dir, VOCABSIZE_FILENAME)) as f:
+        stats = f.read().splitlines()
+    assert stats[0] == str(len(expected))
+    assert len(stats) == len(FILES) + 1
+    assert stats[-1] == f'1.0000 {len(expected)} 0'
+    assert not os.path.exists(os.path.join(output_dir, 'vocab_runs'))
+
+
+def test_partial_vocab_file_corrupted(tmp_path):
+    path = os.path.join(str(tmp_path), f'1_0.{PARTVOCAB_EXT}')
+    PartialVocab(Counter({'a': 3, 'bc': 1}), 0).dump(path)
+    assert is_partial_vocab_file_valid(path)
+
+    with open(path, 'r+b') as f:
+        f.seek(PARTVOCAB_HEADER.size)
+        f.write(b'X')
+    assert is_partial_vocab_file_valid(path, verify_checksum=False)
+    assert not is_partial_vocab_file_valid(path)
+    with pytest.raises(PartialVocabFileCorrupted):
+        PartialVocab.load(path)
+
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert not is_partial_vocab_file_valid(path, verify_checksum=False)
+
+
+def test_calc_vocab_recomputes_incomplete_partial_vocabs(tmp_path, prep_files):
+    output_dir = os.path.join(str(tmp_path), 'vocab')
+    path_to_dump = os.path.join(output_dir, 'part_vocab')
+    os.makedirs(path_to_dump)
+    with open(os.path.join(path_to_dump, PARTIAL_VOCABS_READY_FILENAME), 'w') as f:
+        f.write('2\n')
+    with open(os.path.join(path_to_dump, f'1_0.{PARTVOCAB_EXT}'), 'wb') as f:
+        f.write(b'written by an old version')
+
+    calc_vocab(str(tmp_path), iter(prep_files), output_dir)
+
+    expected = Counter(' '.join(FILES).replace('\n', ' ').split(' '))
+    assert _load_vocab_dict(os.path.join(output_dir, VOCAB_FILENAME)) == expected
+
+
+@pytest.mark.parametrize('batch_files', [1, 1000])
+def test_inline_vocab_counting(tmp_path, batch_files):
+    output_dir = os.path.join(str(tmp_path), 'vocab')
+    with mock.patch('codeprep.pipeline.vocab.multiprocessing.cpu_count', return_value=3):
+        path_to_dump, n_partitions = start_inline_vocab_counting(output_dir)
+
+    with mock.patch('codeprep.pipeline.vocab.INLINE_VOCAB_BATCH_FILES', batch_files):
+        with Pool(2, initializer=init_inline_vocab_counting, initargs=(path_to_dump, n_partitions)) as pool:
+            pool.map(count_words_inline, [content.replace('\n', ' ') for content in FILES])
+            pool.close()
+            pool.join()
+    assert finish_inline_vocab_counting(path_to_dump, n_partitions, len(FILES))
+
+    calc_vocab(str(tmp_path), iter([]), output_dir)
+
+    expected = Counter(' '.join(FILES).replace('\n', ' ').split(' '))
+    assert _load_vocab_dict(os.path.join(output_dir, VOCAB_FILENAME)) == expected
+
+
+def test_inline_vocab_counting_not_all_files(tmp_path):
+    output_dir = os.path.join(str(tmp_path), 'vocab')
+    path_to_dump, n_partitions = start_inline_vocab_counting(output_dir)
+    counter = InlineVocabCounter(path_to_dump, n_partitions)
+    counter.add_file(FILES[0])
+    counter.dump()
+
+    assert not finish_inline_vocab_counting(path_to_dump, n_partitions, len(FILES))
+    assert not os.path.exists(path_to_dump)
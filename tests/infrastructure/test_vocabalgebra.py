@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+from collections import Counter
+from unittest import mock
+
+import pytest
+
+from codeprep.pipeline import vocabalgebra
+from codeprep.pipeline.vocab import _dump_vocab_dict
+from codeprep.pipeline.vocabalgebra import merge, subtract, prune, VocabNotSortedError
+
+FIRST = Counter({'int': 10, 'class': 4, 'foo': 2, 'a\tb': 1})
+SECOND = Counter({'int': 3, 'bar': 5, 'foo': 2})
+
+
+def _write_vocab(counts: Counter, path: str) -> str:
+    _dump_vocab_dict(counts.most_common(), path, to_literal=False)
+    return path
+
+
+def _read_vocab(path: str):
+    with open(path) as f:
+        return [(word, int(count)) for word, _, count in (line.rstrip('\n').rpartition('\t') for line in f)]
+
+
+@pytest.fixture
+def vocabs(tmp_path):
+    return _write_vocab(FIRST, os.path.join(str(tmp_path), 'first')), \
+           _write_vocab(SECOND, os.path.join(str(tmp_path), 'second'))
+
+
+@pytest.mark.parametrize('max_words_in_memory', [1, 1000])
+def test_merge(tmp_path, vocabs, max_words_in_memory):
+    output = os.path.join(str(tmp_path), 'out', 'merged')
+
+    with mock.patch('codeprep.pipeline.vocab.MAX_WORDS_IN_MEMORY', max_words_in_memory), \
+            mock.patch('codeprep.pipeline.vocab.MAX_RUNS_TO_MERGE', 2), \
+            mock.patch.object(vocabalgebra, '_merge_sorted_runs', wraps=vocabalgebra._merge_sorted_runs) as merge_mock:
+        assert merge(list(vocabs), output) == (len(FIRST + SECOND), 0)
+
+    # the runs of both vocabs are not merged at once
+    assert all(len(args[0]) <= 2 for args, _ in merge_mock.call_args_list)
+
+    merged = _read_vocab(output)
+    assert dict(merged) == FIRST + SECOND
+    assert [count for _, count in merged] == sorted((FIRST + SECOND).values(), reverse=True)
+    assert os.listdir(os.path.dirname(output)) == ['merged']
+
+
+def test_subtract(tmp_path, vocabs):
+    output = os.path.join(str(tmp_path), 'subtracted')
+
+    assert subtract(vocabs[0], [vocabs[1]], output) == (3, 0)
+    assert _read_vocab(output) == [('int', 7), ('class', 4), ('a\tb', 1)]
+
+
+def test_prune(tmp_path, vocabs):
+    output = os.path.join(str(tmp_path), 'pruned')
+
+    prune(vocabs[0], output, top_k=3, min_count=3)
+
+    assert _read_vocab(output) == [('int', 10), ('class', 4)]
+
+
+def test_prune_not_sorted(tmp_path):
+    path = os.path.join(str(tmp_path), 'vocab')
+    _dump_vocab_dict([('a', 1), ('b', 2)], path, to_literal=False)
+
+    with pytest.raises(VocabNotSortedError):
+        prune(path, os.path.join(str(tmp_path), 'pruned'))
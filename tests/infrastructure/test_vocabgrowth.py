@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import random
+
+from codeprep.pipeline.vocabgrowth import VocabGrowthSketch, estimate_vocab_growth, shuffle_files
+from codeprep.preprocess.placeholders import placeholders
+
+
+def test_estimate_vocab_growth():
+    rnd = random.Random(11)
+    files = [[f'w{int(rnd.paretovariate(0.8))}' for _ in range(200)] + [placeholders['non_eng']] for _ in range(100)]
+    sketches = []
+    for i in range(0, len(files), 10):
+        sketch = VocabGrowthSketch()
+        for file in files[i:i + 10]:
+            sketch.add_file(file)
+        sketches.append(sketch)
+
+    growth = estimate_vocab_growth(sketches)
+
+    assert [n_files for n_files, _, _ in growth] == list(range(10, 101, 10))
+    assert [non_eng for _, _, non_eng in growth] == list(range(10, 101, 10))
+    for (n_files, vocab_size, _), next_entry in zip(growth, growth[1:] + [None]):
+        exact = len({word for file in files[:n_files] for word in file})
+        assert abs(vocab_size - exact) <= exact * 0.05
+        if next_entry:
+            assert next_entry[1] >= vocab_size
+
+
+def test_shuffle_files_is_reproducible():
+    files = list(range(100))
+    assert shuffle_files(files) == shuffle_files(files)
+    assert sorted(shuffle_files(files)) == files
+    assert files == list(range(100))
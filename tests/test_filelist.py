@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from codeprep.dirutils import walk_and_save
+from codeprep.filelist import FileListWriter, FileList, read_file_list, count_files_in_list, is_binary_file_list
+
+PATHS = [b'./a.java', 'src/über.java'.encode(), b'src/with space.java', b'src/\xff\xfe.java']
+
+
+@pytest.fixture
+def file_list_path(tmp_path):
+    path = str(tmp_path / 'filelist')
+    with FileListWriter(path) as writer:
+        for p in PATHS:
+            writer.write(p)
+    return path
+
+
+def test_read(file_list_path):
+    file_list = FileList(file_list_path)
+
+    assert len(file_list) == len(PATHS)
+    assert list(file_list) == PATHS
+    assert file_list[-1] == PATHS[-1]
+    assert file_list[1:3] == PATHS[1:3]
+    assert file_list.total_bytes == sum(len(p) for p in PATHS)
+    with pytest.raises(IndexError):
+        file_list[len(PATHS)]
+    assert count_files_in_list(file_list_path) == len(PATHS)
+
+
+def test_empty(tmp_path):
+    path = str(tmp_path / 'filelist')
+    with FileListWriter(path):
+        pass
+
+    assert len(FileList(path)) == 0
+    assert list(read_file_list(path)) == []
+
+
+def test_not_finished(tmp_path):
+    path = str(tmp_path / 'filelist')
+    with pytest.raises(KeyboardInterrupt):
+        with FileListWriter(path) as writer:
+            writer.write(b'a.java')
+            raise KeyboardInterrupt()
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_read_text_format(tmp_path):
+    path = str(tmp_path / 'filelist')
+    with open(path, 'w') as f:
+        for p in PATHS:
+            f.write(f'{p}\n')
+
+    assert not is_binary_file_list(path)
+    assert list(read_file_list(path)) == PATHS
+    assert count_files_in_list(path) == len(PATHS)
+
+
+def test_walk_and_save(tmp_path):
+    dataset = tmp_path / 'dataset'
+    os.makedirs(str(dataset / 'src'))
+    for file in ['a.java', os.path.join('src', 'b.java'), os.path.join('src', 'c.py')]:
+        (dataset / file).write_text('')
+    dir_list, file_list = str(tmp_path / 'dirlist'), str(tmp_path / 'filelist')
+
+    walked = list(walk_and_save(str(dataset), dir_list, file_list, False, ['java']))
+
+    assert sorted(walked) == [b'./a.java', b'src/b.java']
+    assert list(read_file_list(file_list)) == walked
+    assert list(read_file_list(dir_list)) == [b'./src']
+
+
+def test_walk_and_save_symlinks(tmp_path):
+    dataset = tmp_path / 'dataset'
+    os.makedirs(str(dataset / 'src' / 'main'))
+    os.makedirs(str(tmp_path / 'outside'))
+    for file in [os.path.join('src', 'main', 'a.java'), os.path.join('..', 'outside', 'b.java')]:
+        (dataset / file).write_text('')
+    os.symlink(str(dataset / 'src'), str(dataset / 'src' / 'main' / 'loop'))
+    os.symlink(str(tmp_path / 'outside'), str(dataset / 'outside'))
+    os.symlink(str(dataset / 'src' / 'main' / 'a.java'), str(dataset / 'link.java'))
+    dir_list, file_list = str(tmp_path / 'dirlist'), str(tmp_path / 'filelist')
+
+    walked = list(walk_and_save(str(dataset), dir_list, file_list, False, ['java']))
+
+    assert sorted(walked) == [b'outside/b.java', b'src/main/a.java']
+    assert sorted(read_file_list(dir_list)) == [b'./outside', b'./src', b'src/main']
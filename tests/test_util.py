@@ -0,0 +1,51 @@
+# SPDX-FileCopyrightText: 2020 Hlib Babii <hlibbabii@gmail.com>
+#
+# SPDX-License-Identifier: Apache-2.0
+
+from multiprocessing.pool import Pool
+
+import pytest
+
+from codeprep.util import AtomicInteger, ProgressChannel, init_progress_channel, report_progress
+
+
+def _report_file_done(n_bytes: int) -> None:
+    report_progress(files=1, bytes=n_bytes)
+
+
+_counter = None
+
+
+def _init_counter(counter: AtomicInteger) -> None:
+    global _counter
+    _counter = counter
+
+
+def _inc_task(_) -> None:
+    for _ in range(100):
+        _counter.inc()
+
+
+def test_progress_channel_in_pool():
+    progress = ProgressChannel()
+    with Pool(2, initializer=init_progress_channel, initargs=(progress,)) as pool:
+        pool.map(_report_file_done, [10, 20, 30])
+
+    assert progress.snapshot() == {'files': 3, 'bytes': 60, 'tokens': 0, 'merges': 0, 'cache_hits': 0}
+
+
+def test_report_progress_outside_of_pool():
+    report_progress(files=1)
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError):
+        ProgressChannel().report(lines=1)
+
+
+def test_atomic_integer_in_pool():
+    counter = AtomicInteger()
+    with Pool(4, initializer=_init_counter, initargs=(counter,)) as pool:
+        pool.map(_inc_task, range(4))
+
+    assert counter.value == 400